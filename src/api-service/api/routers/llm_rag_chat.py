@@ -1,7 +1,10 @@
 import os
+import asyncio
+import traceback
 from fastapi import APIRouter, Header, Query, Body, HTTPException
-from fastapi.responses import FileResponse
-from typing import Dict, Any, List, Optional
+from fastapi.responses import FileResponse, StreamingResponse
+from typing import Dict, Any, List, Optional, AsyncIterator
+import json
 import uuid
 import time
 from datetime import datetime
@@ -9,18 +12,225 @@ import mimetypes
 from pathlib import Path
 from api.utils.llm_rag_utils import (
     chat_sessions,
+    attachments,
+    embedding_cache,
+    embedding_batcher,
+    answer_cache,
+    chroma,
+    vector_index,
+    retrieval_batcher,
+    refresh_vector_index,
+    context_packer,
+    marker_context,
+    embedding_model,
+    generative_model,
+    summary_model,
+    embedding_upstream,
+    chroma_upstream,
+    gemini_upstream,
     create_chat_session,
-    generate_chat_response,
+    lookup_cached_answer,
+    remember_answer,
+    start_cached_chat_session,
+    generate_chat_response_async,
+    generate_chat_response_stream,
     rebuild_chat_session,
+    summarize_chat_async,
+    interpret_panels_stream,
+    PANEL_BATCH_MAX_ROWS,
 )
 from api.utils.chat_utils import ChatHistoryManager
-import pandas as pd
+from api.utils.concurrency import run_blocking
+from api.utils.metrics import timed, detach_request_timings
+from api.utils.persistence import KeyedLocks, WriteBehindChatStore
+from api.utils.startup import WarmUp
+from api.utils.history_policy import (
+    split_turns,
+    summarized_turns,
+    turns_to_summarize,
+    needs_compaction,
+    estimate_history_tokens,
+)
 
 # Define Router
 router = APIRouter()
 
 # Initialize chat history manager and sessions
-chat_manager = ChatHistoryManager(model="llm-rag")
+chat_manager = ChatHistoryManager(model="llm-rag", attachments=attachments)
+# Chats are written behind the response; turns on the same chat are serialized
+chat_store = WriteBehindChatStore(chat_manager)
+chat_locks = KeyedLocks()
+# Background history compactions, one per chat
+compactions: Dict[str, asyncio.Task] = {}
+
+
+async def warm_up_knowledge_base() -> None:
+    """Resolve the knowledge base collection, then load the biomarker context for its version"""
+    await chroma.acollection()
+    await marker_context.refresh(chroma.version)
+
+
+async def warm_up_vector_index() -> None:
+    """Serve retrieval from the local replica, if enabled, and bring it up to date"""
+    if vector_index.enabled:
+        await run_blocking(vector_index.load)
+        refresh_vector_index()
+
+
+# Clients created in the background once the app is serving; the app is
+# ready when all of them are
+warm_up = WarmUp({
+    "embedding_model": embedding_model.aget,
+    "generative_model": generative_model.aget,
+    "summary_model": summary_model.aget,
+    "knowledge_base": warm_up_knowledge_base,
+    "vector_index": warm_up_vector_index,
+})
+
+# Headers for Server-Sent-Events responses; X-Accel-Buffering stops nginx from
+# holding back tokens until the response completes
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def chat_title(message: Dict) -> str:
+    """Derive a chat title from its first user message"""
+    title = message.get("content")
+    if title == "":
+        title = "Blood test interpretation chat"
+    return title[:50] + "..."
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Format a single Server-Sent-Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def load_chat_turn(chat_id: str, x_session_id: str):
+    """Load a chat and its (possibly rebuilt) session for a new turn"""
+    chat = await chat_store.get_chat(chat_id, x_session_id)
+    if not chat:
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    # Get or rebuild chat session
+    chat_session = chat_sessions.get(chat_id)
+    if not chat_session:
+        with timed("rebuild"):
+            chat_session = await run_blocking(rebuild_chat_session, chat["messages"], chat.get("summary"))
+        chat_sessions[chat_id] = chat_session
+        chat["compacted_turns"] = len(split_turns(chat["messages"]))
+
+    # Update timestamp
+    chat["dts"] = int(time.time())
+    return chat, chat_session
+
+
+async def save_turn(chat: Dict, chat_session, x_session_id: str) -> None:
+    """Save a chat after a turn with its history size, then compact its history in the background"""
+    chat["history_tokens"] = estimate_history_tokens(chat_session.history)
+    with timed("persist"):
+        await chat_store.save(chat, x_session_id)
+    chat_id = chat["chat_id"]
+    if chat_id not in compactions and needs_compaction(
+        chat["messages"], chat.get("summary"), chat.get("compacted_turns", 0)
+    ):
+        compactions[chat_id] = asyncio.create_task(compact_chat(chat_id, x_session_id))
+
+
+async def compact_chat(chat_id: str, x_session_id: str) -> None:
+    """
+    Apply the history policy to a chat's session: summarize the turns that
+    left the window, then replace the live session, which still carries every
+    turn's chunks, with one rebuilt from the stored messages and summary.
+    The summary is generated without holding the chat lock.
+    """
+    detach_request_timings()
+    try:
+        chat = await chat_store.get_chat(chat_id, x_session_id)
+        if chat is None:
+            return
+        turn_count = turns_to_summarize(len(split_turns(chat["messages"])), chat.get("summary"))
+        summary = await summarize_chat_async(chat, turn_count) if turn_count else None
+
+        async with chat_locks.hold(chat_id):
+            chat = await chat_store.get_chat(chat_id, x_session_id)
+            if summary and summarized_turns(summary) > summarized_turns(chat.get("summary")):
+                chat["summary"] = summary
+            with timed("rebuild"):
+                chat_session = await run_blocking(rebuild_chat_session, chat["messages"], chat.get("summary"))
+            chat["history_tokens"] = estimate_history_tokens(chat_session.history)
+            chat["compacted_turns"] = len(split_turns(chat["messages"]))
+            chat_sessions.put(chat_id, chat_session)
+            await chat_store.save(chat, x_session_id)
+    except Exception as e:
+        print(f"Error compacting chat {chat_id}: {str(e)}")
+        traceback.print_exc()
+    finally:
+        del compactions[chat_id]
+
+
+async def stream_chat_events(
+    chat_id: str, message: Dict, x_session_id: str, chat: Optional[Dict] = None, chat_session=None
+) -> AsyncIterator[str]:
+    """
+    Stream the assistant response for a user message as Server-Sent-Events.
+
+    Emits a 'chat' event first, a 'delta' event per generated chunk and a 'done'
+    event with the complete chat once it has been queued for saving. Failures
+    are reported with an 'error' event, and nothing is saved. Without a chat,
+    the existing chat is loaded while holding its lock; a new chat's first
+    message may be answered from the answer cache.
+    """
+    async with chat_locks.hold(chat_id):
+        try:
+            if chat is None:
+                chat, chat_session = await load_chat_turn(chat_id, x_session_id)
+        except HTTPException as e:
+            yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+            return
+
+        assistant_message = {
+            "message_id": str(uuid.uuid4()),
+            "role": "assistant",
+            "content": "",
+        }
+        yield sse_event(
+            "chat",
+            {
+                "chat_id": chat["chat_id"],
+                "title": chat.get("title"),
+                "dts": chat["dts"],
+                "message_id": assistant_message["message_id"],
+            },
+        )
+
+        # Only a new chat's first message may be answered from the cache
+        lookup = await lookup_cached_answer(message) if not chat["messages"] else None
+
+        chunks = []
+        try:
+            if lookup and lookup.cached:
+                chat_session = await start_cached_chat_session(message, lookup.cached.answer)
+                chunks.append(lookup.cached.answer)
+                yield sse_event("delta", {"content": lookup.cached.answer})
+            else:
+                async for text in generate_chat_response_stream(
+                    chat_session, message, lookup.query_embedding if lookup else None, chat["messages"]
+                ):
+                    chunks.append(text)
+                    yield sse_event("delta", {"content": text})
+        except HTTPException as e:
+            yield sse_event("error", {"status_code": e.status_code, "detail": e.detail})
+            return
+
+        # Save the complete exchange once the stream has finished
+        assistant_message["content"] = "".join(chunks)
+        remember_answer(lookup, message, assistant_message["content"])
+        chat["messages"].append(message)
+        chat["messages"].append(assistant_message)
+        await save_turn(chat, chat_session, x_session_id)
+        # Re-insert so the cache accounts for the longer history
+        chat_sessions.put(chat["chat_id"], chat_session)
+        yield sse_event("done", chat)
 
 
 @router.get("/chats")
@@ -29,7 +239,61 @@ async def get_chats(
 ):
     """Get all chats, optionally limited to a specific number"""
     print("x_session_id:", x_session_id)
-    return chat_manager.get_recent_chats(x_session_id, limit)
+    return await chat_store.get_recent_chats(x_session_id, limit)
+
+
+@router.get("/sessions/stats")
+async def get_session_cache_stats():
+    """Get hit, miss and eviction counters of the in-memory chat session cache"""
+    return chat_sessions.stats()
+
+
+@router.get("/embeddings/stats")
+async def get_embedding_cache_stats():
+    """Get hit-rate counters of the query embedding cache and the size of embedding batches"""
+    return {**embedding_cache.stats(), "batching": embedding_batcher.stats()}
+
+
+@router.get("/vector-db/health")
+async def get_vector_db_health():
+    """Check the connection to Chroma and the knowledge base collection"""
+    return await chroma.health()
+
+
+@router.get("/upstreams/stats")
+async def get_upstream_stats():
+    """Get retries, hedged calls and circuit breaker state of each upstream service"""
+    return {upstream.name: upstream.stats() for upstream in (embedding_upstream, chroma_upstream, gemini_upstream)}
+
+
+@router.get("/retrieval/stats")
+async def get_retrieval_stats():
+    """Get the size of batched retrievals and how many were served by an identical query in flight"""
+    return retrieval_batcher.stats()
+
+
+@router.get("/vector-index/stats")
+async def get_vector_index_stats():
+    """Get the state of the in-process replica of the knowledge base"""
+    return {**vector_index.stats(), "fresh": vector_index.is_fresh(chroma.version)}
+
+
+@router.get("/context/stats")
+async def get_context_packer_stats():
+    """Get how many retrieved chunks and tokens the context packer kept, and the state of the biomarker context cache"""
+    return {**context_packer.stats(), "marker_context": marker_context.stats()}
+
+
+@router.get("/files/stats")
+async def get_attachment_cache_stats():
+    """Get hit-rate counters of the parsed blood test file cache"""
+    return attachments.stats()
+
+
+@router.get("/answers/stats")
+async def get_answer_cache_stats():
+    """Get hit-rate counters of the first-turn answer cache"""
+    return answer_cache.stats()
 
 
 @router.get("/chats/{chat_id}")
@@ -38,7 +302,7 @@ async def get_chat(
 ):
     """Get a specific chat by ID"""
     print("x_session_id:", x_session_id)
-    chat = chat_manager.get_chat(chat_id, x_session_id)
+    chat = await chat_store.get_chat(chat_id, x_session_id)
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     return chat
@@ -54,25 +318,28 @@ async def start_chat_with_llm(
     chat_id = str(uuid.uuid4())
     current_time = int(time.time())
 
-    # Create a new chat session
-    chat_session = create_chat_session()
-    chat_sessions[chat_id] = chat_session
-
     # Add ID and role to the user message
     message["message_id"] = str(uuid.uuid4())
     message["role"] = "user"
 
-    # Generate response
-    assistant_response = generate_chat_response(chat_session, message)
+    # Answer common first questions from the cache when it is enabled
+    lookup = await lookup_cached_answer(message)
+    if lookup and lookup.cached:
+        assistant_response = lookup.cached.answer
+        chat_session = await start_cached_chat_session(message, assistant_response)
+    else:
+        # Create a new chat session and generate response
+        chat_session = await create_chat_session()
+        assistant_response = await generate_chat_response_async(
+            chat_session, message, lookup.query_embedding if lookup else None
+        )
+        remember_answer(lookup, message, assistant_response)
+    chat_sessions.put(chat_id, chat_session)
 
     # Create chat response
-    title = message.get("content")
-    if title == "":
-        title = "Blood test interpretation chat"
-    title = title[:50] + "..."
     chat_response = {
         "chat_id": chat_id,
-        "title": title,
+        "title": chat_title(message),
         "dts": current_time,
         "messages": [
             message,
@@ -85,10 +352,60 @@ async def start_chat_with_llm(
     }
 
     # Save chat
-    chat_manager.save_chat(chat_response, x_session_id)
+    await save_turn(chat_response, chat_session, x_session_id)
     return chat_response
 
 
+@router.post("/chats/stream")
+async def start_chat_with_llm_stream(
+    message: Dict, x_session_id: str = Header(None, alias="X-Session-ID")
+):
+    """Start a new chat and stream the assistant response as Server-Sent-Events"""
+    print("x_session_id:", x_session_id)
+    chat_id = str(uuid.uuid4())
+
+    # Create a new chat session
+    chat_session = await create_chat_session()
+    chat_sessions[chat_id] = chat_session
+
+    # Add ID and role to the user message
+    message["message_id"] = str(uuid.uuid4())
+    message["role"] = "user"
+
+    chat = {
+        "chat_id": chat_id,
+        "title": chat_title(message),
+        "dts": int(time.time()),
+        "messages": [],
+    }
+    return StreamingResponse(
+        stream_chat_events(chat_id, message, x_session_id, chat, chat_session),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+@router.post("/chats/{chat_id}/stream")
+async def continue_chat_with_llm_stream(
+    chat_id: str, message: Dict, x_session_id: str = Header(None, alias="X-Session-ID")
+):
+    """Add a message to an existing chat and stream the assistant response as Server-Sent-Events"""
+    print("x_session_id:", x_session_id)
+    if not await chat_store.get_chat(chat_id, x_session_id):
+        raise HTTPException(status_code=404, detail="Chat not found")
+
+    # Add message ID and role
+    message["message_id"] = str(uuid.uuid4())
+    message["role"] = "user"
+
+    # The chat is loaded again under its lock once the stream starts
+    return StreamingResponse(
+        stream_chat_events(chat_id, message, x_session_id),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
 @router.post("/chats/{chat_id}")
 async def continue_chat_with_llm(
     chat_id: str, message: Dict, x_session_id: str = Header(None, alias="X-Session-ID")
@@ -96,40 +413,54 @@ async def continue_chat_with_llm(
     print("content:", message["content"])
     print("x_session_id:", x_session_id)
     """Add a message to an existing chat"""
-    chat = chat_manager.get_chat(chat_id, x_session_id)
-    if not chat:
-        raise HTTPException(status_code=404, detail="Chat not found")
+    async with chat_locks.hold(chat_id):
+        chat, chat_session = await load_chat_turn(chat_id, x_session_id)
 
-    # Get or rebuild chat session
-    chat_session = chat_sessions.get(chat_id)
-    if not chat_session:
-        chat_session = rebuild_chat_session(chat["messages"])
-        chat_sessions[chat_id] = chat_session
+        # Add message ID and role
+        message["message_id"] = str(uuid.uuid4())
+        message["role"] = "user"
 
-    # Update timestamp
-    current_time = int(time.time())
-    chat["dts"] = current_time
+        # Generate response
+        assistant_response = await generate_chat_response_async(chat_session, message, chat_messages=chat["messages"])
+        chat_sessions.put(chat_id, chat_session)
 
-    # Add message ID and role
-    message["message_id"] = str(uuid.uuid4())
-    message["role"] = "user"
+        # Add messages
+        chat["messages"].append(message)
+        chat["messages"].append(
+            {
+                "message_id": str(uuid.uuid4()),
+                "role": "assistant",
+                "content": assistant_response,
+            }
+        )
 
-    # Generate response
-    assistant_response = generate_chat_response(chat_session, message)
+        # Save updated chat
+        await save_turn(chat, chat_session, x_session_id)
+    return chat
 
-    # Add messages
-    chat["messages"].append(message)
-    chat["messages"].append(
-        {
-            "message_id": str(uuid.uuid4()),
-            "role": "assistant",
-            "content": assistant_response,
-        }
-    )
 
-    # Save updated chat
-    chat_manager.save_chat(chat, x_session_id)
-    return chat
+@router.post("/panels/interpret")
+async def interpret_panels(request: Dict):
+    """
+    Interpret a multi-row blood test csv, one panel per row, streaming one
+    JSON result per line (NDJSON) as each row finishes, then a summary line.
+    """
+    panels = request.get("file")
+    if not isinstance(panels, list) or not panels or not all(isinstance(panel, dict) for panel in panels):
+        raise HTTPException(status_code=400, detail="Request must contain 'file' with at least one csv row")
+    if len(panels) > PANEL_BATCH_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {PANEL_BATCH_MAX_ROWS} rows per request")
+
+    async def results() -> AsyncIterator[str]:
+        failed = 0
+        async for result in interpret_panels_stream(panels, request.get("content")):
+            failed += result["status"] != "ok"
+            yield json.dumps(result, ensure_ascii=False, default=str) + "\n"
+        yield json.dumps({"done": True, "rows": len(panels), "failed": failed}) + "\n"
+
+    return StreamingResponse(
+        results(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"}
+    )
 
 
 @router.get("/files/{chat_id}/{message_id}.csv")
@@ -142,13 +473,13 @@ async def get_chat_file(chat_id: str, message_id: str):
         message_id: The message ID
 
     Returns:
-        FileResponse: The csv file with appropriate content type
+        List[Dict]: The csv rows
     """
     try:
         # Construct the file path
         file_path = os.path.join(chat_manager.files_dir, chat_id, f"{message_id}.csv")
 
-        # Verify the path exists and is within the files directory
+        # Verify the path is within the files directory
         file_path = Path(file_path).resolve()
         files_dir = Path(chat_manager.files_dir).resolve()
 
@@ -156,20 +487,17 @@ async def get_chat_file(chat_id: str, message_id: str):
         if not str(file_path).startswith(str(files_dir)):
             raise HTTPException(status_code=403, detail="Access denied")
 
-        if not file_path.exists():
-            raise HTTPException(status_code=404, detail="File not found")
-
-        # Read CSV file into pandas DataFrame
-        df = pd.read_csv(file_path)
-
-        # Convert DataFrame to list of dictionaries
-        data = df.to_dict("records")
+        # Serve the parsed rows from the cache, reading the file only on a miss
+        relative_path = os.path.join("files", chat_id, f"{message_id}.csv")
+        data = attachments.cached(relative_path)
+        if data is None:
+            data = await run_blocking(attachments.load, relative_path)
         return data
 
-    except pd.errors.EmptyDataError:
-        raise HTTPException(status_code=400, detail="CSV file is empty")
-    except pd.errors.ParserError:
-        raise HTTPException(status_code=400, detail="Invalid CSV format")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
@@ -1,9 +1,38 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
 from starlette.middleware.cors import CORSMiddleware
 from api.routers import llm_rag_chat
+from api.utils.concurrency import shutdown_executor
+from api.utils.metrics import ServerTimingMiddleware, render_metrics
+from api.utils.admission import AdmissionController, AdmissionMiddleware, SessionRateLimiter
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create the model and Chroma clients in parallel without delaying startup;
+    # /readyz reports when they are all up
+    llm_rag_chat.warm_up.start()
+    yield
+    await llm_rag_chat.warm_up.stop()
+    # Let history compactions finish and write out queued chats, then let
+    # in-flight blocking calls finish
+    await asyncio.gather(*list(llm_rag_chat.compactions.values()), return_exceptions=True)
+    await llm_rag_chat.chat_store.flush()
+    shutdown_executor()
+    llm_rag_chat.chat_manager.store.close()
+    llm_rag_chat.embedding_cache.close()
+
 
 # Setup FastAPI app
-app = FastAPI(title="API Server", description="API Server", version="v1")
+app = FastAPI(title="API Server", description="API Server", version="v1", lifespan=lifespan)
+
+# Limit generation requests per session and in total; overflow gets a 429
+# with Retry-After (inside CORS so browsers can read it)
+admission = AdmissionController()
+rate_limiter = SessionRateLimiter()
+app.add_middleware(AdmissionMiddleware, controller=admission, rate_limiter=rate_limiter)
 
 # Enable CORSMiddleware
 app.add_middleware(
@@ -12,13 +41,42 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After"],
 )
 
+# Report the time spent in each pipeline stage with every response
+app.add_middleware(ServerTimingMiddleware)
+
 
 # Routes
 @app.get("/")
 async def get_index():
     return {"message": "Welcome to Bloodwise"}
 
+
+@app.get("/healthz")
+async def get_liveness():
+    """Liveness: the process is serving requests"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def get_readiness():
+    """Readiness: the model and Chroma clients are up; 503 with the warm-up status until then"""
+    status = llm_rag_chat.warm_up.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/admission/stats")
+async def get_admission_stats():
+    """Get the in-flight and queued generation requests, and how many were rejected"""
+    return {**admission.stats(), "rate_limit": rate_limiter.stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Stage latency histograms and model token counters in the Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Additional routers here
 app.include_router(llm_rag_chat.router, prefix="/llm-rag")
@@ -0,0 +1,282 @@
+import os
+import math
+import time
+import asyncio
+import threading
+import contextlib
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, Optional, Tuple
+from starlette.responses import JSONResponse
+from api.utils.metrics import observe_stage, admission_in_flight, admission_queue_depth, admission_rejections
+
+# Generation requests handled at once per worker, and how many may wait for a slot
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("ADMISSION_MAX_CONCURRENT", "32"))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "64"))
+# How long a queued request waits for a slot before it is rejected
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+# Generation requests per X-Session-ID: sustained rate and burst (0 disables the limit)
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "10"))
+RATE_LIMIT_MAX_SESSIONS = int(os.environ.get("RATE_LIMIT_MAX_SESSIONS", "10000"))
+
+
+class Rejected(Exception):
+    """A request turned away by admission control, with the seconds to wait before retrying"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Global limit on concurrent generation requests, with a bounded FIFO queue.
+
+    A request runs at once while fewer than max_concurrent are running,
+    otherwise it waits in the queue for up to queue_timeout seconds. When the
+    queue is full, or the wait times out, it is rejected immediately with an
+    estimate of when a slot frees up, instead of piling more load on Vertex AI.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        # Moving average of how long a request holds its slot
+        self._hold_seconds = 1.0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "queue_timeout": 0}
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> float:
+        """Estimated seconds until a newly queued request would get a slot"""
+        return self._hold_seconds * (self.queue_depth + 1) / max(1, self.max_concurrent)
+
+    def _reject(self, reason: str) -> Rejected:
+        self.rejected[reason] += 1
+        admission_rejections.inc(reason=reason)
+        return Rejected(reason, self.retry_after())
+
+    def _update_gauges(self) -> None:
+        admission_in_flight.set(self.in_flight)
+        admission_queue_depth.set(self.queue_depth)
+
+    async def acquire(self) -> None:
+        """
+        Take a slot, waiting in the queue if needed.
+
+        Raises:
+            Rejected: The queue is full or the wait timed out
+        """
+        if self.in_flight < self.max_concurrent and not self.queue_depth:
+            self.in_flight += 1
+            self.admitted += 1
+            self._update_gauges()
+            return
+        if self.queue_depth >= self.max_queue:
+            raise self._reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        self._update_gauges()
+        start = time.perf_counter()
+        try:
+            # release() hands its slot over by resolving the future
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # release() may have dequeued the waiter in the same loop tick
+            with contextlib.suppress(ValueError):
+                self._waiters.remove(waiter)
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot as the wait timed out: pass it on
+                self.release()
+            raise self._reject("queue_timeout")
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif not waiter.cancelled():
+                # Cancelled after being handed a slot: pass it on
+                self.release()
+            raise
+        finally:
+            observe_stage("admission_wait", time.perf_counter() - start)
+            self._update_gauges()
+        self.admitted += 1
+
+    def release(self, held_seconds: Optional[float] = None) -> None:
+        """Give a slot back, handing it to the oldest queued request if there is one"""
+        if held_seconds is not None:
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held_seconds
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            # Skip waiters whose wait has timed out or been cancelled but not yet left the queue
+            if not waiter.done():
+                waiter.set_result(None)
+                self._update_gauges()
+                return
+        self.in_flight -= 1
+        self._update_gauges()
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": dict(self.rejected),
+            "hold_seconds": round(self._hold_seconds, 3),
+        }
+
+
+class SessionRateLimiter:
+    """
+    Token bucket per session: each session may send burst requests at once
+    and rate_per_minute on average. Buckets of the least recently seen
+    sessions are dropped beyond max_sessions (a dropped session starts full).
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float = RATE_LIMIT_PER_MINUTE,
+        burst: int = RATE_LIMIT_BURST,
+        max_sessions: int = RATE_LIMIT_MAX_SESSIONS,
+    ):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_sessions = max_sessions
+        # session -> (tokens, monotonic time of the last update), least recently seen first
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, session_id: str, now: Optional[float] = None) -> float:
+        """
+        Take a token from the session's bucket.
+
+        Returns:
+            float: 0 if the request may proceed, otherwise the seconds until a token is available
+        """
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(session_id, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._buckets[session_id] = (tokens - 1, now)
+                wait = 0.0
+                self.allowed += 1
+            else:
+                self._buckets[session_id] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+                self.limited += 1
+            self._buckets.move_to_end(session_id)
+            while len(self._buckets) > self.max_sessions:
+                self._buckets.popitem(last=False)
+        if wait:
+            admission_rejections.inc(reason="rate_limited")
+        return wait
+
+    def refund(self, session_id: str) -> None:
+        """Give back the token of a request that was turned away before it ran"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if session_id in self._buckets:
+                tokens, updated = self._buckets[session_id]
+                self._buckets[session_id] = (min(float(self.burst), tokens + 1), updated)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "rate_per_minute": self.rate * 60,
+                "burst": self.burst,
+                "sessions": len(self._buckets),
+                "allowed": self.allowed,
+                "limited": self.limited,
+            }
+
+
+def too_many_requests(detail: str, retry_after: float) -> JSONResponse:
+    """A 429 response telling the client when to retry, in whole seconds"""
+    return JSONResponse(
+        {"detail": detail},
+        status_code=429,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying the per-session rate limit and then admission
+    control to generation requests (POST requests under the given path
+    prefixes). The slot is held until the response, including a streamed
+    one, is complete; overflow gets an immediate 429 with Retry-After.
+    """
+
+    def __init__(
+        self,
+        app,
+        controller: AdmissionController,
+        rate_limiter: SessionRateLimiter,
+        path_prefixes: Iterable[str] = ("/llm-rag/chats", "/llm-rag/panels/"),
+    ):
+        self.app = app
+        self.controller = controller
+        self.rate_limiter = rate_limiter
+        self.path_prefixes = tuple(path_prefixes)
+
+    def _session_id(self, scope) -> str:
+        for name, value in scope.get("headers", []):
+            if name == b"x-session-id":
+                return value.decode("latin-1")
+        # Requests without a session are limited per client address
+        client = scope.get("client")
+        return f"client:{client[0]}" if client else "anonymous"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        session_id = self._session_id(scope)
+        wait = self.rate_limiter.acquire(session_id)
+        if wait:
+            response = too_many_requests("Too many requests for this session", wait)
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.controller.acquire()
+        except Rejected as e:
+            # The request never ran, so it does not count against the session's rate
+            self.rate_limiter.refund(session_id)
+            response = too_many_requests(f"Server is busy ({e.reason})", e.retry_after)
+            await response(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(time.perf_counter() - start)
@@ -0,0 +1,127 @@
+import os
+import time
+import threading
+import numpy as np
+from typing import Callable, Dict, List, Optional
+
+# The answer cache is opt-in
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "0") == "1"
+# Minimum cosine similarity between a new question and a cached one
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+
+class CachedAnswer:
+    """An answer to a first-turn question together with the chunks it was generated from"""
+
+    def __init__(self, question: str, answer: str, context: List[str], similarity: float = 1.0):
+        self.question = question
+        self.answer = answer
+        self.context = context
+        self.similarity = similarity
+
+
+class SemanticAnswerCache:
+    """
+    Cache of answers to first-turn questions, looked up by embedding similarity.
+
+    A lookup returns the answer of the most similar cached question when its
+    cosine similarity is at least the threshold. Entries expire after
+    ttl_seconds, and all entries are dropped when the knowledge base collection
+    version changes, since their answers were grounded on the old chunks.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = ANSWER_CACHE_ENABLED,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self.version: Optional[str] = None
+        self._entries: List[CachedAnswer] = []
+        self._created: List[float] = []
+        # Unit-normalized question embeddings, one row per entry
+        self._matrix: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_version(self, version: str) -> None:
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries, self._created, self._matrix = [], [], None
+            self.version = version
+
+    def _drop_expired(self) -> None:
+        if not self.ttl_seconds or not self._created:
+            return
+        cutoff = self.clock() - self.ttl_seconds
+        keep = [i for i, created in enumerate(self._created) if created >= cutoff]
+        if len(keep) < len(self._created):
+            self._entries = [self._entries[i] for i in keep]
+            self._created = [self._created[i] for i in keep]
+            self._matrix = self._matrix[keep] if keep else None
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: List[float], version: str) -> Optional[CachedAnswer]:
+        """Find the cached answer whose question is most similar to the query, above the threshold"""
+        with self._lock:
+            self._check_version(version)
+            self._drop_expired()
+            if self._matrix is None:
+                self.misses += 1
+                return None
+
+            similarities = self._matrix @ self._unit(embedding)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry = self._entries[best]
+            return CachedAnswer(entry.question, entry.answer, entry.context, float(similarities[best]))
+
+    def store(self, embedding: List[float], version: str, question: str, answer: str, context: List[str]) -> None:
+        """Cache the answer to a first-turn question"""
+        with self._lock:
+            self._check_version(version)
+            row = self._unit(embedding)[np.newaxis, :]
+            self._entries.append(CachedAnswer(question, answer, context))
+            self._created.append(self.clock())
+            self._matrix = row if self._matrix is None else np.vstack([self._matrix, row])
+            # Drop the oldest entries beyond capacity
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                self._entries = self._entries[overflow:]
+                self._created = self._created[overflow:]
+                self._matrix = self._matrix[overflow:]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "version": self.version,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,205 @@
+import os
+import csv
+import json
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from api.utils.history_store import atomic_write
+
+# Parsed attachments kept in memory
+ATTACHMENT_CACHE_MAX_ENTRIES = int(os.environ.get("ATTACHMENT_CACHE_MAX_ENTRIES", "256"))
+
+# Suffix of the stored panel next to the csv path messages refer to
+PANEL_SUFFIX = ".panel.json"
+
+
+def parse_cell(value: str) -> Any:
+    """Type a csv cell the way it was uploaded: int, float, text, or None when empty"""
+    if value == "":
+        return None
+    for parse in (int, float):
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    return value
+
+
+def clean_value(value: Any) -> Any:
+    """Replace NaN, which is not valid JSON, with None"""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def encode_panel(rows: List[Dict]) -> str:
+    """Store rows column names once, with their values as typed JSON"""
+    columns: List[str] = []
+    for row in rows:
+        for column in row:
+            if column not in columns:
+                columns.append(column)
+    return json.dumps(
+        {"columns": columns, "rows": [[clean_value(row.get(column)) for column in columns] for row in rows]},
+        separators=(",", ":"),
+    )
+
+
+def decode_panel(data: str) -> List[Dict]:
+    panel = json.loads(data)
+    columns = panel["columns"]
+    return [dict(zip(columns, values)) for values in panel["rows"]]
+
+
+def read_csv_rows(filepath: str) -> List[Dict]:
+    """Read a csv saved before panels were stored in the compact format"""
+    with open(filepath, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            raise ValueError("CSV file is empty")
+        rows = []
+        for values in reader:
+            if len(values) != len(header):
+                raise ValueError("Invalid CSV format")
+            rows.append({column: parse_cell(value) for column, value in zip(header, values)})
+        return rows
+
+
+class AttachmentStore:
+    """
+    Blood test files of a chat history, with an LRU cache of parsed panels.
+
+    Messages refer to a file by its csv path relative to the history root
+    (files/<chat_id>/<message_id>.csv). The rows are stored next to it as
+    <message_id>.panel.json: column names once and typed values, so loading
+    is a JSON parse. Files saved as csv by earlier versions are still read.
+    Cached panels are keyed by path and checked against the file's mtime, and
+    are shared between callers, who must not modify them. Staged panels are
+    served from memory until write_staged() has stored them.
+    """
+
+    def __init__(self, root: str, max_entries: int = ATTACHMENT_CACHE_MAX_ENTRIES):
+        self.root = root
+        self.max_entries = max_entries
+        # path -> (mtime_ns, rows), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # path -> (chat_id, message_id, rows) accepted by stage() and not written yet
+        self._staged: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def resolve(self, relative_path: str) -> str:
+        """Path of the file holding an attachment's rows: the stored panel, else a legacy csv"""
+        full_path = os.path.join(self.root, relative_path)
+        panel_path = os.path.splitext(full_path)[0] + PANEL_SUFFIX
+        return panel_path if os.path.exists(panel_path) else full_path
+
+    @staticmethod
+    def relative_path(chat_id: str, message_id: str) -> str:
+        return os.path.join("files", chat_id, f"{message_id}.csv")
+
+    def stage(self, chat_id: str, message_id: str, rows: List[Dict]) -> str:
+        """
+        Accept the rows of an uploaded csv without writing them; they are
+        readable at once and stored by write_staged().
+
+        Returns:
+            str: The csv path relative to the history root, as stored in the message
+        """
+        relative_path = self.relative_path(chat_id, message_id)
+        with self._lock:
+            self._staged[relative_path] = (chat_id, message_id, rows)
+        return relative_path
+
+    def write_staged(self, relative_path: str) -> None:
+        """Store an attachment accepted by stage(), if it has not been stored yet"""
+        with self._lock:
+            staged = self._staged.get(relative_path)
+        if staged is None:
+            return
+        self.save(*staged)
+        with self._lock:
+            self._staged.pop(relative_path, None)
+
+    def save(self, chat_id: str, message_id: str, rows: List[Dict]) -> str:
+        """
+        Store the rows of an uploaded csv.
+
+        Returns:
+            str: The csv path relative to the history root, as stored in the message
+        """
+        relative_path = self.relative_path(chat_id, message_id)
+        panel_path = os.path.splitext(os.path.join(self.root, relative_path))[0] + PANEL_SUFFIX
+        os.makedirs(os.path.dirname(panel_path), exist_ok=True)
+        data = encode_panel(rows)
+        atomic_write(panel_path, data)
+        self._put(relative_path, os.stat(panel_path).st_mtime_ns, decode_panel(data))
+        return relative_path
+
+    def cached(self, relative_path: str) -> Optional[List[Dict]]:
+        """The parsed rows if they are cached and the file has not changed since, without reading it"""
+        with self._lock:
+            staged = self._staged.get(relative_path)
+            if staged is not None:
+                self.hits += 1
+                return staged[2]
+        try:
+            mtime = os.stat(self.resolve(relative_path)).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(relative_path)
+            if entry is None or entry[0] != mtime:
+                return None
+            self._entries.move_to_end(relative_path)
+            self.hits += 1
+            return entry[1]
+
+    def load(self, relative_path: str) -> List[Dict]:
+        """
+        Get the rows of an attachment, parsing the file only when it is not cached.
+
+        Raises:
+            FileNotFoundError: The attachment does not exist
+            ValueError: The file cannot be parsed
+        """
+        rows = self.cached(relative_path)
+        if rows is not None:
+            return rows
+
+        filepath = self.resolve(relative_path)
+        mtime = os.stat(filepath).st_mtime_ns
+        if filepath.endswith(PANEL_SUFFIX):
+            with open(filepath, encoding="utf-8") as f:
+                rows = decode_panel(f.read())
+        else:
+            rows = read_csv_rows(filepath)
+        with self._lock:
+            self.misses += 1
+        self._put(relative_path, mtime, rows)
+        return rows
+
+    def _put(self, relative_path: str, mtime: int, rows: List[Dict]) -> None:
+        with self._lock:
+            self._entries[relative_path] = (mtime, rows)
+            self._entries.move_to_end(relative_path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "staged": len(self._staged),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
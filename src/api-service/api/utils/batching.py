@@ -0,0 +1,109 @@
+import asyncio
+import traceback
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+
+class MicroBatcher:
+    """
+    Collect concurrent calls into batches for an async function taking a list.
+
+    submit() queues an item and waits for its result. A batch is sent when
+    max_batch_size items are queued or max_wait_seconds after its first item,
+    whichever comes first. Calls are single-flight: an item whose key is
+    already queued or in flight waits for that result instead of being sent
+    again. If the batch call fails, every caller waiting on it gets the
+    exception; if it is cancelled, so are they.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int,
+        max_wait_seconds: float,
+        key: Callable[[Any], Hashable] = lambda item: item,
+    ):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.key = key
+        self._pending: List[Tuple[Hashable, Any, asyncio.Future]] = []
+        # key -> result of an item queued or in flight
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+        self.deduplicated = 0
+        self.largest_batch = 0
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        key = self.key(item)
+        self.items += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            self.deduplicated += 1
+        else:
+            future = self._inflight[key] = loop.create_future()
+            self._pending.append((key, item, future))
+            if len(self._pending) >= self.max_batch_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.max_wait_seconds, self._flush)
+        # Shielded so a cancelled caller does not cancel the result others wait for
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[Hashable, Any, asyncio.Future]]) -> None:
+        items = [item for _, item, _ in batch]
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(items))
+
+        try:
+            results = await self.fn(items)
+            if len(results) != len(items):
+                raise ValueError(f"Batch returned {len(results)} results for {len(items)} items")
+        except asyncio.CancelledError:
+            # Release the keys, or later calls with them would wait on this batch forever
+            for key, _, future in batch:
+                self._release(key, future)
+                future.cancel()
+            raise
+        except Exception as e:
+            print(f"Error in batch of {len(items)}: {str(e)}")
+            traceback.print_exc()
+            results = None
+            error = e
+
+        for index, (key, _, future) in enumerate(batch):
+            self._release(key, future)
+            if results is None:
+                future.set_exception(error)
+                # Callers that were cancelled no longer retrieve it
+                future.exception()
+            else:
+                future.set_result(results[index])
+
+    def _release(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    def stats(self) -> Dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_seconds": self.max_wait_seconds,
+            "batches": self.batches,
+            "items": self.items,
+            "deduplicated": self.deduplicated,
+            "largest_batch": self.largest_batch,
+            "average_batch": (self.items - self.deduplicated) / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,136 @@
+import math
+import numpy as np
+from typing import Any, Dict, List, Optional
+
+LOW = "low"
+NORMAL = "normal"
+HIGH = "high"
+UNKNOWN = "unknown"
+
+
+class BiomarkerRange:
+    """Reference range of a blood test biomarker"""
+
+    def __init__(self, name: str, definition: str, low: float, high: float, unit: str):
+        self.name = name
+        self.definition = definition
+        self.low = low
+        self.high = high
+        self.unit = unit
+
+    def describe_range(self) -> str:
+        return f"{self.low:g} to {self.high:g} {self.unit}"
+
+
+# Complete blood count reference ranges, compiled once
+BIOMARKERS = [
+    BiomarkerRange("WBC", "White Blood Cell", 4.0, 10.0, "10^9/L"),
+    BiomarkerRange("LYMp", "Lymphocytes percentage, which is a type of white blood cell", 20.0, 40.0, "%"),
+    BiomarkerRange("MIDp", "Indicates the percentage combined value of the other types of white blood cells not classified as lymphocytes or granulocytes", 1.0, 15.0, "%"),
+    BiomarkerRange("NEUTp", "Neutrophils are a type of white blood cell (leukocytes); neutrophils percentage", 50.0, 70.0, "%"),
+    BiomarkerRange("LYMn", "Lymphocytes number are a type of white blood cell", 0.6, 4.1, "10^9/L"),
+    BiomarkerRange("MIDn", "Indicates the combined number of other white blood cells not classified as lymphocytes or granulocytes", 0.1, 1.8, "10^9/L"),
+    BiomarkerRange("NEUTn", "Neutrophils Number", 2.0, 7.8, "10^9/L"),
+    BiomarkerRange("RBC", "Red Blood Cell", 3.50, 5.50, "10^12/L"),
+    BiomarkerRange("HGB", "Hemoglobin", 11.0, 16.0, "g/dL"),
+    BiomarkerRange("HCT", "Hematocrit is the proportion, by volume, of the Blood that consists of red blood cells", 36.0, 48.0, "%"),
+    BiomarkerRange("MCV", "Mean Corpuscular Volume", 80.0, 99.0, "fL"),
+    BiomarkerRange("MCH", "Mean Corpuscular Hemoglobin is the average amount of haemoglobin in the average red cell", 26.0, 32.0, "pg"),
+    BiomarkerRange("MCHC", "Mean Corpuscular Hemoglobin Concentration", 32.0, 36.0, "g/dL"),
+    BiomarkerRange("RDWSD", "Red Blood Cell Distribution Width", 37.0, 54.0, "fL"),
+    BiomarkerRange("RDWCV", "Red blood cell distribution width", 11.5, 14.5, "%"),
+    BiomarkerRange("PLT", "Platelet Count", 100, 400, "10^9/L"),
+    BiomarkerRange("MPV", "Mean Platelet Volume", 7.4, 10.4, "fL"),
+    BiomarkerRange("PDW", "Red Cell Distribution Width", 10.0, 17.0, "%"),
+    BiomarkerRange("PCT", "The level of Procalcitonin in the Blood", 0.10, 0.28, "%"),
+    BiomarkerRange("PLCR", "Platelet Large Cell Ratio", 13.0, 43.0, "%"),
+]
+BIOMARKER_INDEX = {biomarker.name: i for i, biomarker in enumerate(BIOMARKERS)}
+LOW_BOUNDS = np.array([biomarker.low for biomarker in BIOMARKERS], dtype=np.float64)
+HIGH_BOUNDS = np.array([biomarker.high for biomarker in BIOMARKERS], dtype=np.float64)
+
+# Columns that identify a panel rather than measure anything
+NON_MEASUREMENT_COLUMNS = {"ID"}
+
+
+def to_number(value: Any) -> float:
+    """Parse a csv cell as a number, NaN when it is not one"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def classify(markers: List[str], values: np.ndarray) -> np.ndarray:
+    """
+    Classify biomarker values against their reference ranges.
+
+    Args:
+        markers: Known biomarker names, one per column of values
+        values: Array of shape (panels, markers); NaN for missing values
+
+    Returns:
+        np.ndarray: The status (low, normal, high or unknown) of each value
+    """
+    columns = np.array([BIOMARKER_INDEX[marker] for marker in markers], dtype=int)
+    values = np.asarray(values, dtype=np.float64).reshape(-1, len(columns))
+    status = np.full(values.shape, NORMAL, dtype=object)
+    status[values < LOW_BOUNDS[columns]] = LOW
+    status[values > HIGH_BOUNDS[columns]] = HIGH
+    status[np.isnan(values)] = UNKNOWN
+    return status
+
+
+def classify_panels(panels: List[Dict]) -> List[Dict[str, str]]:
+    """Classify every known biomarker of several panels (csv rows) in one pass"""
+    markers = [marker for marker in BIOMARKER_INDEX if any(marker in panel for panel in panels)]
+    if not markers:
+        return [{} for _ in panels]
+    values = np.array([[to_number(panel.get(marker)) for marker in markers] for panel in panels])
+    status = classify(markers, values)
+    return [
+        {marker: status[row][column] for column, marker in enumerate(markers) if marker in panels[row]}
+        for row in range(len(panels))
+    ]
+
+
+def build_panel_prompt(panel: Dict, status: Optional[Dict[str, str]] = None) -> str:
+    """
+    Summarize a blood test panel for the model. Values outside their reference
+    range come first with their definition and range; normal values and
+    unrecognized columns are listed compactly.
+
+    Args:
+        panel: A csv row
+        status: The panel's statuses from classify_panels, if already computed
+    """
+    if status is None:
+        status = classify_panels([panel])[0]
+    abnormal, normal, other = [], [], []
+    for marker, value in panel.items():
+        if marker in NON_MEASUREMENT_COLUMNS:
+            continue
+        marker_status = status.get(marker, UNKNOWN)
+        if marker_status == UNKNOWN:
+            other.append(f"{marker} {value}")
+            continue
+        biomarker = BIOMARKERS[BIOMARKER_INDEX[marker]]
+        if marker_status == NORMAL:
+            normal.append(f"{marker} {value}")
+        else:
+            abnormal.append(
+                f"- {marker} ({biomarker.definition}): {value} {biomarker.unit}, "
+                f"{marker_status.upper()} (normal range {biomarker.describe_range()})"
+            )
+
+    lines = []
+    if abnormal:
+        lines.append("Blood test values outside the normal range:")
+        lines.extend(abnormal)
+    elif normal:
+        lines.append("All recognized blood test values are within the normal range.")
+    if normal:
+        lines.append("Within the normal range: " + ", ".join(normal) + ".")
+    if other:
+        lines.append("Other values: " + ", ".join(other) + ".")
+    return "\n".join(lines) + "\n"
@@ -7,16 +7,51 @@ import glob
 import base64
 import traceback
 import io
-import pandas as pd
-        
+from api.utils.attachments import AttachmentStore
+from api.utils.history_store import (
+    HistoryStore,
+    JsonHistoryStore,
+    LogHistoryStore,
+    SQLiteHistoryStore,
+    atomic_write,
+    migrate_json_history,
+)
+
+# Chat storage backend: "sqlite" (default), "log" (append-only log per chat)
+# or "json" (one file per chat)
+CHAT_HISTORY_BACKEND = os.environ.get("CHAT_HISTORY_BACKEND", "sqlite")
+# Superseded chat records an append-only log may hold before it is compacted
+CHAT_LOG_COMPACT_AFTER = int(os.environ.get("CHAT_LOG_COMPACT_AFTER", "20"))
+
 class ChatHistoryManager:
-    def __init__(self, model, history_dir: str = "chat-history"):
+    def __init__(
+        self,
+        model,
+        history_dir: str = "chat-history",
+        backend: str = CHAT_HISTORY_BACKEND,
+        attachments: Optional[AttachmentStore] = None,
+    ):
         """Initialize the chat history manager with the specified directory"""
         self.model = model
         self.history_dir = os.path.join(history_dir, model)
         # self.images_dir = os.path.join(self.history_dir, "images")
         self.files_dir = os.path.join(self.history_dir, "files")
         self._ensure_directories()
+        self.store = self._create_store(backend)
+        # Uploaded csv files, shared with the code that reads them back
+        self.attachments = attachments or AttachmentStore(self.history_dir)
+
+    def _create_store(self, backend: str) -> HistoryStore:
+        """Create the chat storage backend, importing existing JSON chats into SQLite once"""
+        if backend == "json":
+            return JsonHistoryStore(self.history_dir)
+        if backend == "log":
+            return LogHistoryStore(self.history_dir, compact_after=CHAT_LOG_COMPACT_AFTER)
+        if backend == "sqlite":
+            store = SQLiteHistoryStore(os.path.join(self.history_dir, "chats.db"))
+            migrate_json_history(self.history_dir, store)
+            return store
+        raise ValueError(f"Unknown chat history backend: {backend}")
     
     def _ensure_directories(self) -> None:
         """Ensure the chat history directory exists"""
@@ -24,10 +59,6 @@ class ChatHistoryManager:
         os.makedirs(self.files_dir, exist_ok=True)
         # os.makedirs(self.images_dir, exist_ok=True)
     
-    def _get_chat_filepath(self, chat_id: str, session_id: str) -> str:
-        """Get the full file path for a chat JSON file"""
-        return os.path.join(self.history_dir, session_id, f"{chat_id}.json")
-
     def _save_file(self, chat_id: str, message_id: str, csv_data: list) -> str:
         """
         Save csv data to a file and return the relative path.
@@ -40,17 +71,9 @@ class ChatHistoryManager:
         Returns:
             str: Relative path to the saved image
         """
-        # Create chat-specific image directory
-        chat_files_dir = os.path.join(self.files_dir, chat_id)
-        os.makedirs(chat_files_dir, exist_ok=True)
-        
-        # Save csv to file
-        file_path = os.path.join(chat_files_dir, f"{message_id}.csv")
         try:
-            pd.DataFrame(csv_data).to_csv(file_path, index=False)
-            
-            # Return relative path from chat history root
-            return os.path.relpath(file_path, self.history_dir)
+            # Stored in the compact panel format; the path returned is the csv's
+            return self.attachments.save(chat_id, message_id, csv_data)
         except Exception as e:
             print(f"Error saving file: {str(e)}")
             traceback.print_exc()
@@ -66,25 +89,18 @@ class ChatHistoryManager:
         Returns:
             Optional[list]: csv data
         """
-        full_path = os.path.join(self.history_dir, relative_path)
         try:
-            if os.path.exists(full_path):
-                return pd.read_csv(full_path).to_dict(orient='records')
-                # with open(full_path, 'rb') as f:
-                #     image_bytes = f.read()
-                # return base64.b64encode(image_bytes).decode('utf-8')
+            return self.attachments.load(relative_path)
+        except FileNotFoundError:
+            pass
         except Exception as e:
             print(f"Error loading file: {str(e)}")
             traceback.print_exc()
         return None
 
     
-    def save_chat(self, chat_to_save: Dict, session_id: str) -> None:
-        """Save a chat to both memory and file, handling files separately"""
-        chat_dir = os.path.join(self.history_dir,session_id)
-        os.makedirs(chat_dir, exist_ok=True)
-        
-        # Process messages to save files separately
+    def save_files(self, chat_to_save: Dict) -> None:
+        """Save uploaded csv files separately, replacing them with their path in the messages"""
         for message in chat_to_save["messages"]:
             if "file" in message and message["file"] is not None:
                 #print("image:",message["image"])
@@ -97,23 +113,29 @@ class ChatHistoryManager:
                 if file_path:
                     message["file_path"] = file_path
                 del message["file"]
-            # if "image" in message and message["image"] is not None:
-            #     #print("image:",message["image"])
-            #     # Save image and replace with path
-            #     image_path = self._save_image(
-            #         chat_to_save["chat_id"],
-            #         message["message_id"],
-            #         message["image"]
-            #     )
-            #     if image_path:
-            #         message["image_path"] = image_path
-            #     del message["image"]
-        
+
+    def stage_files(self, chat_to_save: Dict) -> None:
+        """Like save_files, but the csv files are only written by write_files"""
+        for message in chat_to_save["messages"]:
+            if "file" in message and message["file"] is not None:
+                message["file_path"] = self.attachments.stage(
+                    chat_to_save["chat_id"], message["message_id"], message["file"]
+                )
+                del message["file"]
+
+    def write_files(self, chat_to_save: Dict) -> None:
+        """Write the csv files of a chat staged by stage_files"""
+        for message in chat_to_save["messages"]:
+            if message.get("file_path"):
+                self.attachments.write_staged(message["file_path"])
+
+    def save_chat(self, chat_to_save: Dict, session_id: str) -> None:
+        """Save a chat to the history store, handling files separately"""
+        self.save_files(chat_to_save)
+
         # Save chat data
-        filepath = self._get_chat_filepath(chat_to_save["chat_id"], session_id)
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(chat_to_save, f, indent=2, ensure_ascii=False)    
+            self.store.save_chat(session_id, chat_to_save)
         except Exception as e:
             print(f"Error saving chat {chat_to_save['chat_id']}: {str(e)}")
             traceback.print_exc()
@@ -121,34 +143,13 @@ class ChatHistoryManager:
 
     def get_chat(self, chat_id: str, session_id: str) -> Optional[Dict]:
         """Get a specific chat by ID"""
-        filepath = os.path.join(self.history_dir,session_id,f"{chat_id}.json")
-        chat_data = {}
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                chat_data = json.load(f)        
+            return self.store.get_chat(session_id, chat_id)
         except Exception as e:
-            print(f"Error loading chat history from {filepath}: {str(e)}")
+            print(f"Error loading chat {chat_id}: {str(e)}")
             traceback.print_exc()
-        return chat_data
+        return None
     
     def get_recent_chats(self, session_id: str, limit: Optional[int] = None) -> List[Dict]:
         """Get recent chats, optionally limited to a specific number"""        
-        chat_dir = os.path.join(self.history_dir,session_id)
-        os.makedirs(chat_dir, exist_ok=True)
-        recent_chats = []
-        chat_files = glob.glob(os.path.join(chat_dir,"*.json"))
-        for filepath in chat_files:
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    chat_data = json.load(f)        
-                    recent_chats.append(chat_data)
-            except Exception as e:
-                print(f"Error loading chat history from {filepath}: {str(e)}")
-                traceback.print_exc()
-
-        # Sort by dts
-        recent_chats.sort(key=lambda x: x.get('dts', 0), reverse=True)
-        if limit:
-            return recent_chats[:limit]
-
-        return recent_chats
+        return self.store.list_chats(session_id, limit)
@@ -0,0 +1,145 @@
+import os
+import time
+import asyncio
+import threading
+import traceback
+from typing import Any, Dict, List, Optional
+
+# Requests to Chroma in flight per worker; bounds the keep-alive connections in use
+CHROMA_MAX_CONNECTIONS = int(os.environ.get("CHROMA_MAX_CONNECTIONS", "16"))
+# How often the collection is re-resolved by name to notice a rebuilt collection
+CHROMA_HEALTH_CHECK_SECONDS = float(os.environ.get("CHROMA_HEALTH_CHECK_SECONDS", "30"))
+
+
+class ChromaHandle:
+    """
+    Long-lived handle to the knowledge base collection.
+
+    The Chroma clients are created once and keep their HTTP connections alive,
+    and the collection is resolved once instead of per request, so a retrieval
+    costs a single round trip. `vector-db/cli.py --load` deletes and recreates
+    the collection under the same name with a new id; the handle re-resolves
+    the name every health_check_seconds, and when a query fails it re-resolves
+    and retries once if the collection was replaced.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: Any,
+        collection_name: str,
+        max_connections: int = CHROMA_MAX_CONNECTIONS,
+        health_check_seconds: float = CHROMA_HEALTH_CHECK_SECONDS,
+    ):
+        self.host = host
+        self.port = port
+        self.collection_name = collection_name
+        self.max_connections = max_connections
+        self.health_check_seconds = health_check_seconds
+        self._client = None
+        self._collection = None
+        self._async_client = None
+        self._async_collection = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._async_lock: Optional[asyncio.Lock] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.version: Optional[str] = None
+        self.reconnects = 0
+
+    def _set_version(self, collection) -> None:
+        version = str(collection.id)
+        if self.version is not None and version != self.version:
+            print(f"Collection '{self.collection_name}' was rebuilt: {self.version} -> {version}")
+            self.reconnects += 1
+        self.version = version
+        self._checked_at = time.monotonic()
+
+    def _stale(self) -> bool:
+        return time.monotonic() - self._checked_at > self.health_check_seconds
+
+    # Synchronous access
+
+    def collection(self, refresh: bool = False):
+        """Get the collection through the synchronous client"""
+        with self._lock:
+            if self._client is None:
+                # chromadb takes about a second to import; only load it when connecting
+                import chromadb
+                self._client = chromadb.HttpClient(host=self.host, port=self.port)
+            if refresh or self._collection is None or self._stale():
+                self._collection = self._client.get_collection(name=self.collection_name)
+                self._set_version(self._collection)
+            return self._collection
+
+    def query_sync(self, **kwargs) -> Dict:
+        """Query the collection, re-resolving it once if it was rebuilt"""
+        collection = self.collection()
+        try:
+            return collection.query(**kwargs)
+        except Exception:
+            if str(self.collection(refresh=True).id) == str(collection.id):
+                raise
+            return self._collection.query(**kwargs)
+
+    # Asynchronous access
+
+    async def acollection(self, refresh: bool = False):
+        """Get the collection through the async client"""
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            if self._async_client is None:
+                import chromadb
+                self._async_client = await chromadb.AsyncHttpClient(host=self.host, port=self.port)
+            if refresh or self._async_collection is None:
+                self._async_collection = await self._async_client.get_collection(name=self.collection_name)
+                self._set_version(self._async_collection)
+        self.refresh_if_stale()
+        return self._async_collection
+
+    def refresh_if_stale(self) -> None:
+        """Re-resolve the collection in the background once the last check is too old"""
+        if self._stale() and (self._refresh_task is None or self._refresh_task.done()):
+            # No request waits on the check
+            self._refresh_task = asyncio.create_task(self._background_refresh())
+
+    async def _background_refresh(self) -> None:
+        try:
+            await self.acollection(refresh=True)
+        except Exception as e:
+            print(f"Error refreshing collection '{self.collection_name}': {str(e)}")
+            # Back off until the next check instead of retrying on every request
+            self._checked_at = time.monotonic()
+
+    async def query(self, **kwargs) -> Dict:
+        """Query the collection in one round trip, re-resolving it once if it was rebuilt"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        async with self._semaphore:
+            collection = await self.acollection()
+            try:
+                return await collection.query(**kwargs)
+            except Exception:
+                refreshed = await self.acollection(refresh=True)
+                if str(refreshed.id) == str(collection.id):
+                    raise
+                return await refreshed.query(**kwargs)
+
+    async def health(self) -> Dict:
+        """Check that the server answers and the collection resolves"""
+        status = {"collection": self.collection_name, "version": self.version, "reconnects": self.reconnects}
+        try:
+            if self._async_client is None:
+                await self.acollection()
+            await self._async_client.heartbeat()
+            collection = await self.acollection(refresh=True)
+            status["count"] = await collection.count()
+            status["version"] = self.version
+            status["ok"] = True
+        except Exception as e:
+            traceback.print_exc()
+            status["ok"] = False
+            status["error"] = str(e)
+        return status
@@ -0,0 +1,59 @@
+import os
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+# Number of threads available for blocking calls (Chroma HTTP client, disk I/O)
+BLOCKING_MAX_WORKERS = int(os.environ.get("BLOCKING_MAX_WORKERS", "16"))
+# Number of upstream model calls (Vertex AI) allowed in flight per worker
+UPSTREAM_MAX_CONCURRENCY = int(os.environ.get("UPSTREAM_MAX_CONCURRENCY", "32"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_upstream_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Get the bounded executor used for blocking calls, creating it on first use"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=BLOCKING_MAX_WORKERS, thread_name_prefix="blocking"
+        )
+    return _executor
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """
+    Run a blocking callable on the bounded executor without stalling the event loop.
+
+    Args:
+        func: The blocking callable
+        *args, **kwargs: Arguments passed to the callable
+
+    Returns:
+        Any: The callable's return value
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+@asynccontextmanager
+async def upstream_slot():
+    """Hold one of the UPSTREAM_MAX_CONCURRENCY slots for an upstream call"""
+    global _upstream_semaphore
+    if _upstream_semaphore is None:
+        _upstream_semaphore = asyncio.Semaphore(UPSTREAM_MAX_CONCURRENCY)
+    async with _upstream_semaphore:
+        yield
+
+
+def shutdown_executor(wait: bool = True) -> None:
+    """Shut down the blocking executor, waiting for running calls by default"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait)
+        _executor = None
@@ -0,0 +1,148 @@
+import os
+import math
+import threading
+import numpy as np
+from typing import Dict, List, Optional
+
+# Chunks retrieved per question before packing
+CONTEXT_CANDIDATES = int(os.environ.get("CONTEXT_CANDIDATES", "10"))
+# Maximum number of chunks and estimated tokens sent with a question
+CONTEXT_MAX_CHUNKS = int(os.environ.get("CONTEXT_MAX_CHUNKS", "5"))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "2000"))
+# Chunks farther than this cosine distance from the question are dropped
+CONTEXT_MAX_DISTANCE = float(os.environ.get("CONTEXT_MAX_DISTANCE", "0.75"))
+# Chunks at least this similar to an already selected chunk are duplicates
+CONTEXT_DEDUP_THRESHOLD = float(os.environ.get("CONTEXT_DEDUP_THRESHOLD", "0.95"))
+# MMR trade-off between relevance (1.0) and diversity (0.0)
+CONTEXT_MMR_LAMBDA = float(os.environ.get("CONTEXT_MMR_LAMBDA", "0.7"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count (about four characters per token)"""
+    return math.ceil(len(text) / 4)
+
+
+class ContextPacker:
+    """
+    Select the retrieved chunks sent to the model with a question.
+
+    Chunks beyond max_distance are dropped. The rest are picked greedily by
+    maximal marginal relevance (relevance to the question, penalized by
+    similarity to chunks already picked); chunks that duplicate a picked one
+    are skipped, as are chunks that no longer fit in the token budget.
+    """
+
+    def __init__(
+        self,
+        max_chunks: int = CONTEXT_MAX_CHUNKS,
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        max_distance: float = CONTEXT_MAX_DISTANCE,
+        dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD,
+        mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+    ):
+        self.max_chunks = max_chunks
+        self.token_budget = token_budget
+        self.max_distance = max_distance
+        self.dedup_threshold = dedup_threshold
+        self.mmr_lambda = mmr_lambda
+        self._lock = threading.Lock()
+        self.packed = 0
+        self.chunks_in = 0
+        self.chunks_out = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.dropped_distance = 0
+        self.dropped_duplicate = 0
+
+    @staticmethod
+    def _similarities(embeddings) -> Optional[np.ndarray]:
+        if embeddings is None or len(embeddings) == 0:
+            return None
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix = matrix / norms
+        return matrix @ matrix.T
+
+    def pack(self, documents: List[str], distances: Optional[List[float]] = None, embeddings=None) -> List[str]:
+        """
+        Pack retrieved chunks into the context of a question.
+
+        Args:
+            documents: Retrieved chunks, nearest first
+            distances: Cosine distance of each chunk to the question
+            embeddings: Embedding of each chunk, used for deduplication and MMR
+
+        Returns:
+            List[str]: The selected chunks, in selection order
+        """
+        if distances is None:
+            distances = [0.0] * len(documents)
+        similarities = self._similarities(embeddings)
+
+        candidates = [i for i in range(len(documents)) if distances[i] <= self.max_distance]
+        dropped_distance = len(documents) - len(candidates)
+        dropped_duplicate = 0
+        selected: List[int] = []
+        seen_texts = set()
+        tokens = 0
+
+        while candidates and len(selected) < self.max_chunks:
+            def mmr(i: int) -> float:
+                relevance = 1.0 - distances[i]
+                if not selected or similarities is None:
+                    return relevance
+                redundancy = max(similarities[i][j] for j in selected)
+                return self.mmr_lambda * relevance - (1 - self.mmr_lambda) * redundancy
+
+            best = max(candidates, key=mmr)
+            candidates.remove(best)
+
+            text = " ".join(documents[best].split())
+            duplicate = text in seen_texts or (
+                similarities is not None
+                and any(similarities[best][j] >= self.dedup_threshold for j in selected)
+            )
+            if duplicate:
+                dropped_duplicate += 1
+                continue
+            cost = estimate_tokens(documents[best])
+            if tokens + cost > self.token_budget:
+                continue
+            selected.append(best)
+            seen_texts.add(text)
+            tokens += cost
+
+        with self._lock:
+            self.packed += 1
+            self.chunks_in += len(documents)
+            self.chunks_out += len(selected)
+            self.tokens_in += sum(estimate_tokens(document) for document in documents)
+            self.tokens_out += tokens
+            self.dropped_distance += dropped_distance
+            self.dropped_duplicate += dropped_duplicate
+        return [documents[i] for i in selected]
+
+    def pack_results(self, results: Dict) -> List[str]:
+        """Pack the first row of a collection.query result"""
+        embeddings = results.get("embeddings")
+        return self.pack(
+            results["documents"][0],
+            results["distances"][0] if results.get("distances") else None,
+            embeddings[0] if embeddings is not None else None,
+        )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "max_chunks": self.max_chunks,
+                "token_budget": self.token_budget,
+                "max_distance": self.max_distance,
+                "packed": self.packed,
+                "chunks_in": self.chunks_in,
+                "chunks_out": self.chunks_out,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "dropped_distance": self.dropped_distance,
+                "dropped_duplicate": self.dropped_duplicate,
+            }
@@ -0,0 +1,203 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import traceback
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+from api.utils.concurrency import run_blocking
+
+# In-memory capacity and lifetime of cached query embeddings
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "5000"))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.environ.get("EMBEDDING_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# SQLite file for the on-disk tier that survives restarts; disabled when empty
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", "")
+
+
+def normalize_query(text: str) -> str:
+    """Normalize query text so trivially different spellings share a cache entry"""
+    return " ".join(text.lower().split())
+
+
+class EmbeddingCache:
+    """
+    Cache of query embeddings keyed on normalized text, model name and dimension.
+
+    The memory tier is an LRU bounded by max_entries; vectors are kept as float32
+    arrays. The optional disk tier is a SQLite table that is consulted on a
+    memory miss and survives restarts. Entries older than ttl_seconds are
+    treated as missing in both tiers.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        dimension: Optional[int],
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = EMBEDDING_CACHE_TTL_SECONDS,
+        path: str = EMBEDDING_CACHE_PATH,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.model = model
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.clock = clock
+        # key -> (vector, created), least recently used first
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk: Optional[sqlite3.Connection] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path:
+            self._open_disk()
+
+    def _open_disk(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._disk = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, created REAL NOT NULL)"
+            )
+            if self.ttl_seconds:
+                with self._disk:
+                    self._disk.execute(
+                        "DELETE FROM embeddings WHERE created < ?",
+                        (self.clock() - self.ttl_seconds,),
+                    )
+        except Exception as e:
+            print(f"Error opening embedding cache {self.path}: {str(e)}")
+            traceback.print_exc()
+            self._disk = None
+
+    @property
+    def has_disk_tier(self) -> bool:
+        return self._disk is not None
+
+    def key(self, text: str) -> str:
+        raw = f"{self.model}|{self.dimension}|{normalize_query(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float) -> bool:
+        return bool(self.ttl_seconds) and self.clock() - created > self.ttl_seconds
+
+    def _remember(self, key: str, vector: array, created: float) -> None:
+        with self._lock:
+            self._memory[key] = (vector, created)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.evictions += 1
+
+    def get_memory(self, text: str) -> Optional[List[float]]:
+        """Look up the memory tier only; never blocks on disk"""
+        key = self.key(text)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._expired(entry[1]):
+                del self._memory[key]
+                entry = None
+            if entry is None:
+                return None
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return entry[0].tolist()
+
+    def get_disk(self, text: str) -> Optional[List[float]]:
+        """Look up the disk tier and promote a hit to memory"""
+        if self._disk is None:
+            return None
+        key = self.key(text)
+        try:
+            with self._disk_lock:
+                row = self._disk.execute(
+                    "SELECT vector, created FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+        except Exception as e:
+            print(f"Error reading embedding cache: {str(e)}")
+            return None
+        if row is None or self._expired(row[1]):
+            return None
+        vector = array("f")
+        vector.frombytes(row[0])
+        self._remember(key, vector, row[1])
+        with self._lock:
+            self.disk_hits += 1
+        return vector.tolist()
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """Look up both tiers, counting a miss when neither has the query"""
+        values = self.get_memory(text)
+        if values is None:
+            values = self.get_disk(text)
+        if values is None:
+            with self._lock:
+                self.misses += 1
+        return values
+
+    def put_memory(self, text: str, values: List[float]) -> None:
+        self._remember(self.key(text), array("f", values), self.clock())
+
+    def put_disk(self, text: str, values: List[float]) -> None:
+        if self._disk is None:
+            return
+        try:
+            with self._disk_lock, self._disk:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, created) VALUES (?, ?, ?)",
+                    (self.key(text), array("f", values).tobytes(), self.clock()),
+                )
+        except Exception as e:
+            print(f"Error writing embedding cache: {str(e)}")
+
+    def put(self, text: str, values: List[float]) -> None:
+        self.put_memory(text, values)
+        self.put_disk(text, values)
+
+    async def aget(self, text: str) -> Optional[List[float]]:
+        """Async lookup; only the disk tier runs on the blocking executor"""
+        values = self.get_memory(text)
+        if values is None and self.has_disk_tier:
+            values = await run_blocking(self.get_disk, text)
+        if values is None:
+            with self._lock:
+                self.misses += 1
+        return values
+
+    async def aput(self, text: str, values: List[float]) -> None:
+        """Async store; only the disk tier runs on the blocking executor"""
+        self.put_memory(text, values)
+        if self.has_disk_tier:
+            await run_blocking(self.put_disk, text, values)
+
+    def close(self) -> None:
+        if self._disk is not None:
+            with self._disk_lock:
+                self._disk.close()
+            self._disk = None
+
+    def stats(self) -> Dict:
+        """Get hit-rate counters and current usage"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "model": self.model,
+                "dimension": self.dimension,
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "disk_tier": self.has_disk_tier,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
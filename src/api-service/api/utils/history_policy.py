@@ -0,0 +1,82 @@
+import os
+from typing import Dict, List, Optional
+from api.utils.context_packer import estimate_tokens
+
+# Turns (a user message and its answer) sent verbatim; 0 sends the whole history
+HISTORY_KEEP_TURNS = int(os.environ.get("HISTORY_KEEP_TURNS", "6"))
+# Most recent turns that keep their retrieved chunks in the history
+HISTORY_CONTEXT_TURNS = int(os.environ.get("HISTORY_CONTEXT_TURNS", "1"))
+# Summarize the turns that leave the window instead of dropping them
+HISTORY_SUMMARY_ENABLED = os.environ.get("HISTORY_SUMMARY_ENABLED", "1") == "1"
+# Turns a live session may run past the policy before it is compacted
+HISTORY_COMPACT_SLACK_TURNS = int(os.environ.get("HISTORY_COMPACT_SLACK_TURNS", "3"))
+
+
+def split_turns(messages: List[Dict]) -> List[List[Dict]]:
+    """Group messages into turns, each starting with a user message"""
+    turns: List[List[Dict]] = []
+    for message in messages:
+        if message["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def summarized_turns(summary: Optional[Dict]) -> int:
+    return summary["turns"] if summary else 0
+
+
+def window_start(turn_count: int, summary: Optional[Dict]) -> int:
+    """
+    Index of the first turn sent verbatim. Turns before it are covered by the
+    summary; with summaries disabled they are dropped.
+    """
+    if not HISTORY_KEEP_TURNS:
+        return 0
+    if HISTORY_SUMMARY_ENABLED:
+        # Turns stay verbatim until the summary catches up with them
+        return summarized_turns(summary)
+    return max(0, turn_count - HISTORY_KEEP_TURNS)
+
+
+def turns_to_summarize(turn_count: int, summary: Optional[Dict]) -> int:
+    """Number of leading turns the summary should cover, 0 when it is up to date"""
+    if not HISTORY_KEEP_TURNS or not HISTORY_SUMMARY_ENABLED:
+        return 0
+    target = turn_count - HISTORY_KEEP_TURNS
+    return target if target > summarized_turns(summary) else 0
+
+
+def keeps_context(turn_index: int, turn_count: int) -> bool:
+    """Whether a turn's retrieved chunks are kept when its history is rebuilt"""
+    if not HISTORY_KEEP_TURNS:
+        return True
+    return turn_index >= turn_count - HISTORY_CONTEXT_TURNS
+
+
+def needs_compaction(messages: List[Dict], summary: Optional[Dict], compacted_turns: int = 0) -> bool:
+    """
+    Whether a live session has drifted far enough from the policy to be
+    compacted: more than HISTORY_COMPACT_SLACK_TURNS turns carry chunks the
+    policy would leave out, or lag behind the summary. compacted_turns is the
+    turn count when the session was last rebuilt, so a chat is compacted once
+    every few turns rather than after each one.
+    """
+    if not HISTORY_KEEP_TURNS:
+        return False
+    turn_count = len(split_turns(messages))
+    with_chunks = turn_count - max(compacted_turns, HISTORY_CONTEXT_TURNS)
+    unsummarized = max(0, turns_to_summarize(turn_count, summary) - summarized_turns(summary))
+    return max(with_chunks, unsummarized) > HISTORY_COMPACT_SLACK_TURNS
+
+
+def estimate_history_tokens(history) -> int:
+    """Approximate token count of a chat session's history (a list of Content)"""
+    tokens = 0
+    for content in history:
+        for part in content.parts:
+            try:
+                tokens += estimate_tokens(part.text)
+            except (AttributeError, ValueError):
+                pass
+    return tokens
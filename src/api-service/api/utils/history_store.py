@@ -0,0 +1,423 @@
+import os
+import glob
+import json
+import sqlite3
+import tempfile
+import threading
+import traceback
+from typing import Dict, List, Optional
+
+
+def atomic_write(filepath: str, data: str) -> None:
+    """
+    Write a file so readers and crashes only ever see the old or the new content:
+    write a temp file in the same directory, fsync it, then rename it over the target.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(filepath) or ".", prefix=".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class HistoryStore:
+    """Storage backend for chats, keyed by session ID and chat ID"""
+
+    def save_chat(self, session_id: str, chat: Dict) -> None:
+        raise NotImplementedError
+
+    def get_chat(self, session_id: str, chat_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def list_chats(self, session_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """List a session's chats, most recent (by dts) first"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class JsonHistoryStore(HistoryStore):
+    """One JSON file per chat under <history_dir>/<session_id>/<chat_id>.json"""
+
+    def __init__(self, history_dir: str):
+        self.history_dir = history_dir
+
+    def get_chat_filepath(self, session_id: str, chat_id: str) -> str:
+        """Get the full file path for a chat JSON file"""
+        return os.path.join(self.history_dir, session_id, f"{chat_id}.json")
+
+    def save_chat(self, session_id: str, chat: Dict) -> None:
+        os.makedirs(os.path.join(self.history_dir, session_id), exist_ok=True)
+        filepath = self.get_chat_filepath(session_id, chat["chat_id"])
+        atomic_write(filepath, json.dumps(chat, indent=2, ensure_ascii=False))
+
+    def get_chat(self, session_id: str, chat_id: str) -> Optional[Dict]:
+        filepath = self.get_chat_filepath(session_id, chat_id)
+        if not os.path.exists(filepath):
+            return None
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def list_chats(self, session_id: str, limit: Optional[int] = None) -> List[Dict]:
+        recent_chats = []
+        for filepath in glob.glob(os.path.join(self.history_dir, session_id, "*.json")):
+            try:
+                with open(filepath, 'r', encoding='utf-8') as f:
+                    recent_chats.append(json.load(f))
+            except Exception as e:
+                print(f"Error loading chat history from {filepath}: {str(e)}")
+                traceback.print_exc()
+
+        # Sort by dts
+        recent_chats.sort(key=lambda x: x.get('dts', 0), reverse=True)
+        if limit:
+            return recent_chats[:limit]
+        return recent_chats
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """
+    Chats in an embedded SQLite database.
+
+    Chats are indexed by (session_id, dts) so listing a session's recent chats
+    is an index range scan, and messages are stored one row per message so a
+    new turn only inserts the messages it added.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS chats (
+        session_id TEXT NOT NULL,
+        chat_id TEXT NOT NULL,
+        dts INTEGER NOT NULL DEFAULT 0,
+        data TEXT NOT NULL,
+        PRIMARY KEY (session_id, chat_id)
+    );
+    CREATE INDEX IF NOT EXISTS chats_session_dts ON chats (session_id, dts DESC);
+    CREATE TABLE IF NOT EXISTS messages (
+        session_id TEXT NOT NULL,
+        chat_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (session_id, chat_id, seq)
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        # One connection per thread; WAL lets readers run alongside a writer
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        conn = self._connection()
+        conn.executescript(self.SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def save_chat(self, session_id: str, chat: Dict) -> None:
+        chat_data = {key: value for key, value in chat.items() if key != "messages"}
+        messages = chat.get("messages", [])
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO chats (session_id, chat_id, dts, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (session_id, chat_id) DO UPDATE SET dts = excluded.dts, data = excluded.data",
+                (session_id, chat["chat_id"], chat.get("dts", 0), json.dumps(chat_data, ensure_ascii=False)),
+            )
+            # Messages are only ever appended, so only write the ones not stored yet
+            (stored,) = conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE session_id = ? AND chat_id = ?",
+                (session_id, chat["chat_id"]),
+            ).fetchone()
+            if stored > len(messages):
+                conn.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND chat_id = ? AND seq >= ?",
+                    (session_id, chat["chat_id"], len(messages)),
+                )
+                stored = len(messages)
+            conn.executemany(
+                "INSERT INTO messages (session_id, chat_id, seq, data) VALUES (?, ?, ?, ?)",
+                [
+                    (session_id, chat["chat_id"], seq, json.dumps(message, ensure_ascii=False))
+                    for seq, message in enumerate(messages[stored:], start=stored)
+                ],
+            )
+
+    def _messages(self, conn: sqlite3.Connection, session_id: str, chat_id: str) -> List[Dict]:
+        rows = conn.execute(
+            "SELECT data FROM messages WHERE session_id = ? AND chat_id = ? ORDER BY seq",
+            (session_id, chat_id),
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def get_chat(self, session_id: str, chat_id: str) -> Optional[Dict]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT data FROM chats WHERE session_id = ? AND chat_id = ?",
+            (session_id, chat_id),
+        ).fetchone()
+        if row is None:
+            return None
+        chat = json.loads(row[0])
+        chat["messages"] = self._messages(conn, session_id, chat_id)
+        return chat
+
+    def list_chats(self, session_id: str, limit: Optional[int] = None) -> List[Dict]:
+        conn = self._connection()
+        rows = conn.execute(
+            "SELECT chat_id, data FROM chats WHERE session_id = ? ORDER BY dts DESC LIMIT ?",
+            (session_id, limit if limit else -1),
+        ).fetchall()
+        chats = []
+        for chat_id, data in rows:
+            chat = json.loads(data)
+            chat["messages"] = self._messages(conn, session_id, chat_id)
+            chats.append(chat)
+        return chats
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+class LogHistoryStore(HistoryStore):
+    """
+    Append-only log per chat under <history_dir>/<session_id>/<chat_id>.jsonl.
+
+    Each line is either {"chat": {...}} with the chat's fields (title, dts, ...)
+    or {"message": {...}} with one message, so a turn only appends its new
+    messages and the updated chat fields. A chat is read back by replaying its
+    log; the last chat record wins. Once a log holds compact_after superseded
+    chat records it is rewritten as one chat record plus the messages.
+
+    Each session also has an append-only index.log of (chat_id, dts) records
+    used to list recent chats without opening every chat log. Chats still in
+    the one file per chat JSON layout are read as is and converted to a log on
+    their next save.
+    """
+
+    INDEX_FILE = "index.log"
+
+    def __init__(self, history_dir: str, compact_after: int = 20):
+        self.history_dir = history_dir
+        self.compact_after = compact_after
+        # (session_id, chat_id) -> [stored message count, superseded chat records]
+        self._log_state: Dict[tuple, list] = {}
+        # One lock per chat log and per session index, so chats don't serialize on each other
+        self._locks: Dict[tuple, threading.RLock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock_for(self, *key) -> threading.RLock:
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.RLock())
+
+    def get_log_filepath(self, session_id: str, chat_id: str) -> str:
+        return os.path.join(self.history_dir, session_id, f"{chat_id}.jsonl")
+
+    def _index_filepath(self, session_id: str) -> str:
+        return os.path.join(self.history_dir, session_id, self.INDEX_FILE)
+
+    @staticmethod
+    def _read_records(filepath: str) -> List[Dict]:
+        records = []
+        with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # A line torn by an interrupted append; later appends start on a new line
+                    continue
+        return records
+
+    @staticmethod
+    def _append_records(filepath: str, records: List[Dict]) -> None:
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with open(filepath, 'a+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    # Don't glue the records onto a torn last line
+                    lines = "\n" + lines
+            f.write(lines.encode('utf-8'))
+
+    @staticmethod
+    def _write_records(filepath: str, records: List[Dict]) -> None:
+        atomic_write(
+            filepath,
+            "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records),
+        )
+
+    def _replay(self, session_id: str, chat_id: str) -> Optional[Dict]:
+        filepath = self.get_log_filepath(session_id, chat_id)
+        if not os.path.exists(filepath):
+            return None
+        chat_data: Dict = {}
+        messages = []
+        superseded = -1
+        for record in self._read_records(filepath):
+            if "chat" in record:
+                chat_data = record["chat"]
+                superseded += 1
+            elif "message" in record:
+                messages.append(record["message"])
+        self._log_state[(session_id, chat_id)] = [len(messages), max(superseded, 0)]
+        chat_data["messages"] = messages
+        return chat_data
+
+    def save_chat(self, session_id: str, chat: Dict) -> None:
+        os.makedirs(os.path.join(self.history_dir, session_id), exist_ok=True)
+        key = (session_id, chat["chat_id"])
+        filepath = self.get_log_filepath(session_id, chat["chat_id"])
+        chat_data = {k: v for k, v in chat.items() if k != "messages"}
+        messages = chat.get("messages", [])
+
+        with self._lock_for(*key):
+            if key not in self._log_state:
+                self._replay(session_id, chat["chat_id"])
+            stored, superseded = self._log_state.get(key, [0, -1])
+
+            if stored > len(messages) or superseded + 1 >= self.compact_after:
+                # Compact: one chat record followed by every message
+                self._write_records(
+                    filepath,
+                    [{"chat": chat_data}] + [{"message": m} for m in messages],
+                )
+                self._log_state[key] = [len(messages), 0]
+            else:
+                self._append_records(
+                    filepath,
+                    [{"chat": chat_data}] + [{"message": m} for m in messages[stored:]],
+                )
+                self._log_state[key] = [len(messages), superseded + 1]
+
+        with self._lock_for(session_id):
+            if not os.path.exists(self._index_filepath(session_id)):
+                # Seed the index with the session's existing chats before the first record
+                self._rebuild_index(session_id)
+            self._append_records(
+                self._index_filepath(session_id),
+                [{"chat_id": chat["chat_id"], "dts": chat.get("dts", 0)}],
+            )
+
+    def get_chat(self, session_id: str, chat_id: str) -> Optional[Dict]:
+        with self._lock_for(session_id, chat_id):
+            chat = self._replay(session_id, chat_id)
+        if chat is None:
+            # Not converted from the one file per chat layout yet
+            chat = JsonHistoryStore(self.history_dir).get_chat(session_id, chat_id)
+        return chat
+
+    def _read_index(self, session_id: str) -> Dict[str, int]:
+        index_path = self._index_filepath(session_id)
+        if not os.path.exists(index_path):
+            self._rebuild_index(session_id)
+        latest: Dict[str, int] = {}
+        records = self._read_records(index_path) if os.path.exists(index_path) else []
+        for record in records:
+            latest[record["chat_id"]] = record["dts"]
+        # Compact the index once most of it is superseded
+        if len(records) > 2 * len(latest) + 100:
+            self._write_records(
+                index_path, [{"chat_id": c, "dts": d} for c, d in latest.items()]
+            )
+        return latest
+
+    def _rebuild_index(self, session_id: str) -> None:
+        session_dir = os.path.join(self.history_dir, session_id)
+        records = []
+        for filepath in glob.glob(os.path.join(session_dir, "*.json")) + glob.glob(
+            os.path.join(session_dir, "*.jsonl")
+        ):
+            chat_id = os.path.basename(filepath).rsplit(".", 1)[0]
+            chat = self.get_chat(session_id, chat_id)
+            if chat:
+                records.append({"chat_id": chat_id, "dts": chat.get("dts", 0)})
+        if records:
+            self._write_records(self._index_filepath(session_id), records)
+
+    def list_chats(self, session_id: str, limit: Optional[int] = None) -> List[Dict]:
+        with self._lock_for(session_id):
+            latest = self._read_index(session_id)
+        chat_ids = sorted(latest, key=lambda chat_id: latest[chat_id], reverse=True)
+        if limit:
+            chat_ids = chat_ids[:limit]
+        chats = []
+        for chat_id in chat_ids:
+            chat = self.get_chat(session_id, chat_id)
+            if chat:
+                chats.append(chat)
+        return chats
+
+
+def migrate_json_history(history_dir: str, store: SQLiteHistoryStore) -> int:
+    """
+    One-shot import of the <history_dir>/<session_id>/<chat_id>.json layout.
+
+    The JSON files are left in place. The migration is recorded in the store so
+    later calls return straight away.
+
+    Args:
+        history_dir: The model's chat history directory
+        store: The store to import into
+
+    Returns:
+        int: Number of chats imported
+    """
+    if store.get_meta("json_migrated"):
+        return 0
+
+    migrated = 0
+    for filepath in glob.glob(os.path.join(history_dir, "*", "*.json")):
+        session_id = os.path.basename(os.path.dirname(filepath))
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                chat = json.load(f)
+            if store.get_chat(session_id, chat["chat_id"]) is None:
+                store.save_chat(session_id, chat)
+                migrated += 1
+        except Exception as e:
+            print(f"Error migrating chat history from {filepath}: {str(e)}")
+            traceback.print_exc()
+
+    store.set_meta("json_migrated", "1")
+    if migrated:
+        print(f"Migrated {migrated} chats from {history_dir} into {store.db_path}")
+    return migrated
@@ -1,28 +1,71 @@
 import os
-from typing import Dict, Any, List, Optional
+import time
+import asyncio
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, AsyncIterator
 from fastapi import HTTPException
 import base64
 import io
 # from PIL import Image
 from pathlib import Path
 import traceback
-import chromadb
-import vertexai
-from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
-from vertexai.generative_models import GenerativeModel, SafetySetting, GenerationConfig, Content, Part, ToolConfig
-from vertexai.generative_models import GenerativeModel, ChatSession, Part
-import pandas as pd
+from api.utils.concurrency import run_blocking, upstream_slot
+from api.utils.session_cache import SessionCache
+from api.utils.embedding_cache import EmbeddingCache, normalize_query
+from api.utils.batching import MicroBatcher
+from api.utils.biomarkers import build_panel_prompt, classify_panels
+from api.utils.trends import build_trend_prompt
+from api.utils.attachments import AttachmentStore
+from api.utils.metrics import timed, observe_stage, record_usage, degraded_requests
+from api.utils.answer_cache import CachedAnswer, SemanticAnswerCache
+from api.utils.chroma_utils import ChromaHandle
+from api.utils.vector_index import VectorIndex, VECTOR_INDEX_PATH
+from api.utils.marker_context import MarkerContextCache
+from api.utils.context_packer import ContextPacker, CONTEXT_CANDIDATES
+from api.utils.history_policy import split_turns, window_start, keeps_context, summarized_turns
+from api.utils.startup import LazyResource
+from api.utils.resilience import (
+    Upstream,
+    Deadline,
+    CircuitOpen,
+    EMBED_TIMEOUT_SECONDS,
+    RETRIEVE_TIMEOUT_SECONDS,
+    REQUEST_DEADLINE_SECONDS,
+    GEMINI_SLOW_SECONDS,
+)
+# The Vertex AI SDK is imported when the models are first needed
+if TYPE_CHECKING:
+    from vertexai.generative_models import ChatSession, Content
 # Setup
 GCP_PROJECT = os.environ["GCP_PROJECT"]
 GCP_LOCATION = "us-central1"
 EMBEDDING_MODEL = "text-embedding-004"
 EMBEDDING_DIMENSION = 256
 GENERATIVE_MODEL = "gemini-1.5-flash-001"
+# Concurrent query embeddings are sent together, up to the API's 250 inputs per call
+EMBEDDING_BATCH_MAX_SIZE = int(os.environ.get("EMBEDDING_BATCH_MAX_SIZE", "250"))
+EMBEDDING_BATCH_WINDOW_MS = float(os.environ.get("EMBEDDING_BATCH_WINDOW_MS", "5"))
+# Concurrent retrievals are sent to Chroma as one multi-query request
+RETRIEVAL_BATCH_MAX_SIZE = int(os.environ.get("RETRIEVAL_BATCH_MAX_SIZE", "32"))
+RETRIEVAL_BATCH_WINDOW_MS = float(os.environ.get("RETRIEVAL_BATCH_WINDOW_MS", "2"))
+# Bulk panel interpretation: rows per request, rows interpreted at once and retries per row
+PANEL_BATCH_MAX_ROWS = int(os.environ.get("PANEL_BATCH_MAX_ROWS", "500"))
+PANEL_BATCH_CONCURRENCY = int(os.environ.get("PANEL_BATCH_CONCURRENCY", "8"))
+PANEL_BATCH_RETRIES = int(os.environ.get("PANEL_BATCH_RETRIES", "2"))
 CHROMADB_HOST = os.environ["CHROMADB_HOST"]
 CHROMADB_PORT = os.environ["CHROMADB_PORT"]
 
-vertexai.init(project=GCP_PROJECT, location=GCP_LOCATION)
-embedding_model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL)
+def _init_vertexai() -> None:
+	import vertexai
+	vertexai.init(project=GCP_PROJECT, location=GCP_LOCATION)
+
+def _load_embedding_model():
+	from vertexai.language_models import TextEmbeddingModel
+	vertex.get()
+	return TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL)
+
+# Vertex AI clients are created on first use or by the warm-up at startup
+vertex = LazyResource("vertexai", _init_vertexai)
+embedding_model = LazyResource("embedding_model", _load_embedding_model)
 
 # Configuration settings for the content generation
 generation_config = {
@@ -52,28 +95,56 @@ Remember:
 Your goal is to provide accurate, helpful information about blood test interpretation based solely on the content of the text chunks you receive with each query.
 """
 MODEL_ENDPOINT = "projects/595664810090/locations/us-central1/endpoints/3140012794393395200"
-generative_model = GenerativeModel(
-	MODEL_ENDPOINT,
-	system_instruction=[SYSTEM_INSTRUCTION]
-)
-safety_settings = [
-    SafetySetting(
-        category=SafetySetting.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-        threshold=SafetySetting.HarmBlockThreshold.BLOCK_ONLY_HIGH
-    ),
-    SafetySetting(
-        category=SafetySetting.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-        threshold=SafetySetting.HarmBlockThreshold.BLOCK_ONLY_HIGH
-    ),
-    SafetySetting(
-        category=SafetySetting.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-        threshold=SafetySetting.HarmBlockThreshold.BLOCK_ONLY_HIGH
-    ),
-    SafetySetting(
-        category=SafetySetting.HarmCategory.HARM_CATEGORY_HARASSMENT,
-        threshold=SafetySetting.HarmBlockThreshold.BLOCK_ONLY_HIGH
-    ),
-]
+def _load_generative_model():
+	from vertexai.generative_models import GenerativeModel
+	vertex.get()
+	return GenerativeModel(
+		MODEL_ENDPOINT,
+		system_instruction=[SYSTEM_INSTRUCTION]
+	)
+
+generative_model = LazyResource("generative_model", _load_generative_model)
+# Summarizes chat turns that leave the history window
+SUMMARY_INSTRUCTION = """
+Summarize the conversation between a user and a blood test assistant so it can replace the conversation in the assistant's context. Keep every blood test value the user shared, the questions they asked and the key points of the answers. Be concise and do not add information.
+"""
+# Model that writes the summaries; defaults to the chat model's endpoint
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", MODEL_ENDPOINT)
+def _load_summary_model():
+	from vertexai.generative_models import GenerativeModel
+	vertex.get()
+	return GenerativeModel(
+		SUMMARY_MODEL,
+		system_instruction=[SUMMARY_INSTRUCTION]
+	)
+
+summary_model = LazyResource("summary_model", _load_summary_model)
+summary_generation_config = {
+    "max_output_tokens": 1024,
+    "temperature": 0.0,
+}
+def _build_safety_settings() -> List:
+    from vertexai.generative_models import SafetySetting
+    return [
+        SafetySetting(
+            category=SafetySetting.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+            threshold=SafetySetting.HarmBlockThreshold.BLOCK_ONLY_HIGH
+        ),
+        SafetySetting(
+            category=SafetySetting.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+            threshold=SafetySetting.HarmBlockThreshold.BLOCK_ONLY_HIGH
+        ),
+        SafetySetting(
+            category=SafetySetting.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+            threshold=SafetySetting.HarmBlockThreshold.BLOCK_ONLY_HIGH
+        ),
+        SafetySetting(
+            category=SafetySetting.HarmCategory.HARM_CATEGORY_HARASSMENT,
+            threshold=SafetySetting.HarmBlockThreshold.BLOCK_ONLY_HIGH
+        ),
+    ]
+
+safety_settings = LazyResource("safety_settings", _build_safety_settings)
 
 book_mappings = {
 	"Albumin: Importance, Testing, and What Abnormal Levels Mean": {"author":"Docus", "year": 2024},
@@ -89,174 +160,301 @@ book_mappings = {
 
 }
 
-# Initialize chat sessions
-chat_sessions: Dict[str, ChatSession] = {}
+# Initialize chat sessions, bounded by count, estimated size and idle time
+chat_sessions = SessionCache()
+
+# Uploaded csv files of the chat history, with their parsed panels cached
+attachments = AttachmentStore(os.path.join("chat-history", "llm-rag"))
+
+# Cache of query embeddings, so repeated questions skip the embedding call
+embedding_cache = EmbeddingCache(EMBEDDING_MODEL, EMBEDDING_DIMENSION)
 
-# Connect to chroma DB
-client = chromadb.HttpClient(host=CHROMADB_HOST, port=CHROMADB_PORT)
+# Opt-in cache of answers to common first-turn questions
+answer_cache = SemanticAnswerCache()
+
+# Connect to chroma DB through a long-lived handle to the collection
 method = "semantic-split"
 collection_name = f"{method}-collection"
-# Get the collection
-collection = client.get_collection(name=collection_name)
+chroma = ChromaHandle(CHROMADB_HOST, CHROMADB_PORT, collection_name)
+
+# Optional in-process replica of the collection, used while it matches Chroma
+vector_index = VectorIndex(VECTOR_INDEX_PATH, collection_name)
+_index_refresh: Optional[asyncio.Task] = None
+
+# Precomputed chunks about each biomarker, for uploaded blood tests
+marker_context = MarkerContextCache(ChromaHandle(CHROMADB_HOST, CHROMADB_PORT, f"{method}-marker-context"))
+
+# Call policies of the upstream services: embedding and retrieval calls are
+# idempotent and hedged; chat generations are retried but never hedged
+embedding_upstream = Upstream("embedding", EMBED_TIMEOUT_SECONDS, hedge=True)
+chroma_upstream = Upstream("chroma", RETRIEVE_TIMEOUT_SECONDS, hedge=True)
+gemini_upstream = Upstream("gemini", REQUEST_DEADLINE_SECONDS, slow_seconds=GEMINI_SLOW_SECONDS)
+
+# Selects the retrieved chunks that are sent with a question
+context_packer = ContextPacker()
+# Retrieval results needed by the context packer
+RETRIEVAL_INCLUDE = ["documents", "distances", "embeddings"]
 
 def generate_query_embedding(query):
-	query_embedding_inputs = [TextEmbeddingInput(task_type='RETRIEVAL_DOCUMENT', text=query)]
+	with timed("embed"):
+		cached = embedding_cache.get(query)
+		if cached is not None:
+			return cached
+		from vertexai.language_models import TextEmbeddingInput
+		query_embedding_inputs = [TextEmbeddingInput(task_type='RETRIEVAL_DOCUMENT', text=query)]
+		kwargs = dict(output_dimensionality=EMBEDDING_DIMENSION) if EMBEDDING_DIMENSION else {}
+		embeddings = embedding_model.get().get_embeddings(query_embedding_inputs, **kwargs)
+		embedding_cache.put(query, embeddings[0].values)
+		return embeddings[0].values
+
+async def generate_query_embeddings_batch(queries: List[str]) -> List[List[float]]:
+	"""Embed several queries in a single Vertex AI call"""
+	from vertexai.language_models import TextEmbeddingInput
+	model = await embedding_model.aget()
+	query_embedding_inputs = [TextEmbeddingInput(task_type='RETRIEVAL_DOCUMENT', text=query) for query in queries]
 	kwargs = dict(output_dimensionality=EMBEDDING_DIMENSION) if EMBEDDING_DIMENSION else {}
-	embeddings = embedding_model.get_embeddings(query_embedding_inputs, **kwargs)
-	return embeddings[0].values
+	async with upstream_slot():
+		embeddings = await embedding_upstream.call(
+			lambda: model.get_embeddings_async(query_embedding_inputs, **kwargs)
+		)
+	return [embedding.values for embedding in embeddings]
+
+# Queries arriving within the batch window share one embedding call
+embedding_batcher = MicroBatcher(
+	generate_query_embeddings_batch,
+	max_batch_size=EMBEDDING_BATCH_MAX_SIZE,
+	max_wait_seconds=EMBEDDING_BATCH_WINDOW_MS / 1000,
+	key=normalize_query,
+)
+
+async def generate_query_embedding_async(query):
+	with timed("embed"):
+		cached = await embedding_cache.aget(query)
+		if cached is not None:
+			return cached
+		values = await embedding_batcher.submit(query)
+		await embedding_cache.aput(query, values)
+		return values
+
+def refresh_vector_index() -> None:
+	"""Rebuild the local replica from Chroma in the background if the collection changed"""
+	global _index_refresh
+	if not vector_index.enabled or (_index_refresh is not None and not _index_refresh.done()):
+		return
+	_index_refresh = asyncio.create_task(_refresh_vector_index())
+
+async def _refresh_vector_index():
+	try:
+		collection = await run_blocking(chroma.collection, True)
+		if str(collection.id) != vector_index.version:
+			await run_blocking(vector_index.build, collection)
+	except Exception as e:
+		print(f"Error refreshing vector index: {str(e)}")
+		traceback.print_exc()
 
-def create_chat_session() -> ChatSession:
-    """Create a new chat session with the model"""
-    return generative_model.start_chat()
+async def query_knowledge_base(
+	query_embeddings: List[List[float]], n_results: int = CONTEXT_CANDIDATES, include: List[str] = RETRIEVAL_INCLUDE
+) -> Dict:
+	"""Retrieve chunks from the local replica when it is current, otherwise from Chroma"""
+	if vector_index.enabled:
+		chroma.refresh_if_stale()
+		if vector_index.is_fresh(chroma.version):
+			return vector_index.query(query_embeddings, n_results, include=include)
+		refresh_vector_index()
+	return await chroma_upstream.call(
+		lambda: chroma.query(query_embeddings=query_embeddings, n_results=n_results, include=include)
+	)
 
-def generate_chat_response(chat_session: ChatSession, message: Dict) -> str:
+# Fields of a query result holding one list per query embedding
+QUERY_RESULT_FIELDS = ["ids", "documents", "metadatas", "distances", "embeddings"]
+
+def split_query_results(results: Dict, count: int) -> List[Dict]:
+	"""Split a multi-query result into one single-query result per query embedding"""
+	return [
+		{field: [results[field][i]] for field in QUERY_RESULT_FIELDS if results.get(field) is not None}
+		for i in range(count)
+	]
+
+async def query_knowledge_base_batch(query_embeddings: List[tuple]) -> List[Dict]:
+	"""Retrieve chunks for several query embeddings in one request"""
+	results = await query_knowledge_base([list(embedding) for embedding in query_embeddings])
+	return split_query_results(results, len(query_embeddings))
+
+# Retrievals arriving within the batch window share one request; identical
+# query embeddings in flight are only queried once
+retrieval_batcher = MicroBatcher(
+	query_knowledge_base_batch,
+	max_batch_size=RETRIEVAL_BATCH_MAX_SIZE,
+	max_wait_seconds=RETRIEVAL_BATCH_WINDOW_MS / 1000,
+)
+
+async def retrieve(query_embedding: List[float]) -> Dict:
+	"""Retrieve the candidate chunks for one query embedding"""
+	with timed("retrieve"):
+		return await retrieval_batcher.submit(tuple(query_embedding))
+
+def query_knowledge_base_sync(
+	query_embeddings: List[List[float]], n_results: int = CONTEXT_CANDIDATES, include: List[str] = RETRIEVAL_INCLUDE
+) -> Dict:
+	if vector_index.is_fresh(chroma.version):
+		return vector_index.query(query_embeddings, n_results, include=include)
+	return chroma.query_sync(query_embeddings=query_embeddings, n_results=n_results, include=include)
+
+async def create_chat_session() -> "ChatSession":
+    """Create a new chat session with the model, loading the model off the event loop if needed"""
+    model = await generative_model.aget()
+    return model.start_chat()
+
+def build_file_message_parts(message: Dict) -> List:
     """
-    Generate a response using the chat session to maintain history.
-    Handles both text and image inputs.
+    Build the model input parts for a message carrying a blood test csv.
 
     Args:
-        chat_session: The Vertex AI chat session
-        message: Dict containing 'content' (text) and optionally 'csv'
+        message: Dict containing 'file' (csv rows) or 'file_path', and optionally 'content'
 
     Returns:
-        str: The model's response
+        List: The message parts to send to the model
     """
-    try:
-        # Initialize parts list for the message
-        
-        # Get the collection
-        collection = client.get_collection(name=collection_name)
-        message_parts = []
-
-        # Process csv if present
-        if message.get("file"):
-            # print("file:", message.get("file"))
-
-            try:
-                # Get blood test biomarkers definitions
-                biomarker_dictionary = {
-                    "definition": {
-                        "WBC": "White Blood Cell",
-                        "LYMp": "Lymphocytes percentage, which is a type of white blood cell",
-                        "MIDp": "Indicates the percentage combined value of the other types of white blood cells not classified as lymphocytes or granulocytes",
-                        "NEUTp": "Neutrophils are a type of white blood cell (leukocytes); neutrophils percentage",
-                        "LYMn": "Lymphocytes number are a type of white blood cell",
-                        "MIDn": "Indicates the combined number of other white blood cells not classified as lymphocytes or granulocytes",
-                        "NEUTn": "Neutrophils Number",
-                        "RBC": "Red Blood Cell",
-                        "HGB": "Hemoglobin",
-                        "HCT": "Hematocrit is the proportion, by volume, of the Blood that consists of red blood cells",
-                        "MCV": "Mean Corpuscular Volume",
-                        "MCH": "Mean Corpuscular Hemoglobin is the average amount of haemoglobin in the average red cell",
-                        "MCHC": "Mean Corpuscular Hemoglobin Concentration",
-                        "RDWSD": "Red Blood Cell Distribution Width",
-                        "RDWCV": "Red blood cell distribution width",
-                        "PLT": "Platelet Count",
-                        "MPV": "Mean Platelet Volume",
-                        "PDW": "Red Cell Distribution Width",
-                        "PCT": "The level of Procalcitonin in the Blood",
-                        "PLCR": "Platelet Large Cell Ratio",
-                    },
-                    "normal_range": {
-                        "WBC": "4.0 to 10.0",
-                        "LYMp": "20.0 to 40.0",
-                        "MIDp": "1.0 to 15.0",
-                        "NEUTp": "50.0 to 70.0",
-                        "LYMn": "0.6 to 4.1",
-                        "MIDn": "0.1 to 1.8",
-                        "NEUTn": "2.0 to 7.8",
-                        "RBC": "3.50 to 5.50",
-                        "HGB": "11.0 to 16.0",
-                        "HCT": "36.0 to 48.0",
-                        "MCV": "80.0 to 99.0",
-                        "MCH": "26.0 to 32.0",
-                        "MCHC": "32.0 to 36.0",
-                        "RDWSD": "37.0 to 54.0",
-                        "RDWCV": "11.5 to 14.5",
-                        "PLT": "100 to 400",
-                        "MPV": "7.4 to 10.4",
-                        "PDW": "10.0 to 17.0",
-                        "PCT": "0.10 to 0.28",
-                        "PLCR": "13.0 to 43.0",
-                    },
-                    "unit": {
-                        "WBC": "10^9/L.",
-                        "LYMp": "%",
-                        "MIDp": "%",
-                        "NEUTp": "%",
-                        "LYMn": "10^9/L.",
-                        "MIDn": "10^9/L.",
-                        "NEUTn": "10^9/L.",
-                        "RBC": "10^12/L",
-                        "HGB": "g/dL",
-                        "HCT": "%",
-                        "MCV": "fL",
-                        "MCH": "pg",
-                        "MCHC": "g/dL",
-                        "RDWSD": "fL",
-                        "RDWCV": "%",
-                        "PLT": "10^9/L",
-                        "MPV": "fL",
-                        "PDW": "%",
-                        "PCT": "%",
-                        "PLCR": "%",
-                    },
-                }
-
-                uploaded_data = message.get("file")[0]
-                blood_test_input_prompt = ""
-                for biomarker in uploaded_data:
-                    if biomarker != "ID":
-                        if(biomarker in biomarker_dictionary["definition"].keys()):
-                            blood_test_input_prompt += f"{biomarker} is {biomarker_dictionary['definition'][biomarker]}, the normal range for it is {biomarker_dictionary['normal_range'][biomarker]}, and the patient has a value of {uploaded_data[biomarker]}.\n "
-                        else: 
-                            blood_test_input_prompt += f"the patient has a value of {uploaded_data[biomarker]} for {biomarker}.\n "
-                message_parts.append(blood_test_input_prompt)
-                # Add text content if present
-                if message.get("content"):
-                    message_parts.append(message["content"])
-                else:
-                    message_parts.append("Interpret the blood test result.")
-            except ValueError as e:
-                print(f"Error processing uploaded file: {str(e)}")
-                raise HTTPException(
-                    status_code=400, detail=f"Failed to process the uploaded file."
-                )
-        elif message.get("file_path"):
-            # Read the file
-            file_path = os.path.join(
-                "chat-history", "llm-rag", message.get("file_path")
-            )
-            file = pd.read_csv(file_path)
-            message_parts.append(file)
+    message_parts = []
+
+    # Process csv if present
+    if message.get("file"):
+        # print("file:", message.get("file"))
 
+        try:
+            # Summarize the panel against the precomputed reference ranges
+            uploaded_data = message.get("file")[0]
+            blood_test_input_prompt = build_panel_prompt(uploaded_data)
+            message_parts.append(blood_test_input_prompt)
             # Add text content if present
             if message.get("content"):
                 message_parts.append(message["content"])
             else:
                 message_parts.append("Interpret the blood test result.")
+        except ValueError as e:
+            print(f"Error processing uploaded file: {str(e)}")
+            raise HTTPException(
+                status_code=400, detail=f"Failed to process the uploaded file."
+            )
+    elif message.get("file_path"):
+        # Summarize the stored panel rather than resending the whole table
+        rows = load_file_rows(message["file_path"])
+        message_parts.append(build_panel_prompt(rows[0]))
+
+        # Add text content if present
+        if message.get("content"):
+            message_parts.append(message["content"])
         else:
+            message_parts.append("Interpret the blood test result.")
+
+    return message_parts
+
+def load_file_rows(relative_path: str) -> List[Dict]:
+    """Read the rows of a csv saved by ChatHistoryManager, parsed once and cached"""
+    return attachments.load(relative_path)
+
+def chat_panels(messages: List[Dict]) -> List[Dict]:
+    """The blood test panel (first csv row) of each user message with a file, oldest first"""
+    panels = []
+    for message in messages:
+        if message["role"] != "user":
+            continue
+        try:
+            if message.get("file"):
+                panels.append(message["file"][0])
+            elif message.get("file_path"):
+                panels.append(load_file_rows(message["file_path"])[0])
+        except Exception as e:
+            print(f"Error loading panel of message {message.get('message_id')}: {str(e)}")
+    return panels
+
+def add_panel_trends(message: Dict, message_parts: List, chat_messages: Optional[List[Dict]]) -> None:
+    """
+    Add how the biomarkers changed since the chat's earlier blood tests,
+    inserted before the question. The summary is kept with the message so the
+    session can be rebuilt without reading the files again.
+    """
+    if not chat_messages:
+        return
+    earlier = chat_panels(chat_messages)
+    if not earlier:
+        return
+    current = message["file"][0] if message.get("file") else load_file_rows(message["file_path"])[0]
+    trends = build_trend_prompt(earlier + [current])
+    if trends:
+        message["trends"] = trends
+        message_parts.insert(len(message_parts) - 1, trends)
+
+def build_reference_part(documents: List[str]) -> str:
+    """Introduce the chunks grounding a blood test interpretation"""
+    chunks = "\n".join(documents)
+    return f"Reference information about the values outside the normal range:\n{chunks}"
+
+def add_marker_context(message: Dict, message_parts: List) -> None:
+    """
+    Ground a blood test message with the cached chunks about its abnormal
+    biomarkers, inserted before the question. The chunks are kept with the
+    message so the session can be rebuilt.
+    """
+    flags = classify_panels(message["file"][:1])[0]
+    chunks = context_packer.pack(marker_context.lookup(flags))
+    if chunks:
+        message["context"] = chunks
+        message_parts.insert(len(message_parts) - 1, build_reference_part(chunks))
+
+def build_rag_prompt(content: str, documents: List[str]) -> str:
+    """Combine the user question with the retrieved chunks"""
+    chunks = "\n".join(documents)
+    return f"""
+                {content}
+                {chunks}
+                """
+
+def generate_chat_response(
+    chat_session: "ChatSession", message: Dict, chat_messages: Optional[List[Dict]] = None
+) -> str:
+    """
+    Generate a response using the chat session to maintain history.
+    Handles both text and image inputs.
+
+    Args:
+        chat_session: The Vertex AI chat session
+        message: Dict containing 'content' (text) and optionally 'csv'
+        chat_messages: The chat's earlier messages, for trends across its blood tests
+
+    Returns:
+        str: The model's response
+    """
+    try:
+        if message.get("file") or message.get("file_path"):
+            with timed("build_prompt"):
+                message_parts = build_file_message_parts(message)
+                if message.get("file"):
+                    add_marker_context(message, message_parts)
+                add_panel_trends(message, message_parts, chat_messages)
+        else:
+            message_parts = []
             # Add text content if present
             if message.get("content"):
                 # Create embeddings for the message content
                 query_embedding = generate_query_embedding(message["content"])
                 # Retrieve chunks based on embedding value
-                results = collection.query(
-                    query_embeddings=[query_embedding], n_results=5
-                )
-                INPUT_PROMPT = f"""
-                {message["content"]}
-                {"\n".join(results["documents"][0])}
-                """
-                message_parts.append(INPUT_PROMPT)
+                with timed("retrieve"):
+                    results = query_knowledge_base_sync([query_embedding])
+                # Keep the packed chunks with the message so the session can be rebuilt
+                with timed("build_prompt"):
+                    message["context"] = context_packer.pack_results(results)
+                    message_parts.append(build_rag_prompt(message["content"], message["context"]))
 
         if not message_parts:
             raise ValueError("Message must contain either text content or image")
 
         # Send message with all parts to the model
-        response = chat_session.send_message(
-            message_parts, generation_config=generation_config
-        )
+        with timed("generate"):
+            response = chat_session.send_message(
+                message_parts, generation_config=generation_config
+            )
+        record_usage("chat", response)
 
         return response.text
 
@@ -267,13 +465,385 @@ def generate_chat_response(chat_session: ChatSession, message: Dict) -> str:
             status_code=500, detail=f"Failed to generate response: {str(e)}"
         )
 
+async def get_collection_async():
+    """Get the knowledge base collection without blocking the event loop"""
+    return await chroma.acollection()
+
+async def build_message_parts_async(
+    message: Dict,
+    query_embedding: Optional[List[float]] = None,
+    chat_messages: Optional[List[Dict]] = None,
+    deadline: Optional[Deadline] = None,
+) -> List:
+    """
+    Build the model input parts for a message without blocking the event loop.
+    Vertex AI and Chroma calls use their native async clients; csv parsing runs
+    on the bounded executor. Embedding and retrieval each run within their
+    share of the request deadline; if either fails or runs out of time, the
+    question is answered without retrieved chunks.
+
+    Args:
+        message: Dict containing 'content' (text) and optionally 'csv'
+        query_embedding: The content's embedding, if already computed
+        chat_messages: The chat's earlier messages, for trends across its blood tests
+        deadline: The request's deadline
+
+    Returns:
+        List: The message parts to send to the model
+    """
+    deadline = deadline or Deadline()
+    if message.get("file") or message.get("file_path"):
+        with timed("build_prompt"):
+            message_parts = await run_blocking(build_file_message_parts, message)
+            if message.get("file"):
+                try:
+                    await deadline.run(marker_context.refresh(chroma.version), RETRIEVE_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    print("Timed out loading the marker context")
+                add_marker_context(message, message_parts)
+            await run_blocking(add_panel_trends, message, message_parts, chat_messages)
+        return message_parts
+
+    message_parts = []
+    # Add text content if present
+    if message.get("content"):
+        stage = "embed"
+        try:
+            # Create embeddings for the message content
+            if query_embedding is None:
+                query_embedding = await deadline.run(
+                    generate_query_embedding_async(message["content"]), EMBED_TIMEOUT_SECONDS
+                )
+            # Retrieve chunks based on embedding value
+            stage = "retrieve"
+            results = await deadline.run(retrieve(query_embedding), RETRIEVE_TIMEOUT_SECONDS)
+            # Keep the packed chunks with the message so the session can be rebuilt
+            with timed("build_prompt"):
+                message["context"] = context_packer.pack_results(results)
+        except Exception as e:
+            # Answer from the model alone rather than fail the request
+            print(f"Answering without retrieved context, {stage} failed: {type(e).__name__} {str(e)}")
+            degraded_requests.inc(stage=stage)
+            message["context"] = []
+            message["degraded"] = True
+        message_parts.append(build_rag_prompt(message["content"], message["context"]))
+    return message_parts
+
+def upstream_error(e: Exception) -> HTTPException:
+    """The response for a request whose generation failed"""
+    if isinstance(e, CircuitOpen):
+        return HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(max(1, int(e.retry_after)))}
+        )
+    if isinstance(e, asyncio.TimeoutError):
+        return HTTPException(status_code=504, detail="Failed to generate response: deadline exceeded")
+    return HTTPException(status_code=500, detail=f"Failed to generate response: {str(e)}")
+
+async def generate_chat_response_async(
+    chat_session: "ChatSession",
+    message: Dict,
+    query_embedding: Optional[List[float]] = None,
+    chat_messages: Optional[List[Dict]] = None,
+) -> str:
+    """
+    Non-blocking variant of generate_chat_response for the async routes.
+
+    Args:
+        chat_session: The Vertex AI chat session
+        message: Dict containing 'content' (text) and optionally 'csv'
+        query_embedding: The content's embedding, if already computed
+        chat_messages: The chat's earlier messages, for trends across its blood tests
+
+    Returns:
+        str: The model's response
+    """
+    deadline = Deadline()
+    try:
+        message_parts = await build_message_parts_async(message, query_embedding, chat_messages, deadline)
+        if not message_parts:
+            raise ValueError("Message must contain either text content or image")
+
+        # Send message with all parts to the model, within what is left of the deadline
+        with timed("generate"):
+            async with upstream_slot():
+                response = await gemini_upstream.call(
+                    lambda: chat_session.send_message_async(message_parts, generation_config=generation_config),
+                    timeout=deadline.remaining(),
+                )
+        record_usage("chat", response)
+
+        return response.text
+
+    except Exception as e:
+        print(f"Error generating response: {str(e)}")
+        traceback.print_exc()
+        raise upstream_error(e)
+
+def _chunk_text(response) -> str:
+    """Get the text of a streamed chunk, which may carry no parts (e.g. the final chunk)"""
+    try:
+        return response.text
+    except ValueError:
+        return ""
+
+async def generate_chat_response_stream(
+    chat_session: "ChatSession",
+    message: Dict,
+    query_embedding: Optional[List[float]] = None,
+    chat_messages: Optional[List[Dict]] = None,
+) -> AsyncIterator[str]:
+    """
+    Streaming variant of generate_chat_response_async that yields text as the
+    model produces it. The chat session history is updated once the stream ends.
+
+    Args:
+        chat_session: The Vertex AI chat session
+        message: Dict containing 'content' (text) and optionally 'csv'
+        query_embedding: The content's embedding, if already computed
+        chat_messages: The chat's earlier messages, for trends across its blood tests
+
+    Yields:
+        str: Chunks of the model's response
+    """
+    deadline = Deadline()
+    try:
+        message_parts = await build_message_parts_async(message, query_embedding, chat_messages, deadline)
+        if not message_parts:
+            raise ValueError("Message must contain either text content or image")
+
+        # Send message with all parts to the model; the stream must finish
+        # within what is left of the deadline
+        with timed("generate"):
+            async with upstream_slot():
+                start = time.perf_counter()
+                responses = await gemini_upstream.call(
+                    lambda: chat_session.send_message_async(
+                        message_parts, generation_config=generation_config, stream=True
+                    ),
+                    timeout=deadline.remaining(),
+                )
+                response = None
+                while True:
+                    try:
+                        response = await deadline.run(responses.__anext__())
+                    except StopAsyncIteration:
+                        break
+                    text = _chunk_text(response)
+                    if text:
+                        if start is not None:
+                            observe_stage("first_token", time.perf_counter() - start)
+                            start = None
+                        yield text
+        # The last chunk carries the usage of the whole response
+        record_usage("chat", response)
+
+    except Exception as e:
+        print(f"Error generating response: {str(e)}")
+        traceback.print_exc()
+        raise upstream_error(e)
+
 
-def rebuild_chat_session(chat_history: List[Dict]) -> ChatSession:
-    """Rebuild a chat session with complete context"""
-    new_session = create_chat_session()
+async def interpret_panel_async(panel: Dict, status: Dict[str, str], question: str) -> str:
+    """Interpret a single blood test panel without a chat session"""
+    prompt = build_panel_prompt(panel, status)
+    with timed("interpret_panel"):
+        async with upstream_slot():
+            model = await generative_model.aget()
+            # Rows are retried by interpret_panels_stream
+            response = await gemini_upstream.call(
+                lambda: model.generate_content_async([prompt, question], generation_config=generation_config),
+                retries=0,
+            )
+    record_usage("panel", response)
+    return response.text
+
+async def interpret_panels_stream(panels: List[Dict], question: Optional[str] = None) -> AsyncIterator[Dict]:
+    """
+    Interpret several blood test panels (one csv row per patient) concurrently.
+
+    All rows are flagged in one pass, then interpreted by at most
+    PANEL_BATCH_CONCURRENCY workers. A failed row is retried up to
+    PANEL_BATCH_RETRIES times with backoff without affecting the other rows.
+
+    Args:
+        panels: The csv rows
+        question: The question asked about each panel
 
-    for message in chat_history:
+    Yields:
+        Dict: A result per row, in completion order, with its flags and either
+        the interpretation or the error
+    """
+    question = question or "Interpret the blood test result."
+    flags = classify_panels(panels)
+    workers = asyncio.Semaphore(PANEL_BATCH_CONCURRENCY)
+
+    async def interpret(index: int) -> Dict:
+        result = {"row": index, "id": panels[index].get("ID"), "flags": flags[index]}
+        async with workers:
+            for attempt in range(PANEL_BATCH_RETRIES + 1):
+                try:
+                    result["interpretation"] = await interpret_panel_async(panels[index], flags[index], question)
+                    result["status"] = "ok"
+                    result.pop("error", None)
+                    break
+                except Exception as e:
+                    print(f"Error interpreting row {index} (attempt {attempt + 1}): {str(e)}")
+                    result["status"] = "error"
+                    result["error"] = str(e)
+                    if attempt < PANEL_BATCH_RETRIES:
+                        await asyncio.sleep(0.5 * 2 ** attempt)
+            result["attempts"] = attempt + 1
+        return result
+
+    tasks = [asyncio.create_task(interpret(index)) for index in range(len(panels))]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        # Stop the remaining rows if the client went away
+        for task in tasks:
+            task.cancel()
+
+
+class AnswerLookup:
+    """Result of an answer cache lookup for a first-turn message"""
+
+    def __init__(self, query_embedding: List[float], version: str, cached: Optional[CachedAnswer]):
+        self.query_embedding = query_embedding
+        self.version = version
+        self.cached = cached
+
+async def lookup_cached_answer(message: Dict) -> Optional[AnswerLookup]:
+    """
+    Look up the answer cache for the first message of a new chat.
+
+    Only text-only messages are eligible. On a hit the cached chunks are stored
+    on the message, as if they had been retrieved.
+
+    Args:
+        message: The first user message of the chat
+
+    Returns:
+        Optional[AnswerLookup]: None when the cache is disabled or the message is not eligible
+    """
+    if not answer_cache.enabled or message.get("file") or message.get("file_path") or not message.get("content"):
+        return None
+
+    try:
+        query_embedding = await generate_query_embedding_async(message["content"])
+        collection = await get_collection_async()
+        # The collection is recreated when the knowledge base is reloaded
+        version = str(collection.id)
+    except Exception as e:
+        # The cache is an optimization; let the normal path handle (and report) the failure
+        print(f"Error looking up answer cache: {str(e)}")
+        return None
+    cached = answer_cache.lookup(query_embedding, version)
+    if cached is not None:
+        message["context"] = cached.context
+    return AnswerLookup(query_embedding, version, cached)
+
+def remember_answer(lookup: Optional[AnswerLookup], message: Dict, answer: str) -> None:
+    """Cache a freshly generated first-turn answer"""
+    if lookup is None or lookup.cached is not None or message.get("context") is None or message.get("degraded"):
+        return
+    answer_cache.store(lookup.query_embedding, lookup.version, message["content"], answer, message["context"])
+
+async def start_cached_chat_session(message: Dict, answer: str) -> "ChatSession":
+    """Start a chat session whose history already holds a cached first turn"""
+    return await run_blocking(rebuild_chat_session, [message, {"role": "assistant", "content": answer}])
+
+def rebuild_message_parts(message: Dict, with_context: bool = True) -> List[str]:
+    """
+    Rebuild the parts originally sent to the model for a stored user message,
+    using the saved csv file or retrieval context instead of calling any model.
+
+    Args:
+        message: A user message as saved by ChatHistoryManager
+        with_context: Whether to include the retrieved chunks
+
+    Returns:
+        List[str]: The message parts
+    """
+    if message.get("file_path"):
+        rows = load_file_rows(message["file_path"])
+        message_parts = build_file_message_parts({"file": rows, "content": message.get("content")})
+        if message.get("context") and with_context:
+            message_parts.insert(len(message_parts) - 1, build_reference_part(message["context"]))
+        if message.get("trends"):
+            message_parts.insert(len(message_parts) - 1, message["trends"])
+        return message_parts
+
+    if message.get("context") is not None and with_context:
+        return [build_rag_prompt(message.get("content", ""), message["context"])]
+
+    # Messages saved before the context was stored only have their text
+    return [message["content"]] if message.get("content") else []
+
+def summary_history(summary: Dict) -> List["Content"]:
+    """The exchange that stands in for the summarized turns at the start of a history"""
+    from vertexai.generative_models import Content, Part
+    return [
+        Content(role="user", parts=[Part.from_text(f"Summary of our earlier conversation:\n{summary['text']}")]),
+        Content(role="model", parts=[Part.from_text("Understood, I will keep this in mind.")]),
+    ]
+
+def rebuild_chat_session(chat_history: List[Dict], summary: Optional[Dict] = None) -> "ChatSession":
+    """
+    Rebuild a chat session from the stored messages without calling the model.
+    The history policy applies: turns before the window are replaced by the
+    chat's summary, and only the most recent turns keep their retrieved chunks.
+    """
+    from vertexai.generative_models import Content, Part
+    turns = split_turns(chat_history)
+    start = window_start(len(turns), summary)
+    history = summary_history(summary) if summary and start > 0 else []
+    for index in range(start, len(turns)):
+        with_context = keeps_context(index, len(turns))
+        for message in turns[index]:
+            if message["role"] == "user":
+                parts = rebuild_message_parts(message, with_context)
+                history.append(
+                    Content(role="user", parts=[Part.from_text(part) for part in parts])
+                )
+            elif message["role"] == "assistant":
+                history.append(
+                    Content(role="model", parts=[Part.from_text(message["content"])])
+                )
+
+    return generative_model.get().start_chat(history=history)
+
+def summary_transcript(messages: List[Dict]) -> str:
+    """Render turns as plain text for summarization, without retrieved chunks"""
+    lines = []
+    for message in messages:
         if message["role"] == "user":
-            generate_chat_response(new_session, message)
+            lines.append("User: " + "\n".join(rebuild_message_parts(message, with_context=False)))
+        elif message["role"] == "assistant":
+            lines.append("Assistant: " + message["content"])
+    return "\n".join(lines)
+
+async def summarize_chat_async(chat: Dict, turn_count: int) -> Dict:
+    """
+    Extend the chat's summary to cover its first turn_count turns.
+    Only the turns not covered yet are sent, with the previous summary.
 
-    return new_session
+    Returns:
+        Dict: The new summary, with its text and the number of turns covered
+    """
+    summary = chat.get("summary")
+    turns = split_turns(chat["messages"])[summarized_turns(summary):turn_count]
+    transcript = await run_blocking(summary_transcript, [message for turn in turns for message in turn])
+    prompt = ""
+    if summary:
+        prompt += f"Summary so far:\n{summary['text']}\n\n"
+    prompt += f"New conversation turns:\n{transcript}"
+
+    with timed("summarize"):
+        async with upstream_slot():
+            model = await summary_model.aget()
+            response = await gemini_upstream.call(
+                lambda: model.generate_content_async([prompt], generation_config=summary_generation_config)
+            )
+    record_usage("summary", response)
+    return {"text": response.text, "turns": turn_count}
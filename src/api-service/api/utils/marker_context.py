@@ -0,0 +1,86 @@
+import json
+import time
+from typing import Dict, List, Optional
+from api.utils.chroma_utils import ChromaHandle, CHROMA_HEALTH_CHECK_SECONDS
+
+
+class MarkerContextCache:
+    """
+    Knowledge base chunks about each biomarker, precomputed by
+    `vector-db/cli.py --load` into the "<method>-marker-context" collection
+    with one entry per "<marker>:<low|high>" key.
+
+    The whole collection is read once into memory and read again when the
+    knowledge base collection changes version, so grounding an uploaded blood
+    test needs neither an embedding call nor a vector search. Until the
+    collection exists, lookups return nothing and loading is retried every
+    retry_seconds. A collection built from another version of the knowledge
+    base (its "source" metadata), e.g. while `--load` has not rebuilt it yet,
+    is served but read again every retry_seconds until it matches.
+    """
+
+    def __init__(self, handle: ChromaHandle, retry_seconds: float = CHROMA_HEALTH_CHECK_SECONDS):
+        self.handle = handle
+        self.retry_seconds = retry_seconds
+        self._chunks: Dict[str, List[str]] = {}
+        self._loaded = False
+        self._loaded_for: Optional[str] = None
+        self._attempted_for: Optional[str] = None
+        self._attempted_at = 0.0
+        self.loads = 0
+
+    async def refresh(self, version: Optional[str]) -> None:
+        """Load the cache unless it was loaded, or recently attempted, for this knowledge base version"""
+        if self._loaded and self._loaded_for == version:
+            return
+        if self._attempted_for == version and time.monotonic() - self._attempted_at < self.retry_seconds:
+            return
+        # Concurrent callers serve what is loaded while this attempt runs
+        self._attempted_for = version
+        self._attempted_at = time.monotonic()
+        try:
+            collection = await self.handle.acollection(refresh=True)
+            records = await collection.get(include=["documents"])
+            self._chunks = {
+                key: json.loads(document) for key, document in zip(records["ids"], records["documents"])
+            }
+            self._loaded = True
+            self.loads += 1
+            source = (collection.metadata or {}).get("source")
+            if version is not None and source is not None and source != version:
+                # Serve it until the context for this version has been built
+                print(f"Marker context in '{self.handle.collection_name}' was built for {source}, not {version}")
+                self._loaded_for = None
+                return
+            self._loaded_for = version
+        except Exception as e:
+            print(f"Error loading marker context from '{self.handle.collection_name}': {str(e)}")
+
+    def lookup(self, flags: Dict[str, str]) -> List[str]:
+        """
+        Get the cached chunks for the abnormal biomarkers of a panel, taking
+        one chunk per biomarker in turn so every marker is represented.
+
+        Args:
+            flags: Status of each biomarker, from classify_panels
+        """
+        lists = [
+            self._chunks.get(f"{marker}:{status}", [])
+            for marker, status in flags.items()
+            if status in ("low", "high")
+        ]
+        chunks = []
+        for rank in range(max((len(chunk_list) for chunk_list in lists), default=0)):
+            for chunk_list in lists:
+                if rank < len(chunk_list) and chunk_list[rank] not in chunks:
+                    chunks.append(chunk_list[rank])
+        return chunks
+
+    def stats(self) -> Dict:
+        return {
+            "collection": self.handle.collection_name,
+            "keys": len(self._chunks),
+            "loaded": self._loaded,
+            "version": self._loaded_for,
+            "loads": self.loads,
+        }
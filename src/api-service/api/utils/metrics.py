@@ -0,0 +1,279 @@
+import os
+import math
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds (seconds) of the stage latency histogram buckets
+STAGE_BUCKETS = [
+    float(bound)
+    for bound in os.environ.get(
+        "METRICS_STAGE_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30"
+    ).split(",")
+]
+
+# Stage durations of the current request, for its Server-Timing header
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        name + '="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """Cumulative histogram per label set, in the Prometheus exposition format"""
+
+    def __init__(self, name: str, help_text: str, label_names: List[str], buckets: List[float]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = sorted(buckets) + [math.inf]
+        # labels -> (bucket counts, sum, count)
+        self._series: Dict[Tuple[Tuple[str, str], ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple((name, str(labels[name])) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, [list(counts), total, count]) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = format_labels(key + (("le", format_value(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(key)} {count}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter per label set, in the Prometheus exposition format"""
+
+    def __init__(self, name: str, help_text: str, label_names: List[str]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple((name, str(labels[name])) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        key = tuple((name, str(labels[name])) for name in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{format_labels(key)} {format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """Current value per label set, in the Prometheus exposition format"""
+
+    def __init__(self, name: str, help_text: str, label_names: Optional[List[str]] = None):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names or []
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels: str) -> None:
+        key = tuple((name, str(labels[name])) for name in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels: str) -> float:
+        key = tuple((name, str(labels[name])) for name in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{format_labels(key)} {format_value(value)}")
+        return lines
+
+
+stage_seconds = Histogram(
+    "api_stage_duration_seconds",
+    "Time spent in each stage of the request pipeline.",
+    ["stage"],
+    STAGE_BUCKETS,
+)
+model_tokens = Counter(
+    "api_model_tokens_total",
+    "Tokens reported in the usage metadata of Gemini responses.",
+    ["call", "kind"],
+)
+model_calls = Counter(
+    "api_model_calls_total",
+    "Gemini calls, by purpose.",
+    ["call"],
+)
+admission_in_flight = Gauge(
+    "api_admission_in_flight",
+    "Generation requests holding an admission slot.",
+)
+admission_queue_depth = Gauge(
+    "api_admission_queue_depth",
+    "Generation requests waiting for an admission slot.",
+)
+admission_rejections = Counter(
+    "api_admission_rejections_total",
+    "Generation requests rejected with 429, by reason.",
+    ["reason"],
+)
+circuit_open = Gauge(
+    "api_circuit_open",
+    "Whether the circuit breaker of an upstream is open (1) or closed (0).",
+    ["upstream"],
+)
+upstream_retries = Counter(
+    "api_upstream_retries_total",
+    "Upstream calls retried after a transient error.",
+    ["upstream"],
+)
+upstream_hedges = Counter(
+    "api_upstream_hedges_total",
+    "Upstream calls sent a second time because the first was slow.",
+    ["upstream"],
+)
+degraded_requests = Counter(
+    "api_degraded_requests_total",
+    "Questions answered without retrieved context, by the stage that failed.",
+    ["stage"],
+)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    """Record a stage duration, and add it to the current request's Server-Timing"""
+    stage_seconds.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Time a block of code (sync or inside a coroutine) as a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def record_usage(call: str, response: Any) -> None:
+    """Count the tokens in a Gemini response's usage metadata, if it has any"""
+    model_calls.inc(call=call)
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    for kind, field in (
+        ("prompt", "prompt_token_count"),
+        ("candidates", "candidates_token_count"),
+        ("total", "total_token_count"),
+    ):
+        count = getattr(usage, field, None)
+        if isinstance(count, (int, float)) and count:
+            model_tokens.inc(count, call=call, kind=kind)
+
+
+def start_request_timings() -> Dict[str, float]:
+    """Collect the stage durations of the current request (task) into a new dict"""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def detach_request_timings() -> None:
+    """Keep a background task started by a request out of that request's Server-Timing"""
+    _request_timings.set(None)
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    """Format stage durations as a Server-Timing header value, in milliseconds"""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware adding the stages timed while handling a request, and its
+    total time so far, as a Server-Timing header. For streaming responses the
+    header only covers the stages finished before the body starts.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        timings = start_request_timings()
+
+        async def send_with_timings(message):
+            if message["type"] == "http.response.start":
+                header = server_timing_header({**timings, "total": time.perf_counter() - start})
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", header.encode())]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_timings)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in (
+        stage_seconds,
+        model_tokens,
+        model_calls,
+        admission_in_flight,
+        admission_queue_depth,
+        admission_rejections,
+        circuit_open,
+        upstream_retries,
+        upstream_hedges,
+        degraded_requests,
+    ):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,155 @@
+import os
+import copy
+import asyncio
+import traceback
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from api.utils.chat_utils import ChatHistoryManager
+from api.utils.concurrency import run_blocking
+from api.utils.metrics import timed, detach_request_timings
+from api.utils.resilience import backoff_seconds
+
+# Retries of a chat write that failed, with full-jitter exponential backoff
+PERSIST_RETRIES = int(os.environ.get("PERSIST_RETRIES", "3"))
+
+
+class KeyedLocks:
+    """asyncio locks created on demand per key and dropped once nobody holds or waits on them"""
+
+    def __init__(self):
+        self._locks: Dict[Any, Tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Any):
+        lock, users = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[key]
+            if users == 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, users - 1)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class WriteBehindChatStore:
+    """
+    Write-behind persistence for chats in front of a ChatHistoryManager.
+
+    save() only queues the chat; one background writer per chat stores the
+    latest queued snapshot and its uploaded files on the blocking executor, so
+    writes to the same chat are serialized and ordered while different chats
+    are written concurrently. Several saves queued while a write is running
+    collapse into one write, and a failed write is retried with backoff.
+    Reads see queued chats before they reach the store, and flush() waits for
+    every queued write, e.g. on shutdown.
+    """
+
+    def __init__(self, chat_manager: ChatHistoryManager):
+        self.chat_manager = chat_manager
+        # (session_id, chat_id) -> latest chat not yet picked up by its writer
+        self._pending: Dict[Tuple[str, str], Dict] = {}
+        # (session_id, chat_id) -> chat currently being written
+        self._writing: Dict[Tuple[str, str], Dict] = {}
+        self._writers: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.writes = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.retries = 0
+
+    async def save(self, chat: Dict, session_id: str) -> None:
+        """Queue a chat and its uploaded files for a background write"""
+        # Files are readable from memory at their path until the writer stores them
+        self.chat_manager.stage_files(chat)
+
+        key = (session_id, chat["chat_id"])
+        if key in self._pending:
+            self.coalesced += 1
+        self._pending[key] = chat
+        if key not in self._writers:
+            self._writers[key] = asyncio.create_task(self._drain(key))
+
+    def _write(self, session_id: str, chat: Dict) -> None:
+        self.chat_manager.write_files(chat)
+        self.chat_manager.store.save_chat(session_id, chat)
+
+    async def _drain(self, key: Tuple[str, str]) -> None:
+        detach_request_timings()
+        attempt = 0
+        try:
+            while key in self._pending:
+                chat = self._writing[key] = self._pending.pop(key)
+                try:
+                    with timed("store_write"):
+                        await run_blocking(self._write, key[0], chat)
+                    self.writes += 1
+                    attempt = 0
+                    continue
+                except Exception as e:
+                    print(f"Error saving chat {key[1]}: {str(e)}")
+                    traceback.print_exc()
+                    self.errors += 1
+                finally:
+                    del self._writing[key]
+                if attempt < PERSIST_RETRIES:
+                    # Write it again, unless a newer version was queued meanwhile
+                    self._pending.setdefault(key, chat)
+                    attempt += 1
+                    self.retries += 1
+                    await asyncio.sleep(backoff_seconds(attempt))
+                else:
+                    print(f"Giving up saving chat {key[1]} after {attempt + 1} attempts")
+                    attempt = 0
+        finally:
+            del self._writers[key]
+
+    def _queued(self, key: Tuple[str, str]) -> Optional[Dict]:
+        chat = self._pending.get(key)
+        return chat if chat is not None else self._writing.get(key)
+
+    async def get_chat(self, chat_id: str, session_id: str) -> Optional[Dict]:
+        """Get a chat, including writes that are still queued"""
+        chat = self._queued((session_id, chat_id))
+        if chat is not None:
+            return copy.deepcopy(chat)
+        return await run_blocking(self.chat_manager.get_chat, chat_id, session_id)
+
+    async def get_recent_chats(self, session_id: str, limit: Optional[int] = None) -> List[Dict]:
+        """Get recent chats, including writes that are still queued"""
+        # Taken before reading the store, so a write finishing meanwhile is not missed
+        pending = {
+            chat_id: copy.deepcopy(self._queued((queued_session, chat_id)))
+            for (queued_session, chat_id) in list(self._writing) + list(self._pending)
+            if queued_session == session_id
+        }
+        chats = await run_blocking(self.chat_manager.get_recent_chats, session_id, limit)
+        if not pending:
+            return chats
+
+        chats = [chat for chat in chats if chat["chat_id"] not in pending]
+        chats.extend(pending.values())
+        chats.sort(key=lambda x: x.get('dts', 0), reverse=True)
+        if limit:
+            return chats[:limit]
+        return chats
+
+    async def flush(self) -> None:
+        """Wait until every queued chat has been written"""
+        while self._writers:
+            await asyncio.gather(*list(self._writers.values()), return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._pending) + len(self._writing),
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "retries": self.retries,
+        }
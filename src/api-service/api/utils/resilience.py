@@ -0,0 +1,306 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+from api.utils.metrics import circuit_open, upstream_retries, upstream_hedges
+
+# Time a chat request may take end to end, and the share of it each retrieval stage may use
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "60"))
+EMBED_TIMEOUT_SECONDS = float(os.environ.get("EMBED_TIMEOUT_SECONDS", "3"))
+RETRIEVE_TIMEOUT_SECONDS = float(os.environ.get("RETRIEVE_TIMEOUT_SECONDS", "2"))
+# A Gemini call that times out after running this long counts against its circuit
+GEMINI_SLOW_SECONDS = float(os.environ.get("GEMINI_SLOW_SECONDS", "30"))
+# Retries of a failed upstream call, with full-jitter exponential backoff
+UPSTREAM_RETRIES = int(os.environ.get("UPSTREAM_RETRIES", "2"))
+RETRY_BASE_MS = float(os.environ.get("RETRY_BASE_MS", "100"))
+RETRY_MAX_MS = float(os.environ.get("RETRY_MAX_MS", "2000"))
+# A hedged call is sent again once it is slower than this percentile of recent calls
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_DELAY_MS = float(os.environ.get("HEDGE_MIN_DELAY_MS", "20"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+# Consecutive failures that open a circuit, and how long it stays open before a probe
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", "30"))
+
+# Transient errors of the Vertex AI (google.api_core) and Chroma (httpx) clients
+RETRYABLE_ERRORS = {
+    "ResourceExhausted",
+    "TooManyRequests",
+    "ServiceUnavailable",
+    "InternalServerError",
+    "DeadlineExceeded",
+    "Aborted",
+    "ConnectError",
+    "ConnectTimeout",
+    "ReadError",
+    "ReadTimeout",
+    "RemoteProtocolError",
+}
+
+
+class CircuitOpen(Exception):
+    """An upstream is failing; calls are refused until retry_after seconds have passed"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+def backoff_seconds(attempt: int, base_ms: float = RETRY_BASE_MS, max_ms: float = RETRY_MAX_MS) -> float:
+    """Full jitter: a random delay up to the exponential backoff for this attempt"""
+    return random.uniform(0, min(max_ms, base_ms * 2 ** attempt)) / 1000
+
+
+class Deadline:
+    """
+    Time left for a request. Each stage runs within its own budget, capped by
+    what is left of the request's deadline.
+    """
+
+    def __init__(self, seconds: float = REQUEST_DEADLINE_SECONDS):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def budget(self, stage_seconds: Optional[float] = None) -> float:
+        remaining = self.remaining()
+        return remaining if stage_seconds is None else min(stage_seconds, remaining)
+
+    async def run(self, awaitable: Awaitable, stage_seconds: Optional[float] = None) -> Any:
+        """
+        Await a stage within its budget.
+
+        Raises:
+            asyncio.TimeoutError: The stage used up its budget or the deadline has passed
+        """
+        timeout = self.budget(stage_seconds)
+        if timeout <= 0:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise asyncio.TimeoutError("Request deadline exceeded")
+        return await asyncio.wait_for(awaitable, timeout)
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream after failure_threshold consecutive failures.
+    While open, calls fail fast with CircuitOpen; after reset_seconds one
+    probe call is let through, which closes the circuit if it succeeds and
+    keeps it open for another reset_seconds otherwise.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_seconds: float = BREAKER_RESET_SECONDS,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.opens = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.reset_seconds else "half_open"
+
+    def allow(self) -> None:
+        """
+        Raises:
+            CircuitOpen: The circuit is open, or a probe call is already in flight
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            elapsed = time.monotonic() - self.opened_at
+            if elapsed >= self.reset_seconds:
+                # Let this call probe the upstream; others wait for another period
+                self.opened_at = time.monotonic()
+                return
+            self.rejected += 1
+            raise CircuitOpen(self.name, self.reset_seconds - elapsed)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            if self.opened_at is not None:
+                print(f"Circuit '{self.name}' closed")
+                self.opened_at = None
+                circuit_open.set(0, upstream=self.name)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"Circuit '{self.name}' opened after {self.failures} failures")
+                    self.opens += 1
+                self.opened_at = time.monotonic()
+                circuit_open.set(1, upstream=self.name)
+
+    def stats(self) -> Dict:
+        return {"state": self.state, "failures": self.failures, "opens": self.opens, "rejected": self.rejected}
+
+
+class LatencyTracker:
+    """Latencies of the most recent successful calls, for the hedging delay"""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, fraction: float, min_samples: int = HEDGE_MIN_SAMPLES) -> Optional[float]:
+        if len(self._samples) < min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Upstream:
+    """
+    Call policy for one upstream service: circuit breaker, a timeout per
+    call, retries of transient errors with jittered backoff within that
+    timeout, and optionally hedging, i.e. sending a second identical request
+    when the first is slower than HEDGE_PERCENTILE of recent calls and using
+    whichever answers first. Only idempotent calls may be hedged.
+
+    Only transient errors count against the circuit. A timeout counts only
+    if the call had at least slow_seconds (default: the timeout), so calls
+    cut short by a caller's nearly spent deadline do not open it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        retries: int = UPSTREAM_RETRIES,
+        hedge: bool = False,
+        breaker: Optional[CircuitBreaker] = None,
+        slow_seconds: Optional[float] = None,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.slow_seconds = timeout if slow_seconds is None else slow_seconds
+        self.retries = retries
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker(name)
+        self.latency = LatencyTracker()
+        self.calls = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def hedge_delay(self) -> float:
+        """Wait before hedging: the latency percentile, or half the timeout until there are enough samples"""
+        delay = self.latency.percentile(HEDGE_PERCENTILE)
+        if delay is None:
+            delay = self.timeout / 2
+        return max(HEDGE_MIN_DELAY_MS / 1000, delay)
+
+    async def call(
+        self, make_call: Callable[[], Awaitable], timeout: Optional[float] = None, retries: Optional[int] = None
+    ) -> Any:
+        """
+        Call the upstream under the policy.
+
+        Args:
+            make_call: Starts one request, e.g. lambda: client.query(...)
+            timeout: Total time for the call and its retries (default: the upstream's timeout)
+            retries: Retries of transient errors (default: the upstream's retries)
+
+        Raises:
+            CircuitOpen: The upstream's circuit is open
+            asyncio.TimeoutError: No attempt succeeded in time
+        """
+        budget = self.timeout if timeout is None else timeout
+        expires_at = time.monotonic() + budget
+        retries = self.retries if retries is None else retries
+        self.calls += 1
+        attempt = 0
+        while True:
+            self.breaker.allow()
+            start = time.perf_counter()
+            try:
+                remaining = expires_at - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError(f"{self.name} call timed out")
+                result = await asyncio.wait_for(self._attempt(make_call), remaining)
+            except Exception as e:
+                if self.is_failure(e, budget):
+                    self.breaker.record_failure()
+                delay = backoff_seconds(attempt)
+                if attempt >= retries or not is_retryable(e) or time.monotonic() + delay >= expires_at:
+                    raise
+                print(f"Retrying {self.name} call in {delay:.2f}s after: {type(e).__name__} {str(e)}")
+                attempt += 1
+                self.retried += 1
+                upstream_retries.inc(upstream=self.name)
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            self.latency.observe(time.perf_counter() - start)
+            return result
+
+    def is_failure(self, error: BaseException, budget: float) -> bool:
+        """Whether an error is the upstream's fault, i.e. counts against its circuit"""
+        if isinstance(error, asyncio.TimeoutError):
+            return budget >= self.slow_seconds
+        return is_retryable(error)
+
+    async def _attempt(self, make_call: Callable[[], Awaitable]) -> Any:
+        if not self.hedge:
+            return await make_call()
+        first = asyncio.ensure_future(make_call())
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay())
+            if not done:
+                self.hedged += 1
+                upstream_hedges.inc(upstream=self.name)
+                tasks.add(asyncio.ensure_future(make_call()))
+            # The first success wins; fail only if every request failed
+            error: Optional[BaseException] = None
+            pending = tasks
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict:
+        return {
+            "timeout": self.timeout,
+            "calls": self.calls,
+            "retried": self.retried,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1) if self.hedge else None,
+            "circuit": self.breaker.stats(),
+        }
@@ -0,0 +1,163 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+# Default capacity of the chat session cache
+SESSION_CACHE_MAX_ENTRIES = int(os.environ.get("SESSION_CACHE_MAX_ENTRIES", "1000"))
+SESSION_CACHE_MAX_BYTES = int(os.environ.get("SESSION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_CACHE_TTL_SECONDS = float(os.environ.get("SESSION_CACHE_TTL_SECONDS", "3600"))
+
+# Rough fixed cost of a session object and of each history entry
+SESSION_OVERHEAD_BYTES = 2048
+CONTENT_OVERHEAD_BYTES = 256
+
+
+def estimate_session_bytes(session: Any) -> int:
+    """
+    Estimate the memory held by a chat session from the text in its history.
+
+    Args:
+        session: A chat session exposing 'history' as a list of contents with 'parts'
+
+    Returns:
+        int: Estimated size in bytes
+    """
+    size = SESSION_OVERHEAD_BYTES
+    for content in getattr(session, "history", None) or []:
+        size += CONTENT_OVERHEAD_BYTES
+        for part in getattr(content, "parts", None) or []:
+            try:
+                text = part.text
+            except (AttributeError, ValueError):
+                text = None
+            if isinstance(text, str):
+                size += len(text.encode("utf-8"))
+    return size
+
+
+class SessionCache:
+    """
+    Bounded LRU cache of chat sessions with an idle TTL.
+
+    Entries are evicted least recently used first once either the entry count
+    or the estimated byte size exceeds its limit, and expire after ttl_seconds
+    without being accessed. Evicted sessions are rebuilt from the chat history.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SESSION_CACHE_MAX_ENTRIES,
+        max_bytes: int = SESSION_CACHE_MAX_BYTES,
+        ttl_seconds: float = SESSION_CACHE_TTL_SECONDS,
+        size_fn: Callable[[Any], int] = estimate_session_bytes,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.size_fn = size_fn
+        self.clock = clock
+        # key -> (session, size, last access time), least recently used first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, last_access: float, now: float) -> bool:
+        return bool(self.ttl_seconds) and now - last_access > self.ttl_seconds
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _evict(self, now: float) -> None:
+        # Idle entries sit at the front, since access order is LRU order
+        while self._entries:
+            key, (_, _, last_access) = next(iter(self._entries.items()))
+            if not self._expired(last_access, now):
+                break
+            self._remove(key)
+            self.expirations += 1
+
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Get a session and mark it as recently used"""
+        with self._lock:
+            now = self.clock()
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[2], now):
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+
+            session, size, _ = entry
+            self._entries[key] = (session, size, now)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return session
+
+    def put(self, key: str, session: Any) -> None:
+        """Add or update a session, re-estimating its size"""
+        size = self.size_fn(session)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (session, size, self.clock())
+            self._bytes += size
+            self._evict(self.clock())
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        """Remove a session from the cache"""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            session = self._entries[key][0]
+            self._remove(key)
+            return session
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __setitem__(self, key: str, session: Any) -> None:
+        self.put(key, session)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry[2], self.clock())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the cache counters and current usage"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,138 @@
+import os
+import time
+import asyncio
+import threading
+import traceback
+from typing import Any, Awaitable, Callable, Dict, Optional
+from api.utils.concurrency import run_blocking
+
+# Delay before retrying a failed warm-up step, doubled per failure up to the maximum
+STARTUP_RETRY_SECONDS = float(os.environ.get("STARTUP_RETRY_SECONDS", "1"))
+STARTUP_MAX_RETRY_SECONDS = float(os.environ.get("STARTUP_MAX_RETRY_SECONDS", "30"))
+
+
+class LazyResource:
+    """
+    A client created on first use instead of at import.
+
+    The factory runs once, under a lock so concurrent first callers share it;
+    if it raises, the error is kept for the status and the next call tries
+    again, so a backend that is not up yet does not break the process.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self.name = name
+        self.factory = factory
+        self._value: Any = None
+        self._ready = False
+        self._lock = threading.Lock()
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def get(self) -> Any:
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                start = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.seconds = time.perf_counter() - start
+                self.error = None
+                self._ready = True
+        return self._value
+
+    async def aget(self) -> Any:
+        """Get the resource, creating it on the blocking executor if needed"""
+        if self._ready:
+            return self._value
+        return await run_blocking(self.get)
+
+    def reset(self) -> None:
+        """Drop the resource so the next use creates it again"""
+        with self._lock:
+            self._value = None
+            self._ready = False
+            self.seconds = None
+            self.error = None
+
+
+class WarmUp:
+    """
+    Start-up steps run concurrently in the background once the app is serving.
+
+    Each step is retried with exponential backoff until it succeeds, so the
+    service starts even if a backend is down, and reports ready once every
+    step has succeeded.
+    """
+
+    def __init__(
+        self,
+        steps: Dict[str, Callable[[], Awaitable]],
+        retry_seconds: float = STARTUP_RETRY_SECONDS,
+        max_retry_seconds: float = STARTUP_MAX_RETRY_SECONDS,
+    ):
+        self.steps = steps
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._status: Dict[str, Dict] = {
+            name: {"ready": False, "attempts": 0, "seconds": None, "error": None} for name in steps
+        }
+        self._task: Optional[asyncio.Task] = None
+        self._started_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return all(status["ready"] for status in self._status.values())
+
+    def start(self) -> None:
+        if self._task is None:
+            self._started_at = time.perf_counter()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        await asyncio.gather(*(self._run_step(name, step) for name, step in self.steps.items()))
+        print(f"Warm-up finished in {time.perf_counter() - self._started_at:.2f}s")
+
+    async def _run_step(self, name: str, step: Callable[[], Awaitable]) -> None:
+        status = self._status[name]
+        delay = self.retry_seconds
+        while True:
+            status["attempts"] += 1
+            start = time.perf_counter()
+            try:
+                await step()
+            except Exception as e:
+                print(f"Warm-up step '{name}' failed (attempt {status['attempts']}), retrying in {delay:g}s: {str(e)}")
+                if status["attempts"] == 1:
+                    traceback.print_exc()
+                status["error"] = str(e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_seconds)
+                continue
+            status.update(ready=True, seconds=round(time.perf_counter() - start, 3), error=None)
+            return
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the steps to finish; returns whether the app is ready"""
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.ready
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def status(self) -> Dict:
+        return {"ready": self.ready, "steps": {name: dict(status) for name, status in self._status.items()}}
@@ -0,0 +1,138 @@
+import numpy as np
+from typing import Dict, List, Tuple
+from api.utils.biomarkers import (
+    BIOMARKERS,
+    BIOMARKER_INDEX,
+    LOW_BOUNDS,
+    HIGH_BOUNDS,
+    to_number,
+)
+
+
+def panel_matrix(panels: List[Dict]) -> Tuple[List[str], np.ndarray]:
+    """
+    Load blood test panels into one columnar structure.
+
+    Args:
+        panels: One csv row per panel, oldest first
+
+    Returns:
+        Tuple[List[str], np.ndarray]: The known biomarkers present in any
+        panel, and their values of shape (panels, markers), NaN when missing
+    """
+    markers = [marker for marker in BIOMARKER_INDEX if any(marker in panel for panel in panels)]
+    values = np.array(
+        [[to_number(panel.get(marker)) for marker in markers] for panel in panels], dtype=np.float64
+    ).reshape(len(panels), len(markers))
+    return markers, values
+
+
+def compute_trends(markers: List[str], values: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Compute per-biomarker trends over panels, vectorized across markers.
+
+    Args:
+        markers: Known biomarker names, one per column of values
+        values: Array of shape (panels, markers), oldest first; NaN for missing values
+
+    Returns:
+        Dict[str, np.ndarray]: One array per statistic, indexed by marker:
+        count of measured panels, first, previous and latest values, delta
+        (latest - previous), change (latest - first), slope (least squares,
+        per panel), status (-1 low, 0 normal, 1 high for the latest value,
+        NaN if never measured) and crossings (how often the value moved in or
+        out of its normal range between consecutive measurements)
+    """
+    columns = np.array([BIOMARKER_INDEX[marker] for marker in markers], dtype=int)
+    panels = values.shape[0]
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=0)
+    rows = np.arange(panels)[:, None]
+    measured = count > 0
+
+    # Row of the first, latest and previous measurement of each marker (0 when there is none)
+    latest_row = np.where(valid, rows, -1).max(axis=0)
+    first_row = np.where(valid, rows, panels).min(axis=0)
+    previous_row = np.where(valid & (rows < latest_row), rows, -1).max(axis=0)
+    cols = np.arange(len(markers))
+    first = np.where(measured, values[np.clip(first_row, 0, panels - 1), cols], np.nan)
+    latest = np.where(measured, values[np.clip(latest_row, 0, panels - 1), cols], np.nan)
+    previous = np.where(previous_row >= 0, values[np.clip(previous_row, 0, panels - 1), cols], np.nan)
+
+    # Least squares slope over the measured panels
+    x = np.where(valid, rows, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = x.sum(axis=0) / count
+        y_mean = np.where(valid, values, 0.0).sum(axis=0) / count
+        dx = np.where(valid, rows - x_mean, 0.0)
+        dy = np.where(valid, values - y_mean, 0.0)
+        slope = (dx * dy).sum(axis=0) / (dx * dx).sum(axis=0)
+    slope = np.where(count > 1, slope, np.nan)
+
+    # Range status of every value, carried forward over missing values
+    codes = np.where(values < LOW_BOUNDS[columns], -1.0, np.where(values > HIGH_BOUNDS[columns], 1.0, 0.0))
+    carried = np.maximum.accumulate(np.where(valid, rows, 0), axis=0)
+    carried_codes = codes[carried, cols]
+    seen_before = np.maximum.accumulate(valid, axis=0)[:-1]
+    crossings = ((carried_codes[1:] != carried_codes[:-1]) & valid[1:] & seen_before).sum(axis=0)
+
+    return {
+        "count": count,
+        "first": first,
+        "previous": previous,
+        "latest": latest,
+        "delta": latest - previous,
+        "change": latest - first,
+        "slope": slope,
+        "status": np.where(measured, codes[np.clip(latest_row, 0, panels - 1), cols], np.nan),
+        "crossings": crossings,
+    }
+
+
+STATUS_NAMES = {-1.0: "LOW", 0.0: "normal", 1.0: "HIGH"}
+
+
+def build_trend_prompt(panels: List[Dict]) -> str:
+    """
+    Summarize how the biomarkers changed across a chat's blood tests. The
+    summary has one line per marker that is out of range or crossed its
+    range, whatever the number of panels, so the prompt stays small.
+
+    Args:
+        panels: One csv row per uploaded blood test, oldest first
+
+    Returns:
+        str: The trend summary, empty when there are fewer than two panels
+    """
+    if len(panels) < 2:
+        return ""
+    markers, values = panel_matrix(panels)
+    if not markers:
+        return ""
+    trends = compute_trends(markers, values)
+
+    changed, stable = [], []
+    for column, marker in enumerate(markers):
+        if trends["count"][column] < 2:
+            continue
+        status = trends["status"][column]
+        if status == 0 and trends["crossings"][column] == 0:
+            stable.append(marker)
+            continue
+        biomarker = BIOMARKERS[BIOMARKER_INDEX[marker]]
+        line = (
+            f"- {marker} ({biomarker.definition}): {trends['first'][column]:g} -> "
+            f"{trends['previous'][column]:g} -> {trends['latest'][column]:g} {biomarker.unit} "
+            f"(first, previous, latest), {trends['delta'][column]:+g} since the previous test, "
+            f"slope {trends['slope'][column]:+.3g} per test, now {STATUS_NAMES[status]} "
+            f"(normal range {biomarker.describe_range()})"
+        )
+        if trends["crossings"][column]:
+            line += f", crossed the range boundary {int(trends['crossings'][column])} time(s)"
+        changed.append(line)
+
+    lines = [f"Trends across the {len(panels)} blood tests in this chat (oldest first):"]
+    lines.extend(changed)
+    if stable:
+        lines.append("Within the normal range in every test: " + ", ".join(stable) + ".")
+    return "\n".join(lines) + "\n"
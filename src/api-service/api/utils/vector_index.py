@@ -0,0 +1,189 @@
+import os
+import glob
+import json
+import tempfile
+import threading
+import traceback
+import numpy as np
+from typing import Dict, List, Optional
+from api.utils.history_store import atomic_write
+
+# Directory holding the local replica of the knowledge base; disabled when empty
+VECTOR_INDEX_PATH = os.environ.get("VECTOR_INDEX_PATH", "")
+# Storage type of the replica matrix: float32, or float16 to halve its size
+VECTOR_INDEX_DTYPE = os.environ.get("VECTOR_INDEX_DTYPE", "float32")
+# Rows fetched from Chroma per request when exporting a snapshot
+VECTOR_INDEX_EXPORT_BATCH = 1000
+
+
+class IndexSnapshot:
+    """A loaded snapshot: the embedding matrix (memory-mapped) and the rows' ids, documents and metadata"""
+
+    def __init__(self, version: str, matrix: np.ndarray, ids: List[str], documents: List[str], metadatas: List[Dict]):
+        self.version = version
+        self.matrix = matrix
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+
+
+class VectorIndex:
+    """
+    In-process replica of a Chroma collection answering top-k queries with exact search.
+
+    A snapshot is exported from Chroma into <path>/<collection>-<version>.npy, a
+    matrix of unit-normalized embeddings, next to <path>/<collection>.json with
+    the version (the collection id), ids, documents and metadata. The JSON file
+    is replaced last, so readers always see a complete snapshot. The matrix is
+    memory-mapped, and queries return the same shape as collection.query with
+    cosine distances, matching the collection's hnsw:space.
+    """
+
+    def __init__(self, path: str, collection_name: str, dtype: str = VECTOR_INDEX_DTYPE):
+        self.path = path
+        self.collection_name = collection_name
+        self.dtype = np.dtype(dtype)
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._build_lock = threading.Lock()
+        self.queries = 0
+        self.builds = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    @property
+    def version(self) -> Optional[str]:
+        snapshot = self._snapshot
+        return snapshot.version if snapshot is not None else None
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.path, f"{self.collection_name}.json")
+
+    def _matrix_path(self, version: str) -> str:
+        return os.path.join(self.path, f"{self.collection_name}-{version}.npy")
+
+    def load(self) -> bool:
+        """Load the snapshot on disk, if any; returns whether one is available"""
+        if not self.enabled or not os.path.exists(self._manifest_path()):
+            return False
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                manifest = json.load(f)
+            matrix = np.load(self._matrix_path(manifest["version"]), mmap_mode="r")
+            if matrix.shape[0] != len(manifest["ids"]):
+                raise ValueError(f"Snapshot has {matrix.shape[0]} rows for {len(manifest['ids'])} ids")
+            self._snapshot = IndexSnapshot(
+                manifest["version"], matrix, manifest["ids"], manifest["documents"], manifest["metadatas"]
+            )
+            self._remove_old_matrices(manifest["version"])
+            return True
+        except Exception as e:
+            print(f"Error loading vector index from {self.path}: {str(e)}")
+            traceback.print_exc()
+            return False
+
+    def _remove_old_matrices(self, version: str) -> None:
+        # Mapped files stay readable after unlinking, so in-flight searches are unaffected
+        current = self._matrix_path(version)
+        for filepath in glob.glob(os.path.join(self.path, f"{self.collection_name}-*.npy")):
+            if filepath != current:
+                os.remove(filepath)
+
+    def build(self, collection) -> None:
+        """Export a snapshot of the Chroma collection (synchronous client) and load it"""
+        with self._build_lock:
+            version = str(collection.id)
+            if version == self.version:
+                return
+
+            ids, documents, metadatas, embeddings = [], [], [], []
+            offset = 0
+            while True:
+                page = collection.get(
+                    include=["embeddings", "documents", "metadatas"],
+                    limit=VECTOR_INDEX_EXPORT_BATCH,
+                    offset=offset,
+                )
+                if not page["ids"]:
+                    break
+                ids.extend(page["ids"])
+                documents.extend(page["documents"])
+                metadatas.extend(page["metadatas"] or [{} for _ in page["ids"]])
+                embeddings.extend(page["embeddings"])
+                offset += len(page["ids"])
+
+            matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = (matrix / norms).astype(self.dtype)
+
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=".", suffix=".npy")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, matrix)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self._matrix_path(version))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            manifest = {"version": version, "ids": ids, "documents": documents, "metadatas": metadatas}
+            atomic_write(self._manifest_path(), json.dumps(manifest))
+            self.builds += 1
+            print(f"Built vector index for '{self.collection_name}' ({version}): {len(ids)} rows")
+            self.load()
+
+    def is_fresh(self, version: Optional[str]) -> bool:
+        """
+        Whether the replica can answer queries for the given collection version.
+        An unknown version (Chroma not reached yet) is served from the snapshot.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return False
+        return version is None or version == snapshot.version
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, include: Optional[List[str]] = None) -> Dict:
+        """Exact top-k search by cosine distance, shaped like collection.query; include may add the embeddings"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise RuntimeError(f"Vector index for '{self.collection_name}' is not loaded")
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        similarities = (queries / norms) @ snapshot.matrix.T
+
+        k = min(n_results, len(snapshot.ids))
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if include and "embeddings" in include:
+            results["embeddings"] = []
+        for row in similarities:
+            if k == 0:
+                top = np.array([], dtype=int)
+            else:
+                top = np.argpartition(-row, k - 1)[:k]
+                top = top[np.argsort(-row[top])]
+            results["ids"].append([snapshot.ids[i] for i in top])
+            results["documents"].append([snapshot.documents[i] for i in top])
+            results["metadatas"].append([snapshot.metadatas[i] for i in top])
+            results["distances"].append([float(1.0 - row[i]) for i in top])
+            if "embeddings" in results:
+                results["embeddings"].append(np.asarray(snapshot.matrix[top], dtype=np.float32).tolist())
+        self.queries += 1
+        return results
+
+    def stats(self) -> Dict:
+        snapshot = self._snapshot
+        return {
+            "enabled": self.enabled,
+            "loaded": snapshot is not None,
+            "version": snapshot.version if snapshot is not None else None,
+            "rows": len(snapshot.ids) if snapshot is not None else 0,
+            "dtype": self.dtype.name,
+            "queries": self.queries,
+            "builds": self.builds,
+        }
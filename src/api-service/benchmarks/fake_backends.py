@@ -0,0 +1,325 @@
+"""
+Local stand-ins for Vertex AI and ChromaDB, so the API service can be
+benchmarked offline. Every call sleeps for a configurable latency (with
+jitter) and returns deterministic data; ChromaDB is an in-process
+EphemeralClient seeded with synthetic chunks.
+
+install() must run before the api package is imported.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import types
+import random
+import asyncio
+import hashlib
+import numpy as np
+from typing import Dict, List, Optional
+
+EMBEDDING_DIMENSION = 256
+KNOWLEDGE_BASE_COLLECTION = "semantic-split-collection"
+MARKER_CONTEXT_COLLECTION = "semantic-split-marker-context"
+
+
+class Latency:
+    """Simulated latency of a backend call: base milliseconds plus up to +/- jitter (fraction)"""
+
+    def __init__(self, base_ms: float, jitter: float = 0.2, seed: int = 0):
+        self.base_ms = base_ms
+        self.jitter = jitter
+        self._random = random.Random(seed)
+
+    def seconds(self) -> float:
+        spread = self.base_ms * self.jitter
+        return max(0.0, self.base_ms + self._random.uniform(-spread, spread)) / 1000
+
+    async def wait(self) -> None:
+        await asyncio.sleep(self.seconds())
+
+    def wait_sync(self) -> None:
+        time.sleep(self.seconds())
+
+
+class BackendConfig:
+    """Latencies of the fake backends, in milliseconds"""
+
+    def __init__(
+        self,
+        embed_ms: float = 40,
+        generate_ms: float = 800,
+        first_token_ms: float = 300,
+        stream_chunks: int = 8,
+        chroma_ms: float = 5,
+        jitter: float = 0.2,
+        documents: int = 2000,
+        seed: int = 0,
+    ):
+        self.embed = Latency(embed_ms, jitter, seed)
+        self.generate = Latency(generate_ms, jitter, seed + 1)
+        self.first_token = Latency(first_token_ms, jitter, seed + 2)
+        self.stream_chunks = stream_chunks
+        self.chroma = Latency(chroma_ms, jitter, seed + 3)
+        self.documents = documents
+        self.seed = seed
+
+    def describe(self) -> Dict:
+        return {
+            "embed_ms": self.embed.base_ms,
+            "generate_ms": self.generate.base_ms,
+            "first_token_ms": self.first_token.base_ms,
+            "stream_chunks": self.stream_chunks,
+            "chroma_ms": self.chroma.base_ms,
+            "jitter": self.embed.jitter,
+            "documents": self.documents,
+        }
+
+
+def fake_embedding(text: str, dimension: int = EMBEDDING_DIMENSION) -> List[float]:
+    """A deterministic unit vector for a text"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+# Vertex AI
+
+class Obj:
+    def __init__(self, *args, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Part:
+    def __init__(self, text: str):
+        self.text = text
+
+    @staticmethod
+    def from_text(text: str) -> "Part":
+        return Part(text)
+
+
+class Content:
+    def __init__(self, role: Optional[str] = None, parts: Optional[List[Part]] = None):
+        self.role = role
+        self.parts = parts or []
+
+
+class Response:
+    def __init__(self, text: str, prompt_tokens: int = 0, candidate_tokens: int = 0):
+        self.text = text
+        self.usage_metadata = Obj(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=candidate_tokens,
+            total_token_count=prompt_tokens + candidate_tokens,
+        )
+
+
+def count_tokens(parts) -> int:
+    return sum(len(part) // 4 if isinstance(part, str) else len(getattr(part, "text", "")) // 4 for part in parts)
+
+
+ANSWER = (
+    "Your results show values outside the reference range. This summary is produced "
+    "by the benchmark backend and has roughly the length of a typical answer. "
+) * 4
+
+
+class FakeChatSession:
+    def __init__(self, config: BackendConfig, history: Optional[List[Content]] = None):
+        self.config = config
+        self.history = list(history or [])
+
+    def _record(self, parts) -> int:
+        self.history.append(Content("user", [Part.from_text(part) if isinstance(part, str) else part for part in parts]))
+        self.history.append(Content("model", [Part.from_text(ANSWER)]))
+        return count_tokens([content.parts[0] for content in self.history])
+
+    def send_message(self, parts, **kwargs) -> Response:
+        self.config.generate.wait_sync()
+        return Response(ANSWER, self._record(parts), len(ANSWER) // 4)
+
+    async def send_message_async(self, parts, stream: bool = False, **kwargs):
+        prompt_tokens = self._record(parts)
+        if not stream:
+            await self.config.generate.wait()
+            return Response(ANSWER, prompt_tokens, len(ANSWER) // 4)
+
+        chunks = self.config.stream_chunks
+        size = -(-len(ANSWER) // chunks)
+
+        async def responses():
+            await self.config.first_token.wait()
+            remaining = max(0.0, self.config.generate.seconds() - self.config.first_token.base_ms / 1000)
+            for index in range(chunks):
+                if index:
+                    await asyncio.sleep(remaining / chunks)
+                last = index == chunks - 1
+                yield Response(
+                    ANSWER[index * size:(index + 1) * size],
+                    prompt_tokens if last else 0,
+                    len(ANSWER) // 4 if last else 0,
+                )
+
+        return responses()
+
+
+def install_vertexai(config: BackendConfig) -> None:
+    """Replace the Vertex AI SDK modules with latency-injecting fakes"""
+
+    class TextEmbeddingModel:
+        @staticmethod
+        def from_pretrained(name: str) -> "TextEmbeddingModel":
+            return TextEmbeddingModel()
+
+        def get_embeddings(self, inputs, **kwargs):
+            config.embed.wait_sync()
+            return [Obj(values=fake_embedding(item.text)) for item in inputs]
+
+        async def get_embeddings_async(self, inputs, **kwargs):
+            await config.embed.wait()
+            return [Obj(values=fake_embedding(item.text)) for item in inputs]
+
+    class GenerativeModel:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def start_chat(self, history: Optional[List[Content]] = None, **kwargs) -> FakeChatSession:
+            return FakeChatSession(config, history)
+
+        async def generate_content_async(self, contents, **kwargs) -> Response:
+            await config.generate.wait()
+            return Response(ANSWER, count_tokens(contents), len(ANSWER) // 4)
+
+    class SafetySetting(Obj):
+        class HarmCategory:
+            HARM_CATEGORY_HATE_SPEECH = 1
+            HARM_CATEGORY_DANGEROUS_CONTENT = 2
+            HARM_CATEGORY_SEXUALLY_EXPLICIT = 3
+            HARM_CATEGORY_HARASSMENT = 4
+
+        class HarmBlockThreshold:
+            BLOCK_ONLY_HIGH = 1
+
+    vertexai = types.ModuleType("vertexai")
+    vertexai.init = lambda **kwargs: None
+    language_models = types.ModuleType("vertexai.language_models")
+    language_models.TextEmbeddingInput = lambda task_type=None, text="": Obj(task_type=task_type, text=text)
+    language_models.TextEmbeddingModel = TextEmbeddingModel
+    generative_models = types.ModuleType("vertexai.generative_models")
+    generative_models.GenerativeModel = GenerativeModel
+    generative_models.ChatSession = FakeChatSession
+    generative_models.SafetySetting = SafetySetting
+    generative_models.GenerationConfig = Obj
+    generative_models.ToolConfig = Obj
+    generative_models.Content = Content
+    generative_models.Part = Part
+    vertexai.language_models = language_models
+    vertexai.generative_models = generative_models
+    sys.modules.update({
+        "vertexai": vertexai,
+        "vertexai.language_models": language_models,
+        "vertexai.generative_models": generative_models,
+    })
+
+
+# ChromaDB
+
+class LocalCollection:
+    """A collection of the in-process client, with the simulated network latency"""
+
+    def __init__(self, collection, config: BackendConfig):
+        self._collection = collection
+        self.config = config
+        self.id = collection.id
+        self.name = collection.name
+        self.metadata = collection.metadata
+
+    def query(self, **kwargs):
+        self.config.chroma.wait_sync()
+        return self._collection.query(**kwargs)
+
+    def get(self, **kwargs):
+        self.config.chroma.wait_sync()
+        return self._collection.get(**kwargs)
+
+    def count(self) -> int:
+        return self._collection.count()
+
+
+class LocalAsyncCollection(LocalCollection):
+    """Async view of a collection; searches run on a thread like a request would"""
+
+    async def query(self, **kwargs):
+        await self.config.chroma.wait()
+        return await asyncio.to_thread(self._collection.query, **kwargs)
+
+    async def get(self, **kwargs):
+        await self.config.chroma.wait()
+        return await asyncio.to_thread(self._collection.get, **kwargs)
+
+    async def count(self) -> int:
+        return self._collection.count()
+
+
+def seed_collections(client, config: BackendConfig) -> None:
+    """Create the knowledge base and biomarker context collections with synthetic chunks"""
+    from api.utils.biomarkers import BIOMARKERS
+
+    rng = random.Random(config.seed)
+    words = ["blood", "cell", "count", "range", "iron", "platelet", "anemia", "infection", "marrow", "plasma"]
+    collection = client.get_or_create_collection(KNOWLEDGE_BASE_COLLECTION, metadata={"hnsw:space": "cosine"})
+    for start in range(0, config.documents, 500):
+        ids = [str(index) for index in range(start, min(start + 500, config.documents))]
+        documents = [" ".join(rng.choice(words) for _ in range(120)) + f" ({index})" for index in ids]
+        collection.add(ids=ids, documents=documents, embeddings=[fake_embedding(document) for document in documents])
+
+    context = client.get_or_create_collection(
+        MARKER_CONTEXT_COLLECTION, metadata={"hnsw:space": "cosine", "source": str(collection.id)}
+    )
+    keys = [f"{marker}:{status}" for marker in (biomarker.name for biomarker in BIOMARKERS) for status in ("low", "high")]
+    context.add(
+        ids=keys,
+        documents=[json.dumps([f"Chunk {rank} about {key}" for rank in range(3)]) for key in keys],
+        embeddings=[fake_embedding(key) for key in keys],
+    )
+
+
+def install_chromadb(config: BackendConfig) -> None:
+    """Point the ChromaDB HTTP clients at a seeded in-process client"""
+    os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+    logging.getLogger("chromadb.telemetry.product.posthog").setLevel(logging.CRITICAL)
+    import chromadb
+    from chromadb.config import Settings
+
+    client = chromadb.EphemeralClient(Settings(anonymized_telemetry=False))
+    seed_collections(client, config)
+
+    class LocalHttpClient:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def get_collection(self, name: str, **kwargs) -> LocalCollection:
+            return LocalCollection(client.get_collection(name), config)
+
+        def heartbeat(self) -> int:
+            return client.heartbeat()
+
+    class LocalAsyncClient:
+        async def get_collection(self, name: str, **kwargs) -> LocalAsyncCollection:
+            await config.chroma.wait()
+            return LocalAsyncCollection(client.get_collection(name), config)
+
+        async def heartbeat(self) -> int:
+            return client.heartbeat()
+
+    async def async_http_client(*args, **kwargs) -> LocalAsyncClient:
+        return LocalAsyncClient()
+
+    chromadb.HttpClient = LocalHttpClient
+    chromadb.AsyncHttpClient = async_http_client
+
+
+def install(config: BackendConfig) -> None:
+    install_vertexai(config)
+    install_chromadb(config)
@@ -0,0 +1,303 @@
+"""
+Offline load test of the API service.
+
+Serves the FastAPI app with uvicorn in a child process, against local
+stand-ins for Vertex AI and ChromaDB (see fake_backends.py), drives it with
+concurrent HTTP requests and reports requests/sec, latency percentiles and
+time to first byte per scenario, plus how late the server's event loop ran
+timers while the scenario was running.
+
+    python benchmarks/run.py --output benchmarks/baselines/default.json
+    python benchmarks/run.py --baseline benchmarks/baselines/default.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import platform
+import contextlib
+import multiprocessing
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_backends import BackendConfig, install
+
+QUESTIONS = [
+    "What does a high white blood cell count mean?",
+    "What is hemoglobin?",
+    "Why would platelets be low?",
+    "What is a normal hematocrit?",
+    "What does MCV measure?",
+    "Can dehydration change blood test results?",
+    "What causes low lymphocytes?",
+    "What is the difference between RDW-SD and RDW-CV?",
+]
+PANEL = {"ID": 1, "WBC": 11.2, "LYMp": 18.0, "NEUTp": 72.5, "RBC": 4.1, "HGB": 10.4, "HCT": 33.0, "MCV": 79.0, "PLT": 420}
+
+# Route added to the benchmarked app to read and reset the loop lag samples
+LOOP_LAG_ROUTE = "/benchmark/loop-lag"
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    """Percentiles of durations (seconds) in milliseconds"""
+    return {
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 2),
+    }
+
+
+class LoopLagMonitor:
+    """Measure how late the event loop wakes up a task sleeping for a fixed interval"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: List[float] = []
+
+    async def run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def collect(self) -> Dict[str, float]:
+        """Summarize the samples since the last call and start over"""
+        lags, self.lags = self.lags, []
+        return summarize(lags)
+
+
+def serve(backends: Dict, ready) -> None:
+    """Child process: run the app against the fake backends and report its port"""
+    import uvicorn
+
+    # The service reads its settings at import and keeps chat history in the working directory
+    os.environ.setdefault("GCP_PROJECT", "benchmark")
+    os.environ.setdefault("CHROMADB_HOST", "localhost")
+    os.environ.setdefault("CHROMADB_PORT", "8000")
+    # Scenarios send many requests per session; admission control still applies
+    os.environ.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+    install(BackendConfig(**backends))
+    os.chdir(tempfile.mkdtemp(prefix="api-benchmark-"))
+    from api.service import app
+
+    monitor = LoopLagMonitor()
+    app.add_api_route(LOOP_LAG_ROUTE, monitor.collect, methods=["GET"])
+
+    async def main() -> None:
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", access_log=False))
+        serving = asyncio.create_task(server.serve())
+        while not server.started:
+            if serving.done():
+                serving.result()
+            await asyncio.sleep(0.01)
+        lag = asyncio.create_task(monitor.run())
+        ready.send(server.servers[0].sockets[0].getsockname()[1])
+        await serving
+        lag.cancel()
+
+    # The service prints a line per request
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        asyncio.run(main())
+
+
+class Scenario:
+    """A request to send repeatedly; make() returns (method, url, json body, session id) for the i-th request"""
+
+    def __init__(self, name: str, make: Callable[[int], tuple]):
+        self.name = name
+        self.make = make
+
+
+async def run_scenario(client, scenario: Scenario, requests: int, concurrency: int) -> Dict:
+    latencies: List[float] = []
+    first_bytes: List[float] = []
+    errors = 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(index: int) -> None:
+        nonlocal errors
+        method, url, body, session_id = scenario.make(index)
+        async with slots:
+            start = time.perf_counter()
+            try:
+                async with client.stream(method, url, json=body, headers={"X-Session-ID": session_id}) as response:
+                    first_byte = None
+                    async for _ in response.aiter_bytes():
+                        if first_byte is None:
+                            first_byte = time.perf_counter() - start
+                    if response.status_code >= 400:
+                        errors += 1
+                        return
+            except Exception as e:
+                print(f"Error in {scenario.name}: {str(e)}", file=sys.stderr)
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+            first_bytes.append(first_byte if first_byte is not None else latencies[-1])
+
+    await client.get(LOOP_LAG_ROUTE)
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    elapsed = time.perf_counter() - start
+    loop_lag = (await client.get(LOOP_LAG_ROUTE)).json()
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "concurrency": concurrency,
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        **summarize(latencies),
+        "ttfb_p50_ms": summarize(first_bytes)["p50_ms"],
+        "loop_lag": loop_lag,
+    }
+
+
+async def prepare_chats(client, count: int) -> List[Dict]:
+    """Create chats (each with an uploaded panel) for the scenarios that continue them"""
+    chats = []
+    for index in range(count):
+        session_id = f"bench-{index}"
+        response = await client.post(
+            "/llm-rag/chats",
+            json={"content": "", "file": [PANEL]},
+            headers={"X-Session-ID": session_id},
+        )
+        response.raise_for_status()
+        chats.append({**response.json(), "session_id": session_id})
+    return chats
+
+
+def build_scenarios(chats: List[Dict], seed: int) -> List[Scenario]:
+    rng = random.Random(seed)
+    questions = [rng.choice(QUESTIONS) + f" ({rng.randrange(40)})" for _ in range(1000)]
+    files = [chat["messages"][0]["file_path"] for chat in chats]
+    panels = [{**PANEL, "ID": row, "HGB": round(9 + row % 8, 1)} for row in range(20)]
+
+    def question(i: int) -> str:
+        return questions[i % len(questions)]
+
+    def chat(i: int) -> Dict:
+        return chats[i % len(chats)]
+
+    return [
+        Scenario("chat_start", lambda i: ("POST", "/llm-rag/chats", {"content": question(i)}, f"bench-{i}")),
+        Scenario("chat_start_stream", lambda i: ("POST", "/llm-rag/chats/stream", {"content": question(i)}, f"bench-{i}")),
+        Scenario("chat_continue", lambda i: (
+            "POST", f"/llm-rag/chats/{chat(i)['chat_id']}", {"content": question(i)}, chat(i)["session_id"]
+        )),
+        Scenario("panel_upload", lambda i: ("POST", "/llm-rag/chats", {"content": "", "file": [{**PANEL, "ID": i}]}, f"bench-{i}")),
+        Scenario("file_get", lambda i: ("GET", f"/llm-rag/{files[i % len(files)]}", None, "bench")),
+        Scenario("panels_interpret", lambda i: ("POST", "/llm-rag/panels/interpret", {"file": panels}, "bench")),
+        Scenario("chat_list", lambda i: ("GET", "/llm-rag/chats?limit=20", None, chat(i)["session_id"])),
+    ]
+
+
+async def benchmark(args, port: int) -> Dict:
+    import httpx
+
+    results: Dict = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+        chats = await prepare_chats(client, args.chats)
+        for scenario in build_scenarios(chats, args.seed):
+            if args.scenario and scenario.name not in args.scenario:
+                continue
+            requests = max(1, args.requests // 10) if scenario.name == "panels_interpret" else args.requests
+            results[scenario.name] = await run_scenario(client, scenario, requests, args.concurrency)
+            print(f"{scenario.name:18} {json.dumps(results[scenario.name])}")
+    return results
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Scenarios whose p95 latency or throughput is worse than the baseline by more than tolerance"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        if result["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} ms -> {result['p95_ms']} ms")
+        if result["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {previous['rps']} -> {result['rps']} requests/sec")
+        if result["errors"] > previous["errors"]:
+            regressions.append(f"{name}: {previous['errors']} -> {result['errors']} errors")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline load test of the API service")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32, help="Requests in flight")
+    parser.add_argument("--chats", type=int, default=20, help="Chats created for chat_continue and file_get")
+    parser.add_argument("--scenario", action="append", help="Run only this scenario (repeatable)")
+    parser.add_argument("--embed-ms", type=float, default=40)
+    parser.add_argument("--generate-ms", type=float, default=800)
+    parser.add_argument("--first-token-ms", type=float, default=300)
+    parser.add_argument("--chroma-ms", type=float, default=5)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency jitter, as a fraction of the base latency")
+    parser.add_argument("--documents", type=int, default=2000, help="Chunks in the local knowledge base")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file (e.g. a new baseline)")
+    parser.add_argument("--baseline", help="Compare the results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression against the baseline")
+    args = parser.parse_args(argv)
+
+    backends = dict(
+        embed_ms=args.embed_ms,
+        generate_ms=args.generate_ms,
+        first_token_ms=args.first_token_ms,
+        chroma_ms=args.chroma_ms,
+        jitter=args.jitter,
+        documents=args.documents,
+        seed=args.seed,
+    )
+
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    server = context.Process(target=serve, args=(backends, sender), daemon=True)
+    server.start()
+    try:
+        if not receiver.poll(300):
+            raise RuntimeError("The benchmark server did not start")
+        scenarios = asyncio.run(benchmark(args, receiver.recv()))
+    finally:
+        server.terminate()
+        server.join()
+
+    results = {
+        "created": int(time.time()),
+        "python": platform.python_version(),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "backends": BackendConfig(**backends).describe(),
+        "scenarios": scenarios,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(scenarios, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import os
+import sys
+import asyncio
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.admission import AdmissionController, AdmissionMiddleware, Rejected, SessionRateLimiter
+from api.utils.metrics import admission_rejections
+
+def test_controller_queues_then_hands_over_slots_in_order():
+    async def main():
+        controller = AdmissionController(max_concurrent=1, max_queue=2, queue_timeout=1)
+        order = []
+        await controller.acquire()
+
+        async def queued(name):
+            await controller.acquire()
+            order.append(name)
+
+        tasks = [asyncio.create_task(queued("first")), asyncio.create_task(queued("second"))]
+        await asyncio.sleep(0)
+        assert controller.queue_depth == 2
+
+        # The queue is full: the next request is rejected without waiting
+        with pytest.raises(Rejected) as rejected:
+            await controller.acquire()
+        assert rejected.value.reason == "queue_full"
+        assert rejected.value.retry_after > 0
+
+        controller.release()
+        await tasks[0]
+        controller.release()
+        await tasks[1]
+        controller.release()
+        return order, controller.stats()
+
+    order, stats = asyncio.run(main())
+    assert order == ["first", "second"]
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+    assert stats["admitted"] == 3 and stats["queued"] == 2
+    assert stats["rejected"]["queue_full"] == 1
+
+def test_controller_rejects_after_queue_timeout():
+    async def main():
+        controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.01)
+        await controller.acquire()
+        with pytest.raises(Rejected) as rejected:
+            await controller.acquire()
+        # The timed out request left the queue, so the slot returns to the pool
+        controller.release()
+        return rejected.value.reason, controller.stats()
+
+    reason, stats = asyncio.run(main())
+    assert reason == "queue_timeout"
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+
+def test_release_as_the_queue_wait_times_out():
+    async def main():
+        controller = AdmissionController(max_concurrent=1, max_queue=4, queue_timeout=0.01)
+        await controller.acquire()
+        queued = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        waiter = controller._waiters[0]
+        # The wait has timed out, but the request has not left the queue yet
+        while not waiter.cancelled():
+            await asyncio.sleep(0)
+        controller.release()
+        with pytest.raises(Rejected) as rejected:
+            await queued
+        return rejected.value.reason, controller.stats()
+
+    reason, stats = asyncio.run(main())
+    assert reason == "queue_timeout"
+    # The slot went back to the pool rather than to the timed out request
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+
+def test_rate_limiter_token_bucket_per_session():
+    limiter = SessionRateLimiter(rate_per_minute=60, burst=2)
+    assert limiter.acquire("a", now=0) == 0
+    assert limiter.acquire("a", now=0) == 0
+    assert limiter.acquire("a", now=0) == pytest.approx(1.0)
+    # Other sessions have their own bucket
+    assert limiter.acquire("b", now=0) == 0
+    # One token per second refills
+    assert limiter.acquire("a", now=1.0) == 0
+    assert limiter.stats()["limited"] == 1
+
+    assert SessionRateLimiter(rate_per_minute=0).acquire("a") == 0
+
+def test_middleware_returns_429_with_retry_after():
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["path"])
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    controller = AdmissionController(max_concurrent=4)
+    middleware = AdmissionMiddleware(app, controller, SessionRateLimiter(rate_per_minute=60, burst=1))
+    before = admission_rejections.value(reason="rate_limited")
+
+    async def request(method, path):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": method, "path": path, "headers": [(b"x-session-id", b"s1")]}
+        await middleware(scope, None, send)
+        return messages[0]
+
+    async def main():
+        return [
+            await request("POST", "/llm-rag/chats"),
+            await request("POST", "/llm-rag/chats/c1"),
+            await request("GET", "/llm-rag/chats"),
+        ]
+
+    allowed, limited, listed = asyncio.run(main())
+    assert allowed["status"] == 200 and listed["status"] == 200
+    assert limited["status"] == 429
+    assert (b"retry-after", b"1") in limited["headers"]
+    assert calls == ["/llm-rag/chats", "/llm-rag/chats"]
+    assert controller.in_flight == 0
+    assert admission_rejections.value(reason="rate_limited") == before + 1
+
+def test_middleware_refunds_the_rate_limit_when_busy():
+    async def app(scope, receive, send):
+        raise AssertionError("a rejected request must not run")
+
+    limiter = SessionRateLimiter(rate_per_minute=60, burst=1)
+    middleware = AdmissionMiddleware(app, AdmissionController(max_concurrent=0, max_queue=0), limiter)
+
+    async def request():
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {"type": "http", "method": "POST", "path": "/llm-rag/chats", "headers": [(b"x-session-id", b"s1")]}
+        await middleware(scope, None, send)
+        return messages
+
+    for _ in range(2):
+        start, body = asyncio.run(request())
+        assert start["status"] == 429
+        assert b"busy" in body["body"]
+    # Both requests were turned away by admission, so the session still has its token
+    assert limiter.acquire("s1") == 0
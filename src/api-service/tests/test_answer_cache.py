@@ -0,0 +1,57 @@
+import os
+import sys
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.answer_cache import SemanticAnswerCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def cache(clock):
+    return SemanticAnswerCache(enabled=True, threshold=0.9, ttl_seconds=60, max_entries=3, clock=clock)
+
+def test_hit_above_threshold(cache):
+    cache.store([1.0, 0.0], "v1", "what is wbc", "WBC answer", ["chunk"])
+    hit = cache.lookup([0.99, 0.05], "v1")
+    assert hit.answer == "WBC answer"
+    assert hit.context == ["chunk"]
+    assert hit.similarity > 0.9
+
+def test_miss_below_threshold(cache):
+    cache.store([1.0, 0.0], "v1", "what is wbc", "WBC answer", ["chunk"])
+    assert cache.lookup([0.5, 0.5], "v1") is None
+    assert cache.stats()["misses"] == 1
+
+def test_returns_most_similar_entry(cache):
+    cache.store([1.0, 0.0], "v1", "a", "answer a", [])
+    cache.store([0.0, 1.0], "v1", "b", "answer b", [])
+    assert cache.lookup([0.1, 1.0], "v1").answer == "answer b"
+
+def test_collection_version_change_invalidates(cache):
+    cache.store([1.0, 0.0], "v1", "a", "answer a", [])
+    assert cache.lookup([1.0, 0.0], "v2") is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["invalidations"] == 1
+
+def test_ttl_expiry(cache, clock):
+    cache.store([1.0, 0.0], "v1", "a", "answer a", [])
+    clock.now += 61
+    assert cache.lookup([1.0, 0.0], "v1") is None
+
+def test_capacity_drops_oldest(cache):
+    for i in range(4):
+        vector = [0.0] * 4
+        vector[i] = 1.0
+        cache.store(vector, "v1", str(i), f"answer {i}", [])
+    assert cache.stats()["entries"] == 3
+    assert cache.lookup([1.0, 0.0, 0.0, 0.0], "v1") is None
+    assert cache.lookup([0.0, 0.0, 0.0, 1.0], "v1").answer == "answer 3"
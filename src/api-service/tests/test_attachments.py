@@ -0,0 +1,56 @@
+import os
+import sys
+import math
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.attachments import AttachmentStore, PANEL_SUFFIX
+
+ROWS = [{"ID": 1, "WBC": 5.0, "HGB": 13.5, "Note": "fasting"}, {"ID": 2, "WBC": 12.1, "HGB": math.nan}]
+
+@pytest.fixture
+def store(tmp_path):
+    return AttachmentStore(str(tmp_path), max_entries=2)
+
+def test_save_and_load_keeps_types(store, tmp_path):
+    relative_path = store.save("chat", "msg", ROWS)
+    assert relative_path == os.path.join("files", "chat", "msg.csv")
+    assert store.resolve(relative_path).endswith("msg" + PANEL_SUFFIX)
+
+    reloaded = AttachmentStore(str(tmp_path)).load(relative_path)
+    assert reloaded == [
+        {"ID": 1, "WBC": 5.0, "HGB": 13.5, "Note": "fasting"},
+        {"ID": 2, "WBC": 12.1, "HGB": None, "Note": None},
+    ]
+    assert isinstance(reloaded[0]["ID"], int)
+
+def test_load_is_cached_until_the_file_changes(store):
+    relative_path = store.save("chat", "msg", ROWS)
+    first = store.load(relative_path)
+    assert store.load(relative_path) is first
+    assert store.stats()["hits"] == 2
+
+    filepath = store.resolve(relative_path)
+    with open(filepath, "w", encoding="utf-8") as f:
+        f.write('{"columns":["WBC"],"rows":[[7.5]]}')
+    os.utime(filepath, ns=(0, os.stat(filepath).st_mtime_ns + 1))
+    assert store.load(relative_path) == [{"WBC": 7.5}]
+    assert store.stats()["misses"] == 1
+
+def test_reads_legacy_csv(store, tmp_path):
+    os.makedirs(tmp_path / "files" / "chat")
+    (tmp_path / "files" / "chat" / "old.csv").write_text("ID,WBC,HGB\n3,4.5,\n")
+    assert store.load(os.path.join("files", "chat", "old.csv")) == [{"ID": 3, "WBC": 4.5, "HGB": None}]
+
+def test_invalid_and_missing_files(store, tmp_path):
+    os.makedirs(tmp_path / "files" / "chat")
+    (tmp_path / "files" / "chat" / "empty.csv").write_text("")
+    with pytest.raises(ValueError):
+        store.load(os.path.join("files", "chat", "empty.csv"))
+    with pytest.raises(FileNotFoundError):
+        store.load(os.path.join("files", "chat", "missing.csv"))
+
+def test_evicts_least_recently_used(store):
+    paths = [store.save("chat", f"msg{i}", ROWS) for i in range(3)]
+    assert store.cached(paths[0]) is None
+    assert store.cached(paths[2]) is not None
+    assert store.stats()["evictions"] == 1
@@ -0,0 +1,126 @@
+import os
+import sys
+import asyncio
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.batching import MicroBatcher
+
+class MockBackend:
+    """Records the batches it receives and returns the items upper-cased"""
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    async def __call__(self, items):
+        self.calls.append(list(items))
+        await asyncio.sleep(0.001)
+        if self.fail:
+            raise RuntimeError("quota exceeded")
+        return [item.upper() for item in items]
+
+def test_concurrent_calls_share_a_batch():
+    backend = MockBackend()
+    batcher = MicroBatcher(backend, max_batch_size=100, max_wait_seconds=0.01)
+
+    async def main():
+        return await asyncio.gather(*(batcher.submit(f"q{i}") for i in range(20)))
+
+    assert asyncio.run(main()) == [f"Q{i}" for i in range(20)]
+    assert len(backend.calls) == 1
+    assert batcher.stats()["largest_batch"] == 20
+
+def test_batches_are_capped_at_max_size():
+    backend = MockBackend()
+    batcher = MicroBatcher(backend, max_batch_size=8, max_wait_seconds=0.01)
+
+    async def main():
+        return await asyncio.gather(*(batcher.submit(f"q{i}") for i in range(20)))
+
+    assert asyncio.run(main()) == [f"Q{i}" for i in range(20)]
+    assert [len(call) for call in backend.calls] == [8, 8, 4]
+
+def test_duplicate_keys_are_sent_once():
+    backend = MockBackend()
+    batcher = MicroBatcher(backend, max_batch_size=100, max_wait_seconds=0.01, key=str.lower)
+
+    async def main():
+        return await asyncio.gather(batcher.submit("wbc"), batcher.submit("WBC"), batcher.submit("rbc"))
+
+    assert asyncio.run(main()) == ["WBC", "WBC", "RBC"]
+    assert backend.calls == [["wbc", "rbc"]]
+    assert batcher.stats()["deduplicated"] == 1
+
+def test_errors_reach_every_caller():
+    batcher = MicroBatcher(MockBackend(fail=True), max_batch_size=100, max_wait_seconds=0.01)
+
+    async def main():
+        return await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_separate_windows_make_separate_batches():
+    backend = MockBackend()
+    batcher = MicroBatcher(backend, max_batch_size=100, max_wait_seconds=0.001)
+
+    async def main():
+        first = await batcher.submit("a")
+        second = await batcher.submit("b")
+        return first, second
+
+    assert asyncio.run(main()) == ("A", "B")
+    assert backend.calls == [["a"], ["b"]]
+
+def test_identical_item_in_flight_is_not_sent_again():
+    backend = MockBackend()
+    batcher = MicroBatcher(backend, max_batch_size=100, max_wait_seconds=0.001)
+
+    async def main():
+        first = asyncio.ensure_future(batcher.submit("a"))
+        # Let the first batch start before submitting the same item again
+        await asyncio.sleep(0.002)
+        second = await batcher.submit("a")
+        return await first, second
+
+    assert asyncio.run(main()) == ("A", "A")
+    assert backend.calls == [["a"]]
+
+def test_cancelled_caller_does_not_cancel_others():
+    backend = MockBackend()
+    batcher = MicroBatcher(backend, max_batch_size=100, max_wait_seconds=0.001)
+
+    async def main():
+        first = asyncio.ensure_future(batcher.submit("a"))
+        second = asyncio.ensure_future(batcher.submit("a"))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "A"
+
+def test_cancelled_batch_releases_its_keys():
+    backend = MockBackend()
+    stalled = asyncio.Event()
+
+    async def fn(items):
+        if not backend.calls:
+            backend.calls.append(list(items))
+            await stalled.wait()
+        return await backend(items)
+
+    batcher = MicroBatcher(fn, max_batch_size=100, max_wait_seconds=0.001)
+
+    async def main():
+        first = asyncio.ensure_future(batcher.submit("a"))
+        await asyncio.sleep(0.01)
+        # e.g. shutdown cancelling the batch while it is in flight
+        for task in list(batcher._tasks):
+            task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(first, 1)
+        return await asyncio.wait_for(batcher.submit("a"), 1)
+
+    assert asyncio.run(main()) == "A"
+    assert backend.calls == [["a"], ["a"]]
+
@@ -0,0 +1,52 @@
+import os
+import sys
+import ast
+import pytest
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.biomarkers import classify, classify_panels, build_panel_prompt, BIOMARKERS, LOW, NORMAL, HIGH, UNKNOWN
+
+VECTOR_DB_CLI = os.path.join(os.path.dirname(__file__), '..', '..', 'vector-db', 'cli.py')
+
+def test_classify_against_bounds():
+    values = np.array([[3.9, 4.0, 10.0, 10.1, np.nan]])
+    status = classify(["WBC"] * 5, values)
+    assert status.tolist() == [[LOW, NORMAL, NORMAL, HIGH, UNKNOWN]]
+
+def test_classify_panels():
+    panels = [
+        {"ID": 1, "WBC": "5.0", "HGB": "9.1"},
+        {"ID": 2, "WBC": "12.5", "PLT": "n/a"},
+    ]
+    assert classify_panels(panels) == [
+        {"WBC": NORMAL, "HGB": LOW},
+        {"WBC": HIGH, "PLT": UNKNOWN},
+    ]
+
+def test_panel_prompt_leads_with_abnormal_values():
+    prompt = build_panel_prompt({"ID": 7, "WBC": 5.0, "HGB": 9.1, "PLT": 450, "XYZ": 1.2})
+    lines = prompt.strip().split("\n")
+    assert lines[0] == "Blood test values outside the normal range:"
+    assert lines[1].startswith("- HGB (Hemoglobin): 9.1 g/dL, LOW (normal range 11 to 16 g/dL)")
+    assert lines[2].startswith("- PLT (Platelet Count): 450")
+    assert lines[3] == "Within the normal range: WBC 5.0."
+    assert lines[4] == "Other values: XYZ 1.2."
+    assert "ID" not in prompt
+
+def test_panel_prompt_all_normal():
+    prompt = build_panel_prompt({"WBC": "5.0", "HGB": "13.0"})
+    assert prompt.startswith("All recognized blood test values are within the normal range.")
+    assert "WBC 5.0, HGB 13.0" in prompt
+
+def test_marker_context_covers_the_same_biomarkers():
+    # vector-db builds the per-marker context the panel prompts look up, from its own list
+    if not os.path.exists(VECTOR_DB_CLI):
+        pytest.skip("vector-db is not checked out next to api-service")
+    with open(VECTOR_DB_CLI, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    names = next(
+        ast.literal_eval(node.value)
+        for node in tree.body
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "biomarker_names" for t in node.targets)
+    )
+    assert list(names) == [biomarker.name for biomarker in BIOMARKERS]
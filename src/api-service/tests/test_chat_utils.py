@@ -33,8 +33,7 @@ def test_ensure_directories(chat_manager):
 def test_save_chat(chat_manager, sample_chat):
     session_id = "session_1"
     chat_manager.save_chat(sample_chat, session_id)
-    chat_filepath = chat_manager._get_chat_filepath(sample_chat["chat_id"], session_id)
-    assert os.path.exists(chat_filepath)
+    assert chat_manager.store.get_chat(session_id, sample_chat["chat_id"]) is not None
 
 def test_get_chat(chat_manager, sample_chat):
     session_id = "session_1"
@@ -54,8 +53,8 @@ def test_save_file(chat_manager):
     message_id = "1"
     csv_data = [{"col1": "data1", "col2": "data2"}]
     file_path = chat_manager._save_file(chat_id, message_id, csv_data)
-    full_path = os.path.join(chat_manager.history_dir, file_path)
-    assert os.path.exists(full_path)
+    assert file_path == os.path.join("files", chat_id, f"{message_id}.csv")
+    assert os.path.exists(chat_manager.attachments.resolve(file_path))
 
 def test_load_file(chat_manager):
     chat_id = "123"
@@ -0,0 +1,71 @@
+import os
+import sys
+import asyncio
+import pytest
+from unittest.mock import patch, MagicMock, AsyncMock
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.chroma_utils import ChromaHandle
+
+def make_collection(collection_id, documents):
+    collection = MagicMock()
+    collection.id = collection_id
+    collection.query = AsyncMock(return_value={"documents": [documents]})
+    collection.count = AsyncMock(return_value=len(documents))
+    return collection
+
+@pytest.fixture
+def async_client():
+    client = MagicMock()
+    client.heartbeat = AsyncMock(return_value=1)
+    with patch("chromadb.AsyncHttpClient", new=AsyncMock(return_value=client)):
+        yield client
+
+def test_query_resolves_collection_once(async_client):
+    collection = make_collection("v1", ["chunk1"])
+    async_client.get_collection = AsyncMock(return_value=collection)
+    handle = ChromaHandle("localhost", 8000, "semantic-split-collection", health_check_seconds=1000)
+
+    async def main():
+        for _ in range(3):
+            results = await handle.query(query_embeddings=[[0.1]], n_results=5)
+        return results
+
+    assert asyncio.run(main()) == {"documents": [["chunk1"]]}
+    assert async_client.get_collection.await_count == 1
+    assert collection.query.await_count == 3
+    assert handle.version == "v1"
+
+def test_query_reconnects_to_rebuilt_collection(async_client):
+    old = make_collection("v1", ["old"])
+    old.query.side_effect = Exception("Collection v1 does not exist.")
+    new = make_collection("v2", ["new"])
+    async_client.get_collection = AsyncMock(side_effect=[old, new])
+    handle = ChromaHandle("localhost", 8000, "semantic-split-collection", health_check_seconds=1000)
+
+    results = asyncio.run(handle.query(query_embeddings=[[0.1]], n_results=5))
+    assert results == {"documents": [["new"]]}
+    assert handle.version == "v2"
+    assert handle.reconnects == 1
+
+def test_query_error_is_raised_when_collection_unchanged(async_client):
+    collection = make_collection("v1", [])
+    collection.query.side_effect = Exception("server error")
+    async_client.get_collection = AsyncMock(return_value=collection)
+    handle = ChromaHandle("localhost", 8000, "semantic-split-collection", health_check_seconds=1000)
+
+    with pytest.raises(Exception, match="server error"):
+        asyncio.run(handle.query(query_embeddings=[[0.1]], n_results=5))
+
+def test_health(async_client):
+    async_client.get_collection = AsyncMock(return_value=make_collection("v1", ["a", "b"]))
+    handle = ChromaHandle("localhost", 8000, "semantic-split-collection")
+    status = asyncio.run(handle.health())
+    assert status["ok"] is True
+    assert status["count"] == 2
+
+def test_health_reports_unreachable_server(async_client):
+    async_client.get_collection = AsyncMock(side_effect=Exception("connection refused"))
+    handle = ChromaHandle("localhost", 8000, "semantic-split-collection")
+    status = asyncio.run(handle.health())
+    assert status["ok"] is False
+    assert "connection refused" in status["error"]
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils import concurrency
+from api.utils.concurrency import run_blocking, upstream_slot, shutdown_executor
+
+@pytest.fixture(autouse=True)
+def reset_executor():
+    yield
+    shutdown_executor()
+
+def test_run_blocking_returns_result():
+    result = asyncio.run(run_blocking(lambda a, b=0: a + b, 1, b=2))
+    assert result == 3
+
+def test_run_blocking_runs_off_loop_thread():
+    async def main():
+        return threading.get_ident(), await run_blocking(threading.get_ident)
+    loop_thread, worker_thread = asyncio.run(main())
+    assert loop_thread != worker_thread
+
+def test_run_blocking_does_not_stall_event_loop():
+    async def main():
+        ticks = 0
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+        task = asyncio.create_task(ticker())
+        await run_blocking(time.sleep, 0.2)
+        task.cancel()
+        return ticks
+    assert asyncio.run(main()) >= 5
+
+def test_run_blocking_propagates_exceptions():
+    def fail():
+        raise ValueError("boom")
+    with pytest.raises(ValueError):
+        asyncio.run(run_blocking(fail))
+
+def test_upstream_slot_limits_concurrency(monkeypatch):
+    monkeypatch.setattr(concurrency, "UPSTREAM_MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(concurrency, "_upstream_semaphore", None)
+    in_flight = 0
+    peak = 0
+
+    async def call():
+        nonlocal in_flight, peak
+        async with upstream_slot():
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+
+    async def main():
+        await asyncio.gather(*(call() for _ in range(10)))
+
+    asyncio.run(main())
+    assert peak == 2
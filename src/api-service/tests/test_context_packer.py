@@ -0,0 +1,46 @@
+import os
+import sys
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.context_packer import ContextPacker, estimate_tokens
+
+@pytest.fixture
+def packer():
+    return ContextPacker(max_chunks=3, token_budget=100, max_distance=0.5, dedup_threshold=0.95, mmr_lambda=0.7)
+
+def test_drops_chunks_beyond_max_distance(packer):
+    documents = ["WBC counts white blood cells.", "Unrelated chunk."]
+    assert packer.pack(documents, [0.2, 0.8]) == ["WBC counts white blood cells."]
+    assert packer.stats()["dropped_distance"] == 1
+
+def test_drops_duplicates(packer):
+    documents = ["Hemoglobin carries oxygen.", "Hemoglobin  carries oxygen.", "Platelets help clotting."]
+    embeddings = [[1.0, 0.0], [0.99, 0.01], [0.0, 1.0]]
+    packed = packer.pack(documents, [0.1, 0.1, 0.3], embeddings)
+    assert packed == ["Hemoglobin carries oxygen.", "Platelets help clotting."]
+    assert packer.stats()["dropped_duplicate"] == 1
+
+def test_mmr_prefers_diverse_chunks(packer):
+    documents = ["a", "b", "c"]
+    # b is slightly more relevant than c but very close to a
+    embeddings = [[1.0, 0.0], [0.9, 0.44], [0.0, 1.0]]
+    packer.max_chunks = 2
+    assert packer.pack(documents, [0.10, 0.12, 0.15], embeddings) == ["a", "c"]
+
+def test_respects_token_budget(packer):
+    long_chunk = "x" * 300
+    documents = [long_chunk, "short one", "y" * 200]
+    packed = packer.pack(documents, [0.1, 0.2, 0.3])
+    assert packed == [long_chunk, "short one"]
+    assert sum(estimate_tokens(chunk) for chunk in packed) <= packer.token_budget
+
+def test_pack_results(packer):
+    results = {
+        "documents": [["first", "second"]],
+        "distances": [[0.1, 0.2]],
+        "embeddings": [[[1.0, 0.0], [0.0, 1.0]]],
+    }
+    assert packer.pack_results(results) == ["first", "second"]
+    stats = packer.stats()
+    assert stats["chunks_in"] == 2
+    assert stats["chunks_out"] == 2
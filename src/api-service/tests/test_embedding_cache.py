@@ -0,0 +1,74 @@
+import os
+import sys
+import asyncio
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.embedding_cache import EmbeddingCache, normalize_query
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+def test_normalize_query():
+    assert normalize_query("  What does HIGH  wbc\nmean ") == "what does high wbc mean"
+
+def test_hit_on_normalized_text(clock):
+    cache = EmbeddingCache("model", 4, max_entries=10, ttl_seconds=60, path="", clock=clock)
+    cache.put("What does high WBC mean", [0.5, 0.25, 0.0, 1.0])
+    assert cache.get("what does  high wbc mean") == [0.5, 0.25, 0.0, 1.0]
+    assert cache.get("what does low wbc mean") is None
+    stats = cache.stats()
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+
+def test_key_includes_model_and_dimension():
+    assert EmbeddingCache("a", 256, path="").key("q") != EmbeddingCache("b", 256, path="").key("q")
+    assert EmbeddingCache("a", 256, path="").key("q") != EmbeddingCache("a", 128, path="").key("q")
+
+def test_lru_eviction(clock):
+    cache = EmbeddingCache("model", 1, max_entries=2, ttl_seconds=0, path="", clock=clock)
+    cache.put("a", [1.0])
+    cache.put("b", [2.0])
+    cache.get("a")
+    cache.put("c", [3.0])
+    assert cache.get("b") is None
+    assert cache.get("a") == [1.0]
+    assert cache.stats()["evictions"] == 1
+
+def test_ttl_expiry(clock):
+    cache = EmbeddingCache("model", 1, max_entries=10, ttl_seconds=60, path="", clock=clock)
+    cache.put("a", [1.0])
+    clock.now += 61
+    assert cache.get("a") is None
+
+def test_disk_tier_survives_restart(tmp_path, clock):
+    path = str(tmp_path / "embeddings.db")
+    cache = EmbeddingCache("model", 2, max_entries=10, ttl_seconds=60, path=path, clock=clock)
+    cache.put("a", [1.0, 2.0])
+    cache.close()
+
+    restarted = EmbeddingCache("model", 2, max_entries=10, ttl_seconds=60, path=path, clock=clock)
+    assert restarted.get("a") == [1.0, 2.0]
+    assert restarted.get("a") == [1.0, 2.0]
+    stats = restarted.stats()
+    assert stats["disk_hits"] == 1
+    assert stats["memory_hits"] == 1
+    restarted.close()
+
+def test_async_lookup(tmp_path, clock):
+    cache = EmbeddingCache("model", 1, max_entries=10, ttl_seconds=60, path=str(tmp_path / "e.db"), clock=clock)
+
+    async def main():
+        await cache.aput("a", [1.0])
+        return await cache.aget("a"), await cache.aget("b")
+
+    assert asyncio.run(main()) == ([1.0], None)
+    cache.close()
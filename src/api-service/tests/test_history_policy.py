@@ -0,0 +1,77 @@
+import os
+import sys
+import pytest
+from unittest.mock import MagicMock
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils import history_policy
+from api.utils.history_policy import (
+    split_turns,
+    window_start,
+    turns_to_summarize,
+    keeps_context,
+    needs_compaction,
+    estimate_history_tokens,
+)
+
+@pytest.fixture(autouse=True)
+def policy(monkeypatch):
+    monkeypatch.setattr(history_policy, "HISTORY_KEEP_TURNS", 2)
+    monkeypatch.setattr(history_policy, "HISTORY_CONTEXT_TURNS", 1)
+    monkeypatch.setattr(history_policy, "HISTORY_SUMMARY_ENABLED", True)
+    monkeypatch.setattr(history_policy, "HISTORY_COMPACT_SLACK_TURNS", 2)
+
+def make_messages(turns):
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i}", "context": ["chunk"]})
+        messages.append({"role": "assistant", "content": f"answer {i}"})
+    return messages
+
+def test_split_turns():
+    turns = split_turns(make_messages(3))
+    assert len(turns) == 3
+    assert [m["content"] for m in turns[1]] == ["question 1", "answer 1"]
+
+def test_summary_covers_turns_beyond_window():
+    assert turns_to_summarize(2, None) == 0
+    assert turns_to_summarize(5, None) == 3
+    assert turns_to_summarize(5, {"text": "...", "turns": 3}) == 0
+    # Turns stay verbatim until the summary covers them
+    assert window_start(5, None) == 0
+    assert window_start(5, {"text": "...", "turns": 3}) == 3
+
+def test_window_without_summary(monkeypatch):
+    monkeypatch.setattr(history_policy, "HISTORY_SUMMARY_ENABLED", False)
+    assert window_start(5, None) == 3
+    assert turns_to_summarize(5, None) == 0
+
+def test_policy_disabled(monkeypatch):
+    monkeypatch.setattr(history_policy, "HISTORY_KEEP_TURNS", 0)
+    assert window_start(10, None) == 0
+    assert keeps_context(0, 10)
+    assert not needs_compaction(make_messages(10), None)
+
+def test_only_recent_turns_keep_context():
+    assert keeps_context(4, 5)
+    assert not keeps_context(3, 5)
+
+def test_needs_compaction():
+    assert not needs_compaction(make_messages(1), None)
+    # Chunks of a couple of earlier turns are tolerated in the live session
+    assert not needs_compaction(make_messages(3), None)
+    assert needs_compaction(make_messages(4), None)
+    # Counted from the last rebuild, so the next compaction is a few turns away
+    assert not needs_compaction(make_messages(6), {"text": "...", "turns": 3}, compacted_turns=4)
+    assert needs_compaction(make_messages(7), {"text": "...", "turns": 3}, compacted_turns=4)
+
+def test_needs_compaction_when_summary_lags():
+    # Within the chunk slack, but five turns are past the window and not summarized
+    assert needs_compaction(make_messages(8), {"text": "...", "turns": 1}, compacted_turns=6)
+    assert not needs_compaction(make_messages(8), {"text": "...", "turns": 4}, compacted_turns=6)
+
+def test_estimate_history_tokens():
+    history = [
+        MagicMock(parts=[MagicMock(text="a" * 40)]),
+        MagicMock(parts=[MagicMock(text="b" * 8), MagicMock(text="c")]),
+    ]
+    assert estimate_history_tokens(history) == 10 + 2 + 1
@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.history_store import JsonHistoryStore, LogHistoryStore, SQLiteHistoryStore, migrate_json_history
+
+def make_chat(chat_id, dts, turns=1):
+    messages = []
+    for i in range(turns):
+        messages.append({"message_id": f"{chat_id}-u{i}", "role": "user", "content": f"question {i}"})
+        messages.append({"message_id": f"{chat_id}-a{i}", "role": "assistant", "content": f"answer {i}"})
+    return {"chat_id": chat_id, "title": f"chat {chat_id}", "dts": dts, "messages": messages}
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    store = SQLiteHistoryStore(str(tmp_path / "chats.db"))
+    yield store
+    store.close()
+
+def test_sqlite_save_and_get_chat(sqlite_store):
+    chat = make_chat("c1", 100, turns=2)
+    sqlite_store.save_chat("s1", chat)
+    assert sqlite_store.get_chat("s1", "c1") == chat
+    assert sqlite_store.get_chat("s2", "c1") is None
+
+def test_sqlite_appends_new_messages(sqlite_store):
+    chat = make_chat("c1", 100)
+    sqlite_store.save_chat("s1", chat)
+    chat["messages"].append({"message_id": "new", "role": "user", "content": "follow up"})
+    chat["dts"] = 200
+    sqlite_store.save_chat("s1", chat)
+    loaded = sqlite_store.get_chat("s1", "c1")
+    assert len(loaded["messages"]) == 3
+    assert loaded["messages"][-1]["message_id"] == "new"
+    assert loaded["dts"] == 200
+
+def test_sqlite_list_chats_ordered_by_dts(sqlite_store):
+    for chat_id, dts in [("old", 100), ("new", 300), ("mid", 200)]:
+        sqlite_store.save_chat("s1", make_chat(chat_id, dts))
+    sqlite_store.save_chat("s2", make_chat("other", 400))
+    assert [c["chat_id"] for c in sqlite_store.list_chats("s1")] == ["new", "mid", "old"]
+    assert [c["chat_id"] for c in sqlite_store.list_chats("s1", limit=2)] == ["new", "mid"]
+
+def test_json_store_round_trip(tmp_path):
+    store = JsonHistoryStore(str(tmp_path))
+    chat = make_chat("c1", 100)
+    store.save_chat("s1", chat)
+    assert os.path.exists(store.get_chat_filepath("s1", "c1"))
+    assert store.get_chat("s1", "c1") == chat
+    assert store.list_chats("s1") == [chat]
+
+def test_migrate_json_history(tmp_path, sqlite_store):
+    json_store = JsonHistoryStore(str(tmp_path))
+    json_store.save_chat("s1", make_chat("c1", 100))
+    json_store.save_chat("s1", make_chat("c2", 200))
+    json_store.save_chat("s2", make_chat("c3", 300))
+
+    assert migrate_json_history(str(tmp_path), sqlite_store) == 3
+    assert [c["chat_id"] for c in sqlite_store.list_chats("s1")] == ["c2", "c1"]
+    assert sqlite_store.get_chat("s2", "c3") == make_chat("c3", 300)
+
+    # Runs only once
+    json_store.save_chat("s1", make_chat("c4", 400))
+    assert migrate_json_history(str(tmp_path), sqlite_store) == 0
+
+def test_log_store_appends_only_new_messages(tmp_path):
+    store = LogHistoryStore(str(tmp_path))
+    chat = make_chat("c1", 100)
+    store.save_chat("s1", chat)
+    log_path = store.get_log_filepath("s1", "c1")
+    with open(log_path) as f:
+        assert len(f.readlines()) == 3
+
+    chat["messages"].append({"message_id": "u1", "role": "user", "content": "follow up"})
+    chat["messages"].append({"message_id": "a1", "role": "assistant", "content": "answer"})
+    chat["dts"] = 200
+    store.save_chat("s1", chat)
+    with open(log_path) as f:
+        assert len(f.readlines()) == 6
+
+    # A fresh store replays the log
+    assert LogHistoryStore(str(tmp_path)).get_chat("s1", "c1") == chat
+
+def test_log_store_compacts(tmp_path):
+    store = LogHistoryStore(str(tmp_path), compact_after=3)
+    chat = make_chat("c1", 0)
+    for dts in range(1, 6):
+        chat["dts"] = dts
+        store.save_chat("s1", chat)
+    with open(store.get_log_filepath("s1", "c1")) as f:
+        records = [json.loads(line) for line in f]
+    assert sum("chat" in record for record in records) < 3
+    assert store.get_chat("s1", "c1") == chat
+
+def test_log_store_list_chats(tmp_path):
+    store = LogHistoryStore(str(tmp_path))
+    for chat_id, dts in [("old", 100), ("new", 300), ("mid", 200)]:
+        store.save_chat("s1", make_chat(chat_id, dts))
+    mid = make_chat("mid", 400)
+    store.save_chat("s1", mid)
+    assert [c["chat_id"] for c in store.list_chats("s1")] == ["mid", "new", "old"]
+    assert [c["chat_id"] for c in store.list_chats("s1", limit=1)] == ["mid"]
+
+def test_log_store_reads_json_layout(tmp_path):
+    JsonHistoryStore(str(tmp_path)).save_chat("s1", make_chat("c1", 100))
+    store = LogHistoryStore(str(tmp_path))
+    assert store.get_chat("s1", "c1") == make_chat("c1", 100)
+    assert [c["chat_id"] for c in store.list_chats("s1")] == ["c1"]
+
+def test_log_store_keeps_json_chats_when_saving_before_listing(tmp_path):
+    JsonHistoryStore(str(tmp_path)).save_chat("s1", make_chat("legacy", 100))
+    store = LogHistoryStore(str(tmp_path))
+    store.save_chat("s1", make_chat("new", 200))
+    assert [c["chat_id"] for c in store.list_chats("s1")] == ["new", "legacy"]
+    assert [c["chat_id"] for c in LogHistoryStore(str(tmp_path)).list_chats("s1")] == ["new", "legacy"]
+
+def test_log_store_recovers_from_a_torn_line(tmp_path):
+    store = LogHistoryStore(str(tmp_path))
+    chat = make_chat("c1", 100)
+    store.save_chat("s1", chat)
+    # A crash in the middle of an append to the chat log and to the index
+    for filepath in [store.get_log_filepath("s1", "c1"), os.path.join(str(tmp_path), "s1", "index.log")]:
+        with open(filepath, 'a', encoding='utf-8') as f:
+            f.write('{"message": {"message_id": "c1-u')
+    chat = make_chat("c1", 200, turns=2)
+    store.save_chat("s1", chat)
+    store.save_chat("s1", make_chat("c2", 300))
+
+    assert store.get_chat("s1", "c1") == chat
+    restarted = LogHistoryStore(str(tmp_path))
+    assert restarted.get_chat("s1", "c1") == chat
+    assert [c["chat_id"] for c in restarted.list_chats("s1")] == ["c2", "c1"]
+
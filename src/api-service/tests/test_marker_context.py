@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import asyncio
+from unittest.mock import MagicMock, AsyncMock
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.marker_context import MarkerContextCache
+
+def make_cache(records=None, error=None, source=None):
+    collection = MagicMock()
+    collection.metadata = {"hnsw:space": "cosine", "source": source} if source else None
+    collection.get = AsyncMock(return_value=records, side_effect=error)
+    handle = MagicMock()
+    handle.collection_name = "semantic-split-marker-context"
+    handle.acollection = AsyncMock(return_value=collection)
+    return MarkerContextCache(handle, retry_seconds=1000), collection
+
+RECORDS = {
+    "ids": ["HGB:low", "HGB:high", "PLT:high"],
+    "documents": [
+        json.dumps(["Low hemoglobin can indicate anemia.", "Iron deficiency lowers hemoglobin."]),
+        json.dumps(["High hemoglobin can come from dehydration."]),
+        json.dumps(["High platelets can follow inflammation.", "Iron deficiency lowers hemoglobin."]),
+    ],
+}
+
+def test_lookup_abnormal_markers_only():
+    cache, collection = make_cache(RECORDS)
+    asyncio.run(cache.refresh("v1"))
+    chunks = cache.lookup({"WBC": "normal", "HGB": "low", "PLT": "high"})
+    # One chunk per marker in turn, without duplicates
+    assert chunks == [
+        "Low hemoglobin can indicate anemia.",
+        "High platelets can follow inflammation.",
+        "Iron deficiency lowers hemoglobin.",
+    ]
+    assert cache.lookup({"HGB": "normal"}) == []
+
+def test_loaded_once_per_version():
+    cache, collection = make_cache(RECORDS)
+    asyncio.run(cache.refresh("v1"))
+    asyncio.run(cache.refresh("v1"))
+    assert collection.get.await_count == 1
+    asyncio.run(cache.refresh("v2"))
+    assert collection.get.await_count == 2
+    assert cache.stats()["version"] == "v2"
+
+def test_missing_collection_is_retried_later():
+    cache, collection = make_cache(error=Exception("Collection does not exist"))
+    asyncio.run(cache.refresh("v1"))
+    asyncio.run(cache.refresh("v1"))
+    assert collection.get.await_count == 1
+    assert cache.lookup({"HGB": "low"}) == []
+    assert not cache.stats()["loaded"]
+
+def test_context_built_for_another_version_is_loaded_again():
+    cache, collection = make_cache(RECORDS, source="v1")
+    cache.retry_seconds = 0
+    # The knowledge base was reloaded, its marker context not rebuilt yet
+    asyncio.run(cache.refresh("v2"))
+    assert cache.stats()["version"] is None
+    assert cache.lookup({"PLT": "high"})
+
+    collection.metadata = {"source": "v2"}
+    asyncio.run(cache.refresh("v2"))
+    asyncio.run(cache.refresh("v2"))
+    assert collection.get.await_count == 2
+    assert cache.stats()["version"] == "v2"
+
@@ -0,0 +1,75 @@
+import os
+import sys
+import asyncio
+from types import SimpleNamespace
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.metrics import (
+    Histogram,
+    Counter,
+    ServerTimingMiddleware,
+    model_tokens,
+    timed,
+    record_usage,
+    start_request_timings,
+    detach_request_timings,
+    server_timing_header,
+)
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "Test.", ["stage"], [0.1, 1])
+    for value in [0.05, 0.5, 0.7, 5]:
+        histogram.observe(value, stage="embed")
+    lines = histogram.render()
+    assert 'test_seconds_bucket{stage="embed",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="embed",le="1"} 3' in lines
+    assert 'test_seconds_bucket{stage="embed",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{stage="embed"} 4' in lines
+
+def test_counter_escapes_labels():
+    counter = Counter("test_total", "Test.", ["kind"])
+    counter.inc(2, kind='a"b')
+    assert counter.render()[-1] == 'test_total{kind="a\\"b"} 2'
+
+def test_timed_stages_are_added_to_the_request():
+    async def handle():
+        timings = start_request_timings()
+        with timed("embed"):
+            await asyncio.sleep(0.01)
+        with timed("embed"):
+            pass
+
+        async def background():
+            detach_request_timings()
+            with timed("store_write"):
+                pass
+        await asyncio.create_task(background())
+        return timings
+
+    timings = asyncio.run(handle())
+    assert list(timings) == ["embed"]
+    assert timings["embed"] >= 0.01
+    assert server_timing_header({"embed": 0.0123}) == "embed;dur=12.3"
+
+def test_record_usage_counts_tokens():
+    before = model_tokens.value(call="test", kind="prompt")
+    usage = SimpleNamespace(prompt_token_count=120, candidates_token_count=30, total_token_count=150)
+    record_usage("test", SimpleNamespace(usage_metadata=usage))
+    record_usage("test", SimpleNamespace())
+    assert model_tokens.value(call="test", kind="prompt") == before + 120
+    assert model_tokens.value(call="test", kind="total") == 150
+
+def test_middleware_adds_server_timing_header():
+    async def app(scope, receive, send):
+        with timed("generate"):
+            pass
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    sent = []
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(ServerTimingMiddleware(app)({"type": "http"}, None, send))
+    headers = dict(sent[0]["headers"])
+    assert headers[b"server-timing"].decode().startswith("generate;dur=")
+    assert "total;dur=" in headers[b"server-timing"].decode()
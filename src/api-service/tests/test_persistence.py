@@ -0,0 +1,118 @@
+import os
+import sys
+import asyncio
+import pytest
+from unittest.mock import patch
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.chat_utils import ChatHistoryManager
+from api.utils.persistence import KeyedLocks, WriteBehindChatStore
+
+@pytest.fixture
+def chat_manager(tmp_path):
+    manager = ChatHistoryManager(model="test_model", history_dir=str(tmp_path))
+    yield manager
+    manager.store.close()
+
+def make_chat(chat_id, dts, turns=1):
+    messages = []
+    for i in range(turns):
+        messages.append({"message_id": f"u{i}", "role": "user", "content": f"question {i}"})
+        messages.append({"message_id": f"a{i}", "role": "assistant", "content": f"answer {i}"})
+    return {"chat_id": chat_id, "title": "chat", "dts": dts, "messages": messages}
+
+def test_save_is_visible_before_and_after_flush(chat_manager):
+    async def main():
+        store = WriteBehindChatStore(chat_manager)
+        await store.save(make_chat("c1", 100), "s1")
+        assert (await store.get_chat("c1", "s1"))["dts"] == 100
+        assert [c["chat_id"] for c in await store.get_recent_chats("s1")] == ["c1"]
+        await store.flush()
+        return store
+
+    store = asyncio.run(main())
+    assert store.stats()["pending"] == 0
+    assert chat_manager.get_chat("c1", "s1") == make_chat("c1", 100)
+
+def test_saves_to_same_chat_are_ordered_and_coalesced(chat_manager):
+    async def main():
+        store = WriteBehindChatStore(chat_manager)
+        for turns in range(1, 6):
+            await store.save(make_chat("c1", turns, turns=turns), "s1")
+        await store.flush()
+        return store
+
+    store = asyncio.run(main())
+    assert len(chat_manager.get_chat("c1", "s1")["messages"]) == 10
+    assert store.stats()["writes"] + store.stats()["coalesced"] == 5
+
+def test_recent_chats_merge_pending_writes(chat_manager):
+    chat_manager.save_chat(make_chat("old", 100), "s1")
+
+    async def main():
+        store = WriteBehindChatStore(chat_manager)
+        await store.save(make_chat("new", 200), "s1")
+        chats = await store.get_recent_chats("s1", limit=1)
+        await store.flush()
+        return chats
+
+    assert [c["chat_id"] for c in asyncio.run(main())] == ["new"]
+
+def test_uploaded_files_are_written_behind(chat_manager):
+    chat = make_chat("c1", 100)
+    chat["messages"][0]["file"] = [{"WBC": 5.0, "HGB": 13.0}]
+
+    async def main():
+        store = WriteBehindChatStore(chat_manager)
+        with patch.object(chat_manager.attachments, "save", wraps=chat_manager.attachments.save) as save:
+            await store.save(chat, "s1")
+            # Readable at once from memory, not yet on disk
+            file_path = chat["messages"][0]["file_path"]
+            assert chat_manager.attachments.cached(file_path) == [{"WBC": 5.0, "HGB": 13.0}]
+            save.assert_not_called()
+            await store.flush()
+            save.assert_called_once()
+        return file_path
+
+    file_path = asyncio.run(main())
+    assert chat_manager.attachments.stats()["staged"] == 0
+    assert os.path.exists(chat_manager.attachments.resolve(file_path))
+    assert chat_manager.get_chat("c1", "s1")["messages"][0]["file_path"] == file_path
+
+def test_failed_write_is_retried(chat_manager):
+    save_chat = chat_manager.store.save_chat
+    failures = [OSError("disk full")]
+
+    def flaky_save_chat(session_id, chat):
+        if failures:
+            raise failures.pop()
+        save_chat(session_id, chat)
+
+    async def main():
+        store = WriteBehindChatStore(chat_manager)
+        with patch("api.utils.persistence.backoff_seconds", return_value=0), \
+                patch.object(chat_manager.store, "save_chat", side_effect=flaky_save_chat):
+            await store.save(make_chat("c1", 100), "s1")
+            await store.flush()
+        return store.stats()
+
+    stats = asyncio.run(main())
+    assert stats["errors"] == 1 and stats["retries"] == 1 and stats["writes"] == 1
+    assert chat_manager.get_chat("c1", "s1") == make_chat("c1", 100)
+
+def test_keyed_locks_serialize_same_key_only():
+    locks = KeyedLocks()
+    order = []
+
+    async def worker(key, name):
+        async with locks.hold(key):
+            order.append(f"{name}-start")
+            await asyncio.sleep(0.01)
+            order.append(f"{name}-end")
+
+    async def main():
+        await asyncio.gather(worker("a", "a1"), worker("a", "a2"), worker("b", "b1"))
+
+    asyncio.run(main())
+    assert order.index("a1-end") < order.index("a2-start")
+    assert order.index("b1-start") < order.index("a1-end")
+    assert len(locks) == 0
@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import asyncio
+import pytest
+from unittest.mock import patch, AsyncMock
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.resilience import CircuitBreaker, CircuitOpen, Deadline, Upstream, is_retryable
+
+class ServiceUnavailable(Exception):
+    pass
+
+@pytest.fixture(autouse=True)
+def no_backoff():
+    with patch("api.utils.resilience.backoff_seconds", return_value=0):
+        yield
+
+def test_breaker_opens_then_probes_after_reset():
+    breaker = CircuitBreaker("chroma", failure_threshold=2, reset_seconds=0.05)
+    breaker.allow()
+    breaker.record_failure()
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+
+    time.sleep(0.06)
+    # One probe is let through; others are refused while it runs
+    breaker.allow()
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.allow()
+
+def test_upstream_retries_transient_errors():
+    call = AsyncMock(side_effect=[ServiceUnavailable("503"), ServiceUnavailable("503"), "ok"])
+    upstream = Upstream("embedding", timeout=1, retries=2)
+    assert asyncio.run(upstream.call(call)) == "ok"
+    assert call.await_count == 3
+    assert upstream.stats()["retried"] == 2
+    assert upstream.breaker.failures == 0
+
+def test_upstream_does_not_retry_other_errors():
+    call = AsyncMock(side_effect=ValueError("bad request"))
+    upstream = Upstream("embedding", timeout=1, retries=2)
+    with pytest.raises(ValueError):
+        asyncio.run(upstream.call(call))
+    assert call.await_count == 1
+    assert is_retryable(asyncio.TimeoutError()) and not is_retryable(ValueError())
+
+def test_other_errors_leave_the_circuit_closed():
+    call = AsyncMock(side_effect=ValueError("bad request"))
+    upstream = Upstream("gemini", timeout=1, retries=0)
+    upstream.breaker.failure_threshold = 2
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            asyncio.run(upstream.call(call))
+    assert upstream.breaker.failures == 0
+    assert upstream.breaker.state == "closed"
+
+def test_timeouts_within_a_short_budget_leave_the_circuit_closed():
+    async def stalled():
+        await asyncio.sleep(10)
+
+    upstream = Upstream("gemini", timeout=1, retries=0, slow_seconds=0.5)
+    upstream.breaker.failure_threshold = 1
+    # The caller's deadline was nearly spent: not the upstream's fault
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(upstream.call(stalled, timeout=0.01))
+    assert upstream.breaker.state == "closed"
+
+def test_upstream_fails_fast_once_the_circuit_opens():
+    call = AsyncMock(side_effect=ServiceUnavailable("503"))
+    upstream = Upstream("gemini", timeout=1, retries=0)
+    upstream.breaker.failure_threshold = 2
+    for _ in range(2):
+        with pytest.raises(ServiceUnavailable):
+            asyncio.run(upstream.call(call))
+    with pytest.raises(CircuitOpen):
+        asyncio.run(upstream.call(call))
+    assert call.await_count == 2
+
+def test_hedged_call_uses_the_first_answer():
+    delays = [1.0, 0.0]
+
+    async def query():
+        delay = delays.pop(0)
+        await asyncio.sleep(delay)
+        return delay
+
+    upstream = Upstream("chroma", timeout=2, hedge=True)
+    upstream.hedge_delay = lambda: 0.01
+    start = time.perf_counter()
+    assert asyncio.run(upstream.call(query)) == 0.0
+    assert time.perf_counter() - start < 0.5
+    assert upstream.hedged == 1 and upstream.hedge_wins == 1
+
+def test_slow_call_times_out_within_its_budget():
+    async def stalled():
+        await asyncio.sleep(10)
+
+    upstream = Upstream("chroma", timeout=0.05, retries=0)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(upstream.call(stalled))
+
+    async def main():
+        deadline = Deadline(0.2)
+        with pytest.raises(asyncio.TimeoutError):
+            await deadline.run(stalled(), 0.01)
+        assert 0 < deadline.remaining() <= 0.2
+        assert deadline.budget(5) <= 0.2
+
+    asyncio.run(main())
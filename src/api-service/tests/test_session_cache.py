@@ -0,0 +1,71 @@
+import os
+import sys
+import pytest
+from types import SimpleNamespace
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.session_cache import SessionCache, estimate_session_bytes, SESSION_OVERHEAD_BYTES
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def make_session(text=""):
+    part = SimpleNamespace(text=text)
+    return SimpleNamespace(history=[SimpleNamespace(role="user", parts=[part])])
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+def test_get_hit_and_miss(clock):
+    cache = SessionCache(max_entries=10, max_bytes=10**9, ttl_seconds=60, clock=clock)
+    session = make_session("hello")
+    cache["chat_1"] = session
+    assert cache.get("chat_1") is session
+    assert cache.get("chat_2") is None
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+def test_evicts_least_recently_used_by_count(clock):
+    cache = SessionCache(max_entries=2, max_bytes=10**9, ttl_seconds=0, clock=clock)
+    cache["a"] = make_session()
+    cache["b"] = make_session()
+    cache.get("a")
+    cache["c"] = make_session()
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.stats()["evictions"] == 1
+
+def test_evicts_by_estimated_bytes(clock):
+    cache = SessionCache(max_entries=100, max_bytes=10_000, ttl_seconds=0, clock=clock)
+    cache["a"] = make_session("x" * 4000)
+    cache["b"] = make_session("x" * 4000)
+    assert len(cache) == 1
+    assert "b" in cache
+    assert cache.stats()["bytes"] <= 10_000
+
+def test_expires_idle_sessions(clock):
+    cache = SessionCache(max_entries=10, max_bytes=10**9, ttl_seconds=60, clock=clock)
+    cache["a"] = make_session()
+    clock.now = 30
+    assert cache.get("a") is not None
+    clock.now = 100
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+def test_put_reaccounts_grown_session(clock):
+    cache = SessionCache(max_entries=10, max_bytes=10**9, ttl_seconds=0, clock=clock)
+    session = make_session("short")
+    cache["a"] = session
+    before = cache.stats()["bytes"]
+    session.history.append(SimpleNamespace(role="model", parts=[SimpleNamespace(text="y" * 1000)]))
+    cache.put("a", session)
+    assert cache.stats()["bytes"] > before + 1000
+
+def test_estimate_session_bytes_without_history():
+    assert estimate_session_bytes(SimpleNamespace()) == SESSION_OVERHEAD_BYTES
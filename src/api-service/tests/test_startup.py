@@ -0,0 +1,76 @@
+import os
+import sys
+import asyncio
+import threading
+import pytest
+from unittest.mock import MagicMock
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.startup import LazyResource, WarmUp
+
+def test_lazy_resource_created_once_on_first_use():
+    factory = MagicMock(return_value="client")
+    resource = LazyResource("client", factory)
+    factory.assert_not_called()
+    assert not resource.ready
+
+    threads = [threading.Thread(target=resource.get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert resource.get() == "client"
+    assert asyncio.run(resource.aget()) == "client"
+    assert resource.ready
+    factory.assert_called_once()
+
+def test_lazy_resource_retries_after_failure():
+    factory = MagicMock(side_effect=[Exception("Connection refused"), "client"])
+    resource = LazyResource("client", factory)
+
+    with pytest.raises(Exception):
+        resource.get()
+    assert not resource.ready
+    assert resource.error == "Connection refused"
+
+    assert resource.get() == "client"
+    assert resource.error is None
+
+def test_warm_up_retries_until_every_step_succeeds():
+    attempts = {"chroma": 0}
+
+    async def chroma():
+        attempts["chroma"] += 1
+        if attempts["chroma"] < 3:
+            raise Exception("Chroma is not up yet")
+
+    async def model():
+        pass
+
+    async def main():
+        warm_up = WarmUp({"chroma": chroma, "model": model}, retry_seconds=0.001)
+        assert not warm_up.ready
+        warm_up.start()
+        ready = await warm_up.wait(timeout=5)
+        return ready, warm_up.status()
+
+    ready, status = asyncio.run(main())
+    assert ready and status["ready"]
+    assert status["steps"]["chroma"]["attempts"] == 3
+    assert status["steps"]["chroma"]["error"] is None
+    assert status["steps"]["model"]["attempts"] == 1
+
+def test_warm_up_stops_while_a_step_is_failing():
+    async def failing():
+        raise Exception("Chroma is down")
+
+    async def main():
+        warm_up = WarmUp({"chroma": failing}, retry_seconds=0.01)
+        warm_up.start()
+        assert not await warm_up.wait(timeout=0.05)
+        await warm_up.stop()
+        return warm_up.status()
+
+    status = asyncio.run(main())
+    assert not status["ready"]
+    assert status["steps"]["chroma"]["error"] == "Chroma is down"
@@ -0,0 +1,56 @@
+import os
+import sys
+import math
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.trends import panel_matrix, compute_trends, build_trend_prompt
+
+PANELS = [
+    {"ID": 1, "WBC": 6.0, "HGB": 13.0, "PLT": 250},
+    {"ID": 1, "WBC": 6.2, "HGB": 11.5},
+    {"ID": 1, "WBC": 5.8, "HGB": 10.0, "PLT": 450},
+]
+
+def test_panel_matrix_marks_missing_values():
+    markers, values = panel_matrix(PANELS)
+    assert markers == ["WBC", "HGB", "PLT"]
+    assert values.shape == (3, 3)
+    assert math.isnan(values[1, 2])
+
+def test_compute_trends():
+    markers, values = panel_matrix(PANELS)
+    trends = compute_trends(markers, values)
+    hgb = markers.index("HGB")
+    plt = markers.index("PLT")
+    assert trends["count"].tolist() == [3, 3, 2]
+    assert trends["delta"][hgb] == -1.5
+    assert trends["change"][hgb] == -3.0
+    assert np.isclose(trends["slope"][hgb], -1.5)
+    assert trends["status"][hgb] == -1
+    assert trends["crossings"][hgb] == 1
+    # The missing panel is skipped: 250 in the first, 450 in the last
+    assert trends["previous"][plt] == 250
+    assert np.isclose(trends["slope"][plt], 100.0)
+    assert trends["status"][plt] == 1
+    assert trends["crossings"][plt] == 1
+
+def test_crossings_count_every_boundary():
+    markers, values = panel_matrix([{"HGB": v} for v in [13.0, 10.0, 12.0, 17.0]])
+    trends = compute_trends(markers, values)
+    assert trends["crossings"][0] == 3
+    assert trends["status"][0] == 1
+
+def test_build_trend_prompt():
+    prompt = build_trend_prompt(PANELS)
+    assert prompt.startswith("Trends across the 3 blood tests")
+    assert "- HGB (Hemoglobin): 13 -> 11.5 -> 10 g/dL" in prompt
+    assert "now LOW" in prompt
+    assert "Within the normal range in every test: WBC." in prompt
+
+def test_build_trend_prompt_size_is_independent_of_panel_count():
+    def prompt(count):
+        return build_trend_prompt([{"WBC": 6.0, "HGB": 13.0}] + [{"WBC": 6.0, "HGB": 10.0}] * (count - 1))
+    assert abs(len(prompt(500)) - len(prompt(3))) < 10
+
+def test_build_trend_prompt_needs_two_panels():
+    assert build_trend_prompt(PANELS[:1]) == ""
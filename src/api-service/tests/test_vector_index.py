@@ -0,0 +1,90 @@
+import os
+import sys
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from api.utils.vector_index import VectorIndex
+
+class MockCollection:
+    """Stands in for a Chroma collection, paging through get() like the HTTP client"""
+
+    def __init__(self, collection_id, embeddings):
+        self.id = collection_id
+        self.embeddings = embeddings
+        self.get_calls = 0
+
+    def get(self, include=None, limit=None, offset=0):
+        self.get_calls += 1
+        rows = range(offset, min(offset + limit, len(self.embeddings)))
+        return {
+            "ids": [f"id{i}" for i in rows],
+            "documents": [f"doc{i}" for i in rows],
+            "metadatas": [{"row": i} for i in rows],
+            "embeddings": [self.embeddings[i] for i in rows],
+        }
+
+@pytest.fixture
+def embeddings():
+    rng = np.random.default_rng(0)
+    return rng.normal(size=(2500, 16)).tolist()
+
+def brute_force(embeddings, query, k):
+    matrix = np.asarray(embeddings)
+    matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    similarities = matrix @ (np.asarray(query) / np.linalg.norm(query))
+    return [f"id{i}" for i in np.argsort(-similarities)[:k]]
+
+def test_query_matches_exact_search(tmp_path, embeddings):
+    index = VectorIndex(str(tmp_path), "test-collection")
+    collection = MockCollection("v1", embeddings)
+    index.build(collection)
+
+    # 2500 rows are exported in pages
+    assert collection.get_calls == 4
+    query = embeddings[42]
+    results = index.query([query], n_results=5)
+    assert results["ids"][0] == brute_force(embeddings, query, 5)
+    assert results["ids"][0][0] == "id42"
+    assert results["documents"][0][0] == "doc42"
+    assert results["metadatas"][0][0] == {"row": 42}
+    assert results["distances"][0][0] == pytest.approx(0.0, abs=1e-5)
+    assert results["distances"][0] == sorted(results["distances"][0])
+
+def test_snapshot_is_memory_mapped_and_reloaded(tmp_path, embeddings):
+    VectorIndex(str(tmp_path), "test-collection").build(MockCollection("v1", embeddings))
+
+    index = VectorIndex(str(tmp_path), "test-collection")
+    assert index.load()
+    assert isinstance(index._snapshot.matrix, np.memmap)
+    assert index.version == "v1"
+    assert index.query([embeddings[7]], n_results=1)["ids"] == [["id7"]]
+
+def test_float16_snapshot(tmp_path, embeddings):
+    index = VectorIndex(str(tmp_path), "test-collection", dtype="float16")
+    index.build(MockCollection("v1", embeddings))
+    assert index._snapshot.matrix.dtype == np.float16
+    query = embeddings[1000]
+    assert index.query([query], n_results=3)["ids"][0][0] == "id1000"
+
+def test_freshness_and_rebuild(tmp_path, embeddings):
+    index = VectorIndex(str(tmp_path), "test-collection")
+    assert not index.load()
+    assert not index.is_fresh("v1")
+
+    index.build(MockCollection("v1", embeddings))
+    assert index.is_fresh("v1")
+    # Chroma not reached yet: the snapshot is served
+    assert index.is_fresh(None)
+    assert not index.is_fresh("v2")
+
+    index.build(MockCollection("v2", embeddings[:10]))
+    assert index.is_fresh("v2")
+    assert index.stats()["rows"] == 10
+    # The previous snapshot's matrix is removed
+    assert sorted(os.listdir(tmp_path)) == ["test-collection-v2.npy", "test-collection.json"]
+
+def test_disabled_index(tmp_path):
+    index = VectorIndex("", "test-collection")
+    assert not index.enabled
+    assert not index.load()
+    assert not index.is_fresh(None)
@@ -8,6 +8,8 @@ import hashlib
 import chromadb
 import pandas as pd
 from google.cloud import storage
+import vertexai
+from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
 
 # Langchain
 from langchain.text_splitter import CharacterTextSplitter
@@ -23,6 +25,35 @@ OUTPUT_FOLDER = "outputs"
 CHROMADB_HOST = os.environ["CHROMADB_HOST"]
 CHROMADB_PORT = 8000
 GCS_BUCKET_NAME = "bloodwise-embeddings"
+EMBEDDING_MODEL = "text-embedding-004"
+EMBEDDING_DIMENSION = 256
+# Chunks cached per biomarker and direction for uploaded blood tests
+MARKER_CONTEXT_CHUNKS = 3
+
+# Biomarkers of the api-service reference table (api-service/api/utils/biomarkers.py);
+# api-service/tests/test_biomarkers.py checks the two lists match
+biomarker_names = {
+	"WBC": "white blood cell count",
+	"LYMp": "lymphocytes percentage",
+	"MIDp": "mid-range white blood cells percentage",
+	"NEUTp": "neutrophils percentage",
+	"LYMn": "lymphocyte count",
+	"MIDn": "mid-range white blood cell count",
+	"NEUTn": "neutrophil count",
+	"RBC": "red blood cell count",
+	"HGB": "hemoglobin",
+	"HCT": "hematocrit",
+	"MCV": "mean corpuscular volume",
+	"MCH": "mean corpuscular hemoglobin",
+	"MCHC": "mean corpuscular hemoglobin concentration",
+	"RDWSD": "red cell distribution width (SD)",
+	"RDWCV": "red cell distribution width (CV)",
+	"PLT": "platelet count",
+	"MPV": "mean platelet volume",
+	"PDW": "platelet distribution width",
+	"PCT": "plateletcrit",
+	"PLCR": "platelet large cell ratio",
+}
 
 book_mappings = {
 	"Albumin: Importance, Testing, and What Abnormal Levels Mean": {"author":"Docus", "year": 2024},
@@ -129,6 +160,52 @@ def load(method="semantic-split"):
 		load_text_embeddings(data_df, collection)
 
 
+def generate_query_embeddings(queries, batch_size=250):
+	vertexai.init(project=GCP_PROJECT, location=GCP_LOCATION)
+	embedding_model = TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL)
+	embeddings = []
+	for i in range(0, len(queries), batch_size):
+		inputs = [TextEmbeddingInput(task_type='RETRIEVAL_DOCUMENT', text=query) for query in queries[i:i+batch_size]]
+		results = embedding_model.get_embeddings(inputs, output_dimensionality=EMBEDDING_DIMENSION)
+		embeddings.extend([result.values for result in results])
+	return embeddings
+
+
+def build_marker_context(method="semantic-split"):
+	print("build_marker_context()")
+
+	# Connect to chroma DB
+	client = chromadb.HttpClient(host=CHROMADB_HOST, port=CHROMADB_PORT)
+	collection = client.get_collection(name=f"{method}-collection")
+
+	# One query per biomarker and direction, answered from the knowledge base once
+	keys, queries = [], []
+	for marker, name in biomarker_names.items():
+		for direction in ["low", "high"]:
+			keys.append(f"{marker}:{direction}")
+			queries.append(f"What does a {direction} {name} ({marker}) in a blood test mean and what can cause it?")
+	embeddings = generate_query_embeddings(queries)
+	results = collection.query(query_embeddings=embeddings, n_results=MARKER_CONTEXT_CHUNKS)
+
+	# Store the chunks in a collection next to the knowledge base; the api-service
+	# reads it once per knowledge base version
+	context_collection_name = f"{method}-marker-context"
+	try:
+		client.delete_collection(name=context_collection_name)
+	except Exception:
+		pass
+	context_collection = client.create_collection(
+		name=context_collection_name, metadata={"hnsw:space": "cosine", "source": str(collection.id)}
+	)
+	context_collection.add(
+		ids=keys,
+		documents=[json.dumps(documents) for documents in results["documents"]],
+		metadatas=[{"marker": key.split(":")[0], "direction": key.split(":")[1]} for key in keys],
+		embeddings=embeddings
+	)
+	print(f"Cached context for {len(keys)} biomarker queries in collection '{context_collection_name}'")
+
+
 def main(args=None):
 	print("CLI Arguments:", args)
  
@@ -137,6 +214,10 @@ def main(args=None):
 
 	if args.load:
 		load()
+		build_marker_context()
+
+	if args.marker_context:
+		build_marker_context()
 
 
 if __name__ == "__main__":
@@ -156,6 +237,12 @@ if __name__ == "__main__":
 		help="Load embeddings to vector db",
 	)
 
+	parser.add_argument(
+		"--marker-context",
+		action="store_true",
+		help="Rebuild the per-biomarker context cache from the loaded collection",
+	)
+
 	args = parser.parse_args()
 
 	main(args)
\ No newline at end of file
@@ -6,7 +6,7 @@ import glob
 import os
 import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from cli import load
+from cli import load, build_marker_context
 
 # Mock folders
 INPUT_FOLDER = "test-input-datasets"
@@ -66,4 +66,33 @@ def test_load_semantic_split(mock_chromadb_client, mock_read_json, mock_glob, mo
     mock_client.create_collection.assert_called_once_with(
         name="semantic-split-collection", metadata={"hnsw:space": "cosine"}
     )
-    mock_collection.add.assert_called_once()  
\ No newline at end of file
+    mock_collection.add.assert_called_once()  
+
+@patch("cli.generate_query_embeddings")
+@patch("chromadb.HttpClient")
+def test_build_marker_context(mock_chromadb_client, mock_generate_query_embeddings):
+    # Arrange
+    mock_generate_query_embeddings.side_effect = lambda queries: [[0.1] * 256 for _ in queries]
+    mock_client = MagicMock()
+    mock_chromadb_client.return_value = mock_client
+    mock_collection = MagicMock()
+    mock_collection.id = "collection-id"
+    mock_collection.query.side_effect = lambda query_embeddings, n_results: {
+        "documents": [["chunk 1 text", "chunk 2 text"] for _ in query_embeddings]
+    }
+    mock_client.get_collection.return_value = mock_collection
+    mock_context_collection = MagicMock()
+    mock_client.create_collection.return_value = mock_context_collection
+
+    build_marker_context(method="semantic-split")
+
+    # Assert
+    # One query per biomarker and direction, sent in a single request
+    mock_collection.query.assert_called_once()
+    mock_client.create_collection.assert_called_once_with(
+        name="semantic-split-marker-context", metadata={"hnsw:space": "cosine", "source": "collection-id"}
+    )
+    added = mock_context_collection.add.call_args.kwargs
+    assert "HGB:low" in added["ids"]
+    assert len(added["ids"]) == 40
+    assert added["documents"][0] == '["chunk 1 text", "chunk 2 text"]'